@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+file_xfer.py - File transfer over the chat UART (used by pc_chat.py / pi_chat.py)
+
+Chat text and file blocks share the same serial line:
+  * chat text is sent as-is (UTF-8 lines, never contains a 0x00 byte)
+  * transfer frames are COBS-encoded and wrapped in 0x00 delimiters, so a
+    corrupted frame only costs that frame and the stream re-syncs on the
+    next 0x00
+
+Frames (after COBS): type byte + body + CRC32 of both.
+  O OFFER   id, size, block size, flags, file CRC32, name
+  A ACCEPT  id, first missing block, zlib(bitmap of blocks already held)  -> resume
+  D DATA    id, block number, flags (zlib), data
+  S SACK    id, first missing block, bitmap of the next 64 blocks
+  K DONE    id, status (0 = whole-file CRC ok)
+  C CANCEL  id
+
+The sender keeps up to WINDOW blocks in flight and only resends blocks
+the receiver reports missing (selective repeat): at once when a later
+block has been acked, or after a timeout. Blocks are compressed one by
+one when that makes them smaller. The receiver writes into <name>.part
+and keeps the block bitmap in <name>.part.json, so an interrupted
+transfer picks up where it stopped when the same file is offered again.
+
+Self-test over a pty pair with a line-rate-paced bridge that flips bits:
+  python3 file_xfer.py --selftest --baud 115200 --ber 1e-5 --size 300000
+"""
+
+import argparse
+import json
+import os
+import random
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+# --- CONFIGURATION ---
+BLOCK_SIZE = 512         # Payload bytes per DATA frame (before compression)
+WINDOW = 32              # Blocks in flight (max 64: the SACK bitmap size)
+RECEIVE_DIR = "received"
+OFFER_TRIES = 10         # OFFERs sent (1 s apart) before giving up
+MAX_BLOCK_RETRIES = 30   # Timeouts on one block before giving up
+STATE_SAVE_INTERVAL = 1.0
+PROGRESS_INTERVAL = 0.25
+
+F_ZLIB = 0x01
+
+OFFER = struct.Struct(">HQHBI")
+ACCEPT = struct.Struct(">HI")
+DATA = struct.Struct(">HIB")
+SACK = struct.Struct(">HIQ")
+DONE = struct.Struct(">HB")
+CANCEL = struct.Struct(">H")
+
+
+# --- FRAMING ---
+def cobs_encode(data: bytes) -> bytes:
+    out = bytearray()
+    for seg in data.split(b"\0"):
+        while len(seg) >= 254:
+            out.append(0xFF)
+            out += seg[:254]
+            seg = seg[254:]
+        out.append(len(seg) + 1)
+        out += seg
+    return bytes(out)
+
+
+def cobs_decode(data: bytes) -> bytes:
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        code = data[i]
+        i += 1
+        if code == 0 or i + code - 1 > n:
+            raise ValueError("bad COBS block")
+        out += data[i:i + code - 1]
+        i += code - 1
+        if code < 0xFF and i < n:
+            out.append(0)
+    return bytes(out)
+
+
+def make_frame(kind: bytes, body: bytes) -> bytes:
+    payload = kind + body
+    return b"\0" + cobs_encode(payload + zlib.crc32(payload).to_bytes(4, "big")) + b"\0"
+
+
+def parse_frame(raw: bytes):
+    """(kind, body) or None if the frame is damaged."""
+    try:
+        payload = cobs_decode(raw)
+    except ValueError:
+        return None
+    if len(payload) < 5 or zlib.crc32(payload[:-4]) != int.from_bytes(payload[-4:], "big"):
+        return None
+    return payload[:1], payload[1:-4]
+
+
+def pack_bits(flags) -> bytes:
+    out = bytearray((len(flags) + 7) // 8)
+    for i, f in enumerate(flags):
+        if f:
+            out[i >> 3] |= 1 << (i & 7)
+    return bytes(out)
+
+
+def file_crc(path: str) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class Progress:
+    """Throttled one-line progress display."""
+
+    def __init__(self, label: str, total: int, enabled: bool = True):
+        self.label, self.total, self.enabled = label, total, enabled
+        self.t0 = time.monotonic()
+        self.last = 0.0
+
+    def show(self, done_bytes: int, extra: str = "", force: bool = False) -> None:
+        now = time.monotonic()
+        if not self.enabled or (not force and now - self.last < PROGRESS_INTERVAL):
+            return
+        self.last = now
+        pct = 100 * done_bytes / self.total if self.total else 100
+        rate = done_bytes / max(now - self.t0, 1e-6)
+        print(f"\r[XFER] {self.label} {pct:5.1f}%  {rate / 1e3:6.1f} kB/s {extra}   ", end="", flush=True)
+
+
+# --- SENDER ---
+class Sender:
+    def __init__(self, link, path: str, compress: bool, block_size: int, window: int):
+        self.link = link
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.bs = block_size
+        self.window = min(window, 64)
+        self.compress = compress
+        self.nblocks = -(-self.size // block_size)
+        self.xid = random.randrange(1, 0x10000)
+        self.acked = bytearray(self.nblocks)
+        self.ever_sent = bytearray(self.nblocks)
+        self.base = 0
+        self.sent_at = {}          # block -> monotonic time of the last send
+        self.timeouts = {}         # block -> timeouts so far
+        self.cond = threading.Condition()
+        self.accepted = None       # None until ACCEPT; then number of blocks already there
+        self.result = None         # DONE status, or 'cancelled'
+        self.frames_sent = 0
+        self.retransmits = 0
+        self.wire_bytes = 0
+
+    # Called from the link's reader thread
+    def on_frame(self, kind: bytes, body: bytes) -> None:
+        with self.cond:
+            if kind == b"A" and self.accepted is None:
+                _, base = ACCEPT.unpack_from(body)
+                have = zlib.decompress(body[ACCEPT.size:]) if len(body) > ACCEPT.size else b""
+                for i in range(min(base, self.nblocks)):
+                    self.acked[i] = 1
+                for i in range(base, self.nblocks):
+                    j = i - base
+                    if j >> 3 < len(have) and have[j >> 3] >> (j & 7) & 1:
+                        self.acked[i] = 1
+                self.accepted = sum(self.acked)
+                self._advance()
+            elif kind == b"S":
+                _, base, bits = SACK.unpack_from(body)
+                for i in range(self.base, min(base, self.nblocks)):
+                    self.acked[i] = 1
+                top = None
+                for j in range(64):
+                    if bits >> j & 1 and base + 1 + j < self.nblocks:
+                        self.acked[base + 1 + j] = 1
+                        top = base + 1 + j
+                # Selective repeat: anything still missing that went out before
+                # a block that did arrive was lost -> resend now, not at timeout
+                if top is not None and top in self.sent_at:
+                    for i in range(base, top):
+                        if not self.acked[i] and self.sent_at.get(i, 0) < self.sent_at[top]:
+                            self.sent_at.pop(i, None)
+                self._advance()
+            elif kind == b"K":
+                self.result = DONE.unpack_from(body)[1]
+            elif kind == b"C":
+                self.result = "cancelled"
+            self.cond.notify_all()
+
+    def _advance(self) -> None:
+        while self.base < self.nblocks and self.acked[self.base]:
+            self.base += 1
+
+    def _block(self, f, seq: int) -> bytes:
+        f.seek(seq * self.bs)
+        raw = f.read(self.bs)
+        flags = 0
+        if self.compress:
+            packed = zlib.compress(raw, 6)
+            if len(packed) < len(raw):
+                raw, flags = packed, F_ZLIB
+        return make_frame(b"D", DATA.pack(self.xid, seq, flags) + raw)
+
+    def _rto(self) -> float:
+        # A full window queued in the UART + the SACK back, with margin
+        frame_s = (self.bs + 16) * 10 / self.link.baud
+        return 2 * self.window * frame_s + 0.5
+
+    def run(self, progress: bool = True) -> bool:
+        crc = file_crc(self.path)
+        flags = F_ZLIB if self.compress else 0
+        offer = make_frame(b"O", OFFER.pack(self.xid, self.size, self.bs, flags, crc) + self.name.encode())
+        self.link.senders[self.xid] = self
+        try:
+            with self.cond:
+                for _ in range(OFFER_TRIES):
+                    self.link.write(offer)
+                    if self.cond.wait_for(lambda: self.accepted is not None or self.result, 1.0):
+                        break
+            if self.result == "cancelled" or self.accepted is None:
+                print(f"\n[XFER] {self.name}: no answer from the other side" if self.accepted is None
+                      else f"\n[XFER] {self.name}: cancelled")
+                return False
+            if self.accepted:
+                print(f"[XFER] {self.name}: resuming, {self.accepted}/{self.nblocks} blocks already there")
+            return self._stream(progress)
+        finally:
+            self.link.senders.pop(self.xid, None)
+
+    def _stream(self, progress: bool) -> bool:
+        bar = Progress(f"-> {self.name}", self.size, progress)
+        t0 = time.monotonic()
+        rto = self._rto()
+        done_probe = 0.0
+        with open(self.path, "rb") as f:
+            while True:
+                with self.cond:
+                    if self.result is not None:
+                        break
+                    now = time.monotonic()
+                    if self.base >= self.nblocks:
+                        # All acked: wait for the receiver's CRC verdict
+                        if now - done_probe > rto:
+                            done_probe = now
+                            if self.nblocks:
+                                self.sent_at.pop(self.nblocks - 1, None)
+                                to_send = [self.nblocks - 1]  # Any DATA makes it repeat DONE
+                            else:
+                                to_send = []
+                                self.link.write(make_frame(b"S", SACK.pack(self.xid, 0, 0)))
+                        else:
+                            self.cond.wait(0.1)
+                            continue
+                    else:
+                        to_send = []
+                        for seq in range(self.base, min(self.base + self.window, self.nblocks)):
+                            if self.acked[seq]:
+                                continue
+                            t = self.sent_at.get(seq)
+                            if t is None or now - t > rto:
+                                if t is not None:
+                                    self.timeouts[seq] = self.timeouts.get(seq, 0) + 1
+                                    if self.timeouts[seq] > MAX_BLOCK_RETRIES:
+                                        print(f"\n[XFER] {self.name}: block {seq} keeps getting lost, giving up")
+                                        self.link.write(make_frame(b"C", CANCEL.pack(self.xid)))
+                                        return False
+                                to_send.append(seq)
+                        if not to_send:
+                            self.cond.wait(0.05)
+                            continue
+                for seq in to_send:
+                    frame = self._block(f, seq)
+                    with self.cond:
+                        if self.ever_sent[seq]:
+                            self.retransmits += 1
+                        self.ever_sent[seq] = 1
+                        self.sent_at[seq] = time.monotonic()
+                    self.link.write(frame)
+                    self.frames_sent += 1
+                    self.wire_bytes += len(frame)
+                bar.show(sum(self.acked) * self.bs, f"retx {self.retransmits}")
+
+        elapsed = time.monotonic() - t0
+        bar.show(self.size, f"retx {self.retransmits}", force=True)
+        print()
+        if self.result != 0:
+            print(f"[XFER] {self.name}: FAILED ({'cancelled' if self.result == 'cancelled' else 'CRC mismatch'})")
+            return False
+        sent = (self.nblocks - self.accepted) * self.bs
+        print(f"[XFER] {self.name}: {self.size} bytes OK in {elapsed:.1f} s "
+              f"({min(sent, self.size) / max(elapsed, 1e-6) / 1e3:.1f} kB/s file data, "
+              f"{self.wire_bytes / max(elapsed, 1e-6) / (self.link.baud / 10) * 100:.0f}% of line rate, "
+              f"{self.retransmits} retransmits)")
+        return True
+
+
+# --- RECEIVER ---
+class Receiver:
+    def __init__(self, link, xid: int, size: int, bs: int, crc: int, name: str, recv_dir: str):
+        self.link = link
+        self.xid, self.size, self.bs, self.crc = xid, size, bs, crc
+        self.name = os.path.basename(name) or "unnamed"
+        self.final = os.path.join(recv_dir, self.name)
+        self.part = self.final + ".part"
+        self.state_path = self.part + ".json"
+        self.nblocks = -(-size // bs)
+        self.have = bytearray(self.nblocks)
+        self.base = 0
+        self.last_save = 0.0
+        self.done = False
+        os.makedirs(recv_dir, exist_ok=True)
+
+        state = self._load_state()
+        if state:
+            bits = bytes.fromhex(state["have"])
+            for i in range(self.nblocks):
+                if bits[i >> 3] >> (i & 7) & 1:
+                    self.have[i] = 1
+            self._advance()
+        else:
+            with open(self.part, "wb"):
+                pass
+        self.f = open(self.part, "r+b")
+        self.bar = Progress(f"<- {self.name}", size, link.progress)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        same = (state.get("size"), state.get("crc"), state.get("block_size")) == (self.size, self.crc, self.bs)
+        return state if same and os.path.exists(self.part) else None
+
+    def _save_state(self) -> None:
+        self.f.flush()  # Data first, then the bitmap that claims it
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"size": self.size, "crc": self.crc, "block_size": self.bs,
+                       "have": pack_bits(self.have).hex()}, f)
+        os.replace(tmp, self.state_path)
+        self.last_save = time.monotonic()
+
+    def _advance(self) -> None:
+        while self.base < self.nblocks and self.have[self.base]:
+            self.base += 1
+
+    def accept_frame(self) -> bytes:
+        rest = pack_bits(self.have[self.base:])
+        return make_frame(b"A", ACCEPT.pack(self.xid, self.base) + zlib.compress(rest))
+
+    def sack_frame(self) -> bytes:
+        bits = 0
+        for j in range(64):
+            i = self.base + 1 + j
+            if i >= self.nblocks:
+                break
+            if self.have[i]:
+                bits |= 1 << j
+        return make_frame(b"S", SACK.pack(self.xid, self.base, bits))
+
+    def on_data(self, seq: int, flags: int, data: bytes) -> None:
+        if seq >= self.nblocks:
+            return
+        if not self.have[seq]:
+            if flags & F_ZLIB:
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error:
+                    return  # CRC passed but the block is bogus: let it be resent
+            expect = min(self.bs, self.size - seq * self.bs)
+            if len(data) != expect:
+                return
+            self.f.seek(seq * self.bs)
+            self.f.write(data)
+            self.have[seq] = 1
+            self._advance()
+            if time.monotonic() - self.last_save > STATE_SAVE_INTERVAL:
+                self._save_state()
+        self.link.write(self.sack_frame())
+        self.bar.show(sum(self.have) * self.bs)
+
+    def finish(self) -> int:
+        """All blocks in: check the whole-file CRC and move it into place."""
+        self.f.close()
+        ok = file_crc(self.part) == self.crc
+        if ok:
+            os.replace(self.part, self.final)
+        else:
+            os.remove(self.part)  # Start from scratch next time
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.done = True
+        self.bar.show(self.size, force=True)
+        print(f"\n[XFER] {'Received ' + self.final if ok else self.name + ': CRC mismatch, discarded'}")
+        return 0 if ok else 1
+
+    def close(self) -> None:
+        if not self.done:
+            self._save_state()
+            self.f.close()
+
+
+# --- LINK ---
+class FrameLink:
+    """Owns the serial port: one reader thread splitting chat text from frames."""
+
+    def __init__(self, ser, on_text, recv_dir: str = RECEIVE_DIR, progress: bool = True):
+        self.ser = ser
+        self.baud = getattr(ser, "baudrate", 9600) or 9600
+        self.on_text = on_text
+        self.recv_dir = recv_dir
+        self.progress = progress
+        self.wlock = threading.Lock()
+        self.in_frame = False
+        self.frame = bytearray()
+        self.text = bytearray()
+        self.senders = {}       # id -> Sender (ours, outgoing)
+        self.receivers = {}     # id -> Receiver (incoming)
+        self.finished = {}      # id -> DONE status, to answer repeats
+        self.running = True
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+
+    def start(self) -> "FrameLink":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        for r in list(self.receivers.values()):
+            r.close()
+
+    def write(self, data: bytes) -> None:
+        with self.wlock:
+            self.ser.write(data)
+
+    def send_text(self, text: str) -> None:
+        self.write(text.encode("utf-8"))
+
+    def send_file(self, path: str, compress: bool = True, block_size: int = BLOCK_SIZE,
+                  window: int = WINDOW) -> bool:
+        """Blocking; run it in a thread to keep chatting meanwhile."""
+        if not os.path.isfile(path):
+            print(f"[XFER] No such file: {path}")
+            return False
+        return Sender(self, path, compress, block_size, window).run(self.progress)
+
+    def cancel(self) -> None:
+        for xid, s in list(self.senders.items()):
+            self.write(make_frame(b"C", CANCEL.pack(xid)))
+            s.on_frame(b"C", b"")
+        for xid, r in list(self.receivers.items()):
+            self.write(make_frame(b"C", CANCEL.pack(xid)))
+            r.close()
+            del self.receivers[xid]
+
+    # --- READING ---
+    def _reader(self) -> None:
+        while self.running:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except Exception as e:
+                if self.running:
+                    print(f"Read Error: {e}")
+                break
+            if data:
+                self.feed(data)
+            else:
+                self._flush_text(force=True)  # Line went quiet: show a message without newline too
+
+    def feed(self, data: bytes) -> None:
+        while data:
+            z = data.find(0)
+            if z < 0:
+                (self.frame if self.in_frame else self.text).extend(data)
+                break
+            part, data = data[:z], data[z + 1:]
+            if self.in_frame:
+                self.frame += part
+                if self.frame:
+                    frame = parse_frame(bytes(self.frame))
+                    self.frame.clear()
+                    self.in_frame = False
+                    if frame:
+                        self._on_frame(*frame)
+                # Empty frame (00 00): that was an end + start, stay in frame mode
+            else:
+                self.text += part
+                self._flush_text(force=True)
+                self.in_frame = True
+        if len(self.frame) > 4 * 65536:
+            self.frame.clear()  # Lost a delimiter in a long run of noise
+        self._flush_text()
+
+    def _flush_text(self, force: bool = False) -> None:
+        """Passes complete lines (or everything, if force) to on_text."""
+        end = len(self.text) if force else self.text.rfind(b"\n") + 1
+        if not end:
+            return
+        raw, self.text = bytes(self.text[:end]), self.text[end:]
+        if self.senders or self.receivers:
+            # Mid-transfer, a frame that lost its delimiter shows up here:
+            # only pass on what is clearly text
+            try:
+                text = raw.decode("utf-8")
+            except UnicodeDecodeError:
+                return
+        else:
+            text = raw.decode("utf-8", errors="replace")
+        if text.strip():
+            self.on_text(text.strip())
+
+    def _on_frame(self, kind: bytes, body: bytes) -> None:
+        if len(body) < 2:
+            return
+        xid = int.from_bytes(body[:2], "big")
+        if kind in b"AKS" and xid in self.senders and (kind != b"S" or len(body) >= SACK.size):
+            self.senders[xid].on_frame(kind, body)
+        elif kind == b"O" and len(body) >= OFFER.size:
+            self._on_offer(body)
+        elif kind == b"D" and len(body) >= DATA.size:
+            _, seq, flags = DATA.unpack_from(body)
+            r = self.receivers.get(xid)
+            if r is not None:
+                r.on_data(seq, flags, body[DATA.size:])
+                if r.base >= r.nblocks:
+                    self._finish(r)
+            elif xid in self.finished:
+                self.write(make_frame(b"K", DONE.pack(xid, self.finished[xid])))
+        elif kind == b"S" and xid in self.receivers:
+            r = self.receivers[xid]  # Empty file probe
+            if r.base >= r.nblocks:
+                self._finish(r)
+        elif kind == b"C":
+            if xid in self.senders:
+                self.senders[xid].on_frame(kind, body)
+            r = self.receivers.pop(xid, None)
+            if r:
+                r.close()
+                print(f"\n[XFER] {r.name}: cancelled by the other side (kept for resume)")
+
+    def _on_offer(self, body: bytes) -> None:
+        xid, size, bs, flags, crc = OFFER.unpack_from(body)
+        if xid in self.finished:
+            self.write(make_frame(b"K", DONE.pack(xid, self.finished[xid])))
+            return
+        r = self.receivers.get(xid)
+        if r is None:
+            name = body[OFFER.size:].decode("utf-8", errors="replace")
+            r = Receiver(self, xid, size, bs, crc, name, self.recv_dir)
+            self.receivers[xid] = r
+            held = sum(r.have)
+            print(f"\n[XFER] Receiving {r.name} ({size} bytes)" +
+                  (f", resuming with {held}/{r.nblocks} blocks" if held else ""))
+        self.write(r.accept_frame())
+        if r.base >= r.nblocks:
+            self._finish(r)
+
+    def _finish(self, r: Receiver) -> None:
+        status = r.finish()
+        self.finished[r.xid] = status
+        self.receivers.pop(r.xid, None)
+        self.write(make_frame(b"K", DONE.pack(r.xid, status)))
+
+
+# --- CHAT COMMANDS ---
+CHAT_HELP = "Commands: /send <file> [--raw]   /cancel   (received files go to ./" + RECEIVE_DIR + ")"
+
+
+def handle_chat_command(link: FrameLink, msg: str) -> bool:
+    """Runs /send and /cancel typed in the chat. Returns True if msg was one."""
+    if msg.startswith("/send "):
+        args = msg[6:].split()
+        compress = "--raw" not in args
+        path = " ".join(a for a in args if a != "--raw")
+        threading.Thread(target=link.send_file, args=(path, compress), daemon=True).start()
+        return True
+    if msg.strip() == "/cancel":
+        link.cancel()
+        return True
+    return False
+
+
+# --- SELF-TEST (pty pair + noisy bridge) ---
+def bridge(fd_a: int, fd_b: int, baud: int, ber: float, stats: dict, stop: threading.Event) -> None:
+    """Copies bytes between two pty masters at line rate, flipping bits at `ber`."""
+    byte_time = 10 / baud
+    busy_until = {fd_a: 0.0, fd_b: 0.0}
+    rng = random.Random(42)
+    next_flip = {fd_a: 0, fd_b: 0}
+    for fd in next_flip:
+        next_flip[fd] = int(rng.expovariate(ber)) if ber else -1
+    while not stop.is_set():
+        ready, _, _ = select.select([fd_a, fd_b], [], [], 0.1)
+        for src in ready:
+            dst = fd_b if src == fd_a else fd_a
+            try:
+                data = bytearray(os.read(src, 4096))
+            except OSError:
+                return
+            if next_flip[src] >= 0:
+                # Bits until the next error are drawn from an exponential distribution
+                bit = next_flip[src]
+                while bit < len(data) * 8:
+                    data[bit >> 3] ^= 1 << (bit & 7)
+                    stats["flips"] += 1
+                    bit += 1 + int(rng.expovariate(ber))
+                next_flip[src] = bit - len(data) * 8
+            # Pace like a real UART: the bytes leave no faster than baud/10
+            now = time.monotonic()
+            busy_until[src] = max(busy_until[src], now) + len(data) * byte_time
+            if busy_until[src] > now:
+                time.sleep(busy_until[src] - now)
+            os.write(dst, bytes(data))
+
+
+def make_test_file(path: str, size: int) -> None:
+    rng = random.Random(7)
+    out = bytearray()
+    while len(out) < size:
+        if rng.random() < 0.5:
+            out += f"{time.time():.3f},sensor,{rng.randint(0, 1023)},ok\n".encode() * 20
+        else:
+            out += rng.randbytes(1024)
+    with open(path, "wb") as f:
+        f.write(out[:size])
+
+
+def selftest(baud: int, ber: float, size: int, compress: bool) -> int:
+    import pty
+    import serial
+
+    tmp = tempfile.mkdtemp(prefix="xfer_")
+    src = os.path.join(tmp, "payload.bin")
+    make_test_file(src, size)
+    m_a, s_a = pty.openpty()
+    m_b, s_b = pty.openpty()
+    stats = {"flips": 0}
+    stop = threading.Event()
+    threading.Thread(target=bridge, args=(m_a, m_b, baud, ber, stats, stop), daemon=True).start()
+
+    ser_a = serial.Serial(os.ttyname(s_a), baud, timeout=0.2)
+    ser_b = serial.Serial(os.ttyname(s_b), baud, timeout=0.2)
+    chat = []
+    a = FrameLink(ser_a, chat.append, recv_dir=os.path.join(tmp, "a"), progress=False).start()
+    b = FrameLink(ser_b, chat.append, recv_dir=os.path.join(tmp, "b"), progress=False).start()
+    print(f"Self-test: {size} bytes at {baud} baud (line rate {baud / 10 / 1e3:.1f} kB/s), "
+          f"bit error rate {ber:g}, compression {'on' if compress else 'off'}")
+
+    ok = True
+    try:
+        # 1. Interrupted transfer: cancel on the sender side part-way through
+        a.send_text("hello before the transfer\n")
+        t = threading.Thread(target=a.send_file, args=(src, compress), daemon=True)
+        t.start()
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            r = next(iter(b.receivers.values()), None)
+            if r is not None and sum(r.have) > r.nblocks * 0.4:
+                break
+            time.sleep(0.01)
+        a.cancel()
+        t.join(10)
+        time.sleep(0.5)
+
+        # 2. Offer it again: the receiver resumes from its .part/.json
+        ok = a.send_file(src, compress) and ok
+        dst = os.path.join(tmp, "b", "payload.bin")
+        with open(src, "rb") as f1, open(dst, "rb") as f2:
+            same = f1.read() == f2.read()
+        print(f"Chat text seen: {chat}")
+        print(f"Bits flipped on the wire: {stats['flips']}")
+        print("✅ SELFTEST PASS" if ok and same else "❌ SELFTEST FAIL")
+        return 0 if ok and same else 1
+    except FileNotFoundError:
+        print("❌ SELFTEST FAIL: file never arrived")
+        return 1
+    finally:
+        stop.set()
+        a.stop()
+        b.stop()
+        ser_a.close()
+        ser_b.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--selftest", action="store_true", help="Transfer a file across a noisy pty pair")
+    ap.add_argument("--baud", type=int, default=115200, help="Line rate the bridge emulates (default: 115200)")
+    ap.add_argument("--ber", type=float, default=1e-5, help="Bit error rate injected by the bridge (default: 1e-5)")
+    ap.add_argument("--size", type=int, default=300_000, help="Test file size in bytes (default: 300000)")
+    ap.add_argument("--raw", action="store_true", help="Disable per-block compression")
+    args = ap.parse_args()
+    if args.selftest:
+        sys.exit(selftest(args.baud, args.ber, args.size, not args.raw))
+    print(__doc__)
@@ -7,11 +7,33 @@ app = Flask(__name__)
 # --- CONFIGURATION ---
 UART_PORT = '/dev/ttyUSB0'  # <--- CHANGE THIS
 BAUD_RATE = 9600
+# Reply timeout follows the measured round trip (RFC 6298: SRTT + 4 * RTTVAR),
+# starting at 1 s and kept between these bounds
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 5.0
+
+# --- ROUND TRIP ESTIMATE ---
+srtt = None
+rttvar = None
+reply_timeout = 1.0
+
+def rtt_sample(r):
+    global srtt, rttvar, reply_timeout
+    if srtt is None:
+        srtt, rttvar = r, r / 2
+    else:
+        rttvar = 0.75 * rttvar + 0.25 * abs(srtt - r)
+        srtt = 0.875 * srtt + 0.125 * r
+    reply_timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, srtt + 4 * rttvar))
+
+def rtt_backoff():
+    global reply_timeout
+    reply_timeout = min(MAX_TIMEOUT, reply_timeout * 2)
 
 # --- SERIAL CONNECTION ---
 try:
-    ser = serial.Serial(UART_PORT, BAUD_RATE, timeout=2)
-    time.sleep(2) # Wait for connection to settle
+    ser = serial.Serial(UART_PORT, BAUD_RATE, timeout=reply_timeout)
+    time.sleep(0.1) # Let the adapter's lines settle (the Pi doesn't reset on open)
     ser.reset_input_buffer()
     print(f"✅ Connected to {UART_PORT}")
 except Exception as e:
@@ -54,7 +76,8 @@ HTML_PAGE = """
             .then(response => response.json())
             .then(data => {
                 // Update text with response from Pi
-                document.getElementById('status').innerText = "Status: " + data.reply;
+                var link = data.rtt_ms === null ? "" : " (RTT " + data.rtt_ms + " ms, timeout " + data.timeout_ms + " ms)";
+                document.getElementById('status').innerText = "Status: " + data.reply + link;
             })
             .catch(error => {
                 document.getElementById('status').innerText = "Status: Error communicating";
@@ -80,19 +103,27 @@ def control_led():
 
     # 1. Send Command to Pi
     print(f"Sending to Pi: {command}")
+    ser.reset_input_buffer()  # Drop a reply that came in after an earlier timeout
+    ser.timeout = reply_timeout
+    sent_at = time.monotonic()
     ser.write((command + "\n").encode('utf-8'))
     
     # 2. Wait for Reply from Pi
     # We strip whitespace so we get clean text like "LED is ON"
     response = ser.readline().decode('utf-8').strip()
     
-    if not response:
-        response = "No response from Pi"
+    if response:
+        rtt_sample(time.monotonic() - sent_at)
+    else:
+        response = f"No response from Pi within {ser.timeout * 1000:.0f} ms"
+        rtt_backoff()
 
     print(f"Reply from Pi: {response}")
     
     # 3. Send Reply to Frontend
-    return jsonify({'reply': response})
+    return jsonify({'reply': response,
+                    'rtt_ms': None if srtt is None else round(srtt * 1000, 1),
+                    'timeout_ms': round(reply_timeout * 1000)})
 
 if __name__ == '__main__':
     # Run server on localhost:5000
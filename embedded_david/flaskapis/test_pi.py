@@ -13,6 +13,21 @@ LED_PIN = 18
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(LED_PIN, GPIO.OUT)
 
+# --- COMMANDS ---
+def led_on():
+    GPIO.output(LED_PIN, GPIO.HIGH)
+    return "LED is now ON"
+
+def led_off():
+    GPIO.output(LED_PIN, GPIO.LOW)
+    return "LED is now OFF"
+
+# Command -> handler returning the reply; one dict lookup per line
+COMMANDS = {
+    "LED_ON": led_on,
+    "LED_OFF": led_off,
+}
+
 try:
     ser = serial.Serial(UART_PORT, BAUD_RATE, timeout=1)
     ser.reset_input_buffer()
@@ -30,14 +45,8 @@ try:
             print(f"📩 Received: {command}")
 
             # 2. Execute Hardware Action
-            if command == "LED_ON":
-                GPIO.output(LED_PIN, GPIO.HIGH)
-                reply = "LED is now ON"
-            elif command == "LED_OFF":
-                GPIO.output(LED_PIN, GPIO.LOW)
-                reply = "LED is now OFF"
-            else:
-                reply = f"Unknown command: {command}"
+            handler = COMMANDS.get(command)
+            reply = handler() if handler else f"Unknown command: {command}"
 
             # 3. Send Confirmation back to Flask
             print(f"📤 Replying: {reply}")
@@ -1,50 +1,47 @@
 import serial
-import threading
 import sys
-import time
+
+import file_xfer
 
 # --- CONFIGURATION ---
 PORT = '/dev/serial0'
 BAUD = 9600
+# While main_listener.py owns the UART with UART_MUX on, use its 'chat' channel:
+# PORT = 'socket://localhost:5760'
 
 try:
-    ser = serial.Serial(PORT, BAUD, timeout=1)
+    ser = serial.serial_for_url(PORT, BAUD, timeout=1)
+    if PORT.startswith('socket://'):
+        ser.write(b"OPEN chat\n")  # uart_mux.ChannelServer: pick our channel
     ser.flush()
     print(f"✅ Pi Connected to {PORT}")
 except Exception as e:
     print(f"❌ Error opening port: {e}")
     sys.exit()
 
-def listen_for_data():
-    while True:
-        try:
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting)
-                text = data.decode('utf-8', errors='replace').strip()
-                if text:
-                    print(f"\n[FROM PC]: {text}")
-                    print("You: ", end="", flush=True)
-            time.sleep(0.1)
-        except Exception as e:
-            print(f"Read Error: {e}")
-            break
+def show_message(text):
+    print(f"\n[FROM PC]: {text}")
+    print("You: ", end="", flush=True)
 
-# Start Listener in Background
-t = threading.Thread(target=listen_for_data, daemon=True)
-t.start()
+# Start Listener in Background (chat text + file transfers share the port)
+link = file_xfer.FrameLink(ser, show_message).start()
 
 # Main Sender Loop
 try:
     print("--- CHAT STARTED ---")
     print("Type message and press ENTER.")
+    print(file_xfer.CHAT_HELP)
     print("You: ", end="", flush=True)
     
     while True:
         msg = input()
+        if msg and file_xfer.handle_chat_command(link, msg):
+            continue
         if msg:
             full_msg = msg + "\n"
-            ser.write(full_msg.encode('utf-8'))
+            link.send_text(full_msg)
 
 except KeyboardInterrupt:
     print("\nClosing connection...")
+    link.stop()  # Keeps partial incoming files resumable
     ser.close()
@@ -11,6 +11,21 @@ GPIO.setmode(GPIO.BCM)
 GPIO.setup(LED_PIN, GPIO.OUT)
 GPIO.setwarnings(False)
 
+# --- COMMANDS ---
+def led_on():
+    GPIO.output(LED_PIN, GPIO.HIGH)
+    print("Command: ON  | Status: LED turned ON")
+
+def led_off():
+    GPIO.output(LED_PIN, GPIO.LOW)
+    print("Command: OFF | Status: LED turned OFF")
+
+# One dict lookup per line; add a command by adding an entry
+COMMANDS = {
+    'on': led_on,
+    'off': led_off,
+}
+
 try:
     # Open the serial port on the Pi
     ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
@@ -21,15 +36,9 @@ try:
         if ser.in_waiting > 0:
             # Read the incoming command
             data = ser.readline().decode('utf-8').strip()
-            
-            if data == 'on':
-                GPIO.output(LED_PIN, GPIO.HIGH)
-                print("Command: ON  | Status: LED turned ON")
-                
-            elif data == 'off':
-                GPIO.output(LED_PIN, GPIO.LOW)
-                print("Command: OFF | Status: LED turned OFF")
-                
+            handler = COMMANDS.get(data)
+            if handler:
+                handler()
             else:
                 print(f"Received unknown data: {data}")
 
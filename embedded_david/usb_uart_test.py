@@ -9,11 +9,19 @@ Usage examples:
   python3 usb_uart_test.py --list
   python3 usb_uart_test.py -p COM5 -b 115200
   python3 usb_uart_test.py -p /dev/ttyUSB0 -b 115200 --interactive
+  python3 usb_uart_test.py -p /dev/ttyUSB0 -b 921600 --bench --duration 10 --json out.json
+  python3 usb_uart_test.py --all --match 0403:6001 --duration 3     # whole rack at once
 """
 
 import argparse
+import json
+import random
+import statistics
 import sys
+import threading
 import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 
 import serial
 from serial.tools import list_ports
@@ -33,29 +41,67 @@ def list_serial_ports() -> None:
         print(f"  {p.device:15}  {p.description}  [{p.hwid}]")
 
 
-def open_port(port: str, baud: int, timeout: float) -> serial.Serial:
+def match_ports(vidpids=(), desc=None) -> list:
+    """comports() filtered by VID[:PID] (hex, any of vidpids) and description substring."""
+    out = []
+    for p in sorted(list_ports.comports(), key=lambda p: p.device):
+        if vidpids:
+            if p.vid is None:
+                continue
+            ids = f"{p.vid:04X}:{p.pid or 0:04X}"
+            if not any(ids.startswith(v.upper()) for v in vidpids):
+                continue
+        if desc and desc.lower() not in (p.description or "").lower():
+            continue
+        out.append(p)
+    return out
+
+
+def connect(port: str, baud: int, timeout: float, settle: float = 0.1) -> serial.Serial:
+    """Opens and flushes the port; raises serial.SerialException on failure."""
+    ser = serial.Serial(
+        port=port,
+        baudrate=baud,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=timeout,       # read timeout (seconds)
+        write_timeout=timeout  # write timeout (seconds)
+    )
+    # Small settling time for some USB-UART chips after open
+    time.sleep(settle)
+    # Flush buffers
+    ser.reset_input_buffer()
+    ser.reset_output_buffer()
+    return ser
+
+
+def open_port(port: str, baud: int, timeout: float, settle: float = 0.1) -> serial.Serial:
     try:
-        ser = serial.Serial(
-            port=port,
-            baudrate=baud,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=timeout,       # read timeout (seconds)
-            write_timeout=timeout  # write timeout (seconds)
-        )
-        # Small settling time for some USB-UART chips after open
-        time.sleep(0.1)
-        # Flush buffers
-        ser.reset_input_buffer()
-        ser.reset_output_buffer()
-        return ser
+        return connect(port, baud, timeout, settle)
     except serial.SerialException as e:
         raise SystemExit(f"Failed to open {port}: {e}") from e
 
 
 def hexdump(b: bytes) -> str:
-    return " ".join(f"{x:02X}" for x in b)
+    return bytes(b).hex(" ").upper()
+
+
+def echo(ser: serial.Serial, payload: bytes, read_timeout: float) -> bytes:
+    """Writes payload and reads back up to len(payload) bytes within read_timeout."""
+    written = ser.write(payload)
+    ser.flush()
+    if written != len(payload):
+        print(f"WARNING: {ser.port}: wrote {written}/{len(payload)} bytes")
+
+    # Read back up to payload length (loopback) within a deadline
+    deadline = time.time() + read_timeout
+    buf = bytearray(len(payload))
+    view = memoryview(buf)
+    got = 0
+    while time.time() < deadline and got < len(payload):
+        got += ser.readinto(view[got:]) or 0
+    return bytes(buf[:got])
 
 
 def loopback_test(ser: serial.Serial, payload: bytes, read_timeout: float) -> bool:
@@ -64,22 +110,11 @@ def loopback_test(ser: serial.Serial, payload: bytes, read_timeout: float) -> bo
     print(f"TX hex: {hexdump(payload)}")
 
     try:
-        written = ser.write(payload)
-        ser.flush()
-        if written != len(payload):
-            print(f"WARNING: wrote {written}/{len(payload)} bytes")
+        rx = echo(ser, payload, read_timeout)
     except serial.SerialTimeoutException:
         print("ERROR: write timeout")
         return False
 
-    # Read back up to payload length (loopback) within a deadline
-    deadline = time.time() + read_timeout
-    rx = b""
-    while time.time() < deadline and len(rx) < len(payload):
-        chunk = ser.read(len(payload) - len(rx))
-        if chunk:
-            rx += chunk
-
     print(f"RX ({len(rx)} bytes): {rx!r}")
     print(f"RX hex: {hexdump(rx)}")
 
@@ -94,6 +129,269 @@ def loopback_test(ser: serial.Serial, payload: bytes, read_timeout: float) -> bo
     return False
 
 
+# --- BENCHMARK (--bench) ---
+PATTERN_SIZE = 64 * 1024   # Pseudo-random reference stream, repeated
+TX_BLOCK = 1024            # Bytes per write() in the throughput phase
+RX_BLOCK = 4096            # Largest single read in the throughput phase
+RESYNC_KEY = 16            # Bytes used to find our place again after a drop
+
+
+class StreamChecker:
+    """Checks received bytes against the repeating TX pattern.
+
+    Bit errors keep the stream aligned and are counted as byte errors.
+    A dropped run of bytes shifts everything after it, so when most of a
+    chunk mismatches we look its first bytes up in the pattern, count the
+    gap as dropped and carry on from there.
+    """
+
+    def __init__(self, pattern: bytes):
+        self.size = len(pattern)
+        self.ref = pattern + pattern    # Any slice up to PATTERN_SIZE is contiguous
+        self.pos = 0                    # Stream offset of the next expected byte
+        self.received = 0
+        self.errors = 0
+        self.dropped = 0
+        self.resyncs = 0
+
+    def feed(self, data) -> None:
+        n = len(data)
+        self.received += n
+        off = self.pos % self.size
+        expected = self.ref[off:off + n]
+        if data == expected:
+            self.pos += n
+            return
+        errs = sum(a != b for a, b in zip(data, expected))
+        if errs * 4 > n and n >= RESYNC_KEY:
+            hit = self.ref.find(bytes(data[:RESYNC_KEY]), off)
+            skipped = (hit - off) % self.size if hit >= 0 else 0
+            if skipped:
+                self.dropped += skipped
+                self.resyncs += 1
+                self.pos += skipped
+                self.received -= n
+                self.feed(data)
+                return
+        self.errors += errs
+        self.pos += n
+
+
+def percentiles(samples_us) -> dict:
+    if not samples_us:
+        return {}
+    q = statistics.quantiles(samples_us, n=100, method="inclusive") if len(samples_us) > 1 else [samples_us[0]] * 99
+    return {"p50": q[49], "p90": q[89], "p99": q[98], "max": max(samples_us),
+            "jitter": statistics.pstdev(samples_us)}
+
+
+def bench_throughput(ser: serial.Serial, duration: float, drain_timeout: float) -> dict:
+    """Streams the pattern for `duration` s with TX and RX running at once."""
+    pattern = random.Random(1234).randbytes(PATTERN_SIZE)
+    tx_view = memoryview(pattern + pattern[:TX_BLOCK])
+    checker = StreamChecker(pattern)
+    rx_buf = bytearray(RX_BLOCK)
+    rx_view = memoryview(rx_buf)
+    sent = [0]
+    tx_done = threading.Event()
+
+    def tx_loop():
+        end = time.perf_counter() + duration
+        try:
+            while time.perf_counter() < end:
+                off = sent[0] % PATTERN_SIZE
+                sent[0] += ser.write(tx_view[off:off + TX_BLOCK]) or 0
+        except serial.SerialTimeoutException:
+            pass  # Flow control stalled us; what was sent still counts
+        finally:
+            tx_done.set()
+
+    ser.reset_input_buffer()
+    t0 = time.perf_counter()
+    tx = threading.Thread(target=tx_loop, daemon=True)
+    tx.start()
+    idle_since = None
+    t_last = t0
+    while True:
+        n = ser.readinto(rx_view[:min(RX_BLOCK, max(1, ser.in_waiting))]) or 0
+        now = time.perf_counter()
+        if n:
+            checker.feed(rx_view[:n])
+            idle_since = None
+            t_last = now
+        elif tx_done.is_set():
+            if checker.pos >= sent[0]:
+                break
+            idle_since = idle_since or now
+            if now - idle_since > drain_timeout:
+                break
+    tx.join()
+    elapsed = t_last - t0
+    limit = ser.baudrate / 10   # 8N1: start + 8 data + stop bits per byte
+    lost = max(0, sent[0] - checker.pos)
+    return {
+        "duration_s": elapsed,
+        "tx_bytes": sent[0],
+        "rx_bytes": checker.received,
+        "bytes_per_s": checker.received / elapsed if elapsed else 0.0,
+        "baud_limit_bytes_per_s": limit,
+        "efficiency": checker.received / elapsed / limit if elapsed else 0.0,
+        "byte_errors": checker.errors,
+        "dropped_bytes": checker.dropped + lost,
+        "resyncs": checker.resyncs,
+    }
+
+
+class RttEstimator:
+    """RFC 6298 SRTT/RTTVAR: the timeout this link actually needs (no 1 s floor)."""
+
+    def __init__(self, initial: float, floor: float = 0.001, cap: float = 60.0):
+        self.srtt = self.rttvar = None
+        self.rto = initial
+        self.floor, self.cap = floor, cap
+
+    def sample(self, r: float) -> None:
+        if self.srtt is None:
+            self.srtt, self.rttvar = r, r / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - r)
+            self.srtt = 0.875 * self.srtt + 0.125 * r
+        self.rto = min(self.cap, max(self.floor, self.srtt + max(0.0001, 4 * self.rttvar)))
+
+    def backoff(self) -> None:
+        self.rto = min(self.cap, 2 * self.rto)
+
+
+def bench_latency(ser: serial.Serial, frames: int, frame_size: int, read_timeout: float) -> dict:
+    """Round trip of small frames, one at a time (write -> full echo back).
+
+    read_timeout is the hard limit; echoes slower than the adaptive RTO
+    (what a protocol tuned to this link would wait) are counted as 'late'.
+    """
+    rng = random.Random(5678)
+    payloads = [rng.randbytes(frame_size) for _ in range(16)]
+    buf = bytearray(frame_size)
+    view = memoryview(buf)
+    lat_ns = array('Q', bytes(8 * frames))
+    done = lost = bad = 0
+    clock = time.perf_counter_ns
+    timeout_ns = int(read_timeout * 1e9)
+    est = RttEstimator(initial=read_timeout, cap=read_timeout)
+    late = 0
+
+    ser.reset_input_buffer()
+    for i in range(frames):
+        tx = payloads[i % len(payloads)]
+        t0 = clock()
+        ser.write(tx)
+        got = 0
+        while got < frame_size and clock() - t0 < timeout_ns:
+            got += ser.readinto(view[got:]) or 0
+        t1 = clock()
+        if got < frame_size:
+            lost += 1
+            est.backoff()
+            ser.reset_input_buffer()  # Don't let a late echo poison the next frame
+            continue
+        if buf != tx:
+            bad += 1
+        if (t1 - t0) / 1e9 > est.rto:
+            late += 1
+        est.sample((t1 - t0) / 1e9)
+        lat_ns[done] = t1 - t0
+        done += 1
+
+    lat_us = [v / 1000 for v in lat_ns[:done]]
+    wire_us = frame_size * 10 / ser.baudrate * 1e6
+    return {"frames": frames, "frame_size": frame_size, "completed": done,
+            "lost_frames": lost, "bad_frames": bad, "late_frames": late,
+            "srtt_us": est.srtt and est.srtt * 1e6, "rttvar_us": est.rttvar and est.rttvar * 1e6,
+            "rto_us": est.rto * 1e6,
+            "wire_time_us": wire_us, "latency_us": percentiles(lat_us)}
+
+
+def run_bench(ser: serial.Serial, duration: float, frames: int, frame_size: int, read_timeout: float) -> dict:
+    print(f"\nBenchmark on {ser.port} @ {ser.baudrate} bps (loopback TX->RX required)")
+    tp = bench_throughput(ser, duration, read_timeout)
+    print(f"Throughput: {tp['bytes_per_s'] / 1e3:.1f} kB/s of {tp['baud_limit_bytes_per_s'] / 1e3:.1f} kB/s "
+          f"baud limit ({100 * tp['efficiency']:.1f}%), {tp['rx_bytes']}/{tp['tx_bytes']} bytes back")
+    print(f"Errors:     {tp['byte_errors']} byte errors, {tp['dropped_bytes']} dropped bytes, "
+          f"{tp['resyncs']} resyncs")
+
+    lat = bench_latency(ser, frames, frame_size, read_timeout)
+    l = lat["latency_us"]
+    if l:
+        print(f"Latency:    {frame_size} B frames, p50 {l['p50']:.0f} us  p90 {l['p90']:.0f} us  "
+              f"p99 {l['p99']:.0f} us  max {l['max']:.0f} us  (wire time {lat['wire_time_us']:.0f} us)")
+    if lat["srtt_us"] is not None:
+        print(f"Timeout:    SRTT {lat['srtt_us']:.0f} us  RTTVAR {lat['rttvar_us']:.0f} us  -> RTO {lat['rto_us']:.0f} us "
+              f"(vs --read-deadline {read_timeout * 1e6:.0f} us), {lat['late_frames']} echoes slower than the RTO")
+    print(f"Frames:     {lat['completed']}/{frames} echoed, {lat['lost_frames']} lost, {lat['bad_frames']} corrupted")
+    ok = not (tp["byte_errors"] or tp["dropped_bytes"] or lat["lost_frames"] or lat["bad_frames"])
+    print("✅ BENCH PASS" if ok else "❌ BENCH saw errors or drops")
+    return {"port": ser.port, "baud": ser.baudrate, "ok": ok, "throughput": tp, "latency": lat}
+
+
+# --- FLEET MODE (--all / --match / --desc) ---
+def qualify_port(info, args) -> dict:
+    """Loopback + throughput check of one adapter; never raises."""
+    result = {"port": info.device, "description": info.description,
+              "hwid": info.hwid, "ok": False, "error": None}
+    try:
+        ser = connect(info.device, args.baud, args.timeout, args.settle)
+    except serial.SerialException as e:
+        result["error"] = f"open failed: {e}"
+        return result
+    try:
+        payload = args.payload.encode("utf-8")
+        if echo(ser, payload, args.read_deadline) != payload:
+            result["error"] = "loopback mismatch"
+            return result
+        tp = bench_throughput(ser, args.duration, args.read_deadline)
+        result["throughput"] = tp
+        result["ok"] = not (tp["byte_errors"] or tp["dropped_bytes"])
+        if not result["ok"]:
+            result["error"] = "errors in stream"
+    except (serial.SerialException, OSError) as e:
+        result["error"] = str(e)  # Adapter unplugged mid-test, etc.
+    finally:
+        ser.close()
+    return result
+
+
+def run_fleet(ports, args) -> list:
+    """Tests every port concurrently; total time ~ one port's test time."""
+    print(f"Testing {len(ports)} port(s) @ {args.baud} bps, {args.duration:g} s stream each...")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs or len(ports)) as pool:
+        results = list(pool.map(lambda p: qualify_port(p, args), ports))
+    elapsed = time.perf_counter() - t0
+
+    limit = args.baud / 10
+    print(f"\n{'port':15} {'result':6} {'kB/s':>8} {'% baud':>7} {'errors':>7} {'dropped':>8}  description / error")
+    for r in results:
+        tp = r.get("throughput")
+        if tp:
+            nums = (f"{tp['bytes_per_s'] / 1e3:8.1f} {100 * tp['bytes_per_s'] / limit:6.1f}% "
+                    f"{tp['byte_errors']:7} {tp['dropped_bytes']:8}")
+        else:
+            nums = f"{'-':>8} {'-':>7} {'-':>7} {'-':>8}"
+        note = r["description"] if r["ok"] else r["error"]
+        print(f"{r['port']:15} {'PASS' if r['ok'] else 'FAIL':6} {nums}  {note}")
+    passed = sum(r["ok"] for r in results)
+    print(f"\n{passed}/{len(results)} passed in {elapsed:.1f} s")
+    return results
+
+
+def write_json(obj, dest: str) -> None:
+    out = json.dumps(obj, indent=2)
+    if dest == "-":
+        print(out)
+    else:
+        with open(dest, "w") as f:
+            f.write(out)
+
+
 def interactive_mode(ser: serial.Serial) -> None:
     print("\nInteractive mode:")
     print("  - Type text and press Enter to send")
@@ -129,10 +427,21 @@ def main() -> int:
     ap.add_argument("-p", "--port", help="Serial port (e.g., COM5 or /dev/ttyUSB0)")
     ap.add_argument("-b", "--baud", type=int, default=115200, help="Baud rate (default: 115200)")
     ap.add_argument("--timeout", type=float, default=0.2, help="Serial read/write timeout (seconds)")
-    ap.add_argument("--read-deadline", type=float, default=1.5, help="Max time to wait for echo (seconds)")
+    ap.add_argument("--read-deadline", type=float, default=1.5, help="Max time to wait for echo (seconds); --bench also reports the RTT-based timeout")
     ap.add_argument("--interactive", action="store_true", help="Interactive send/receive mode")
     ap.add_argument("--payload", default="TechDhaba USB-UART test 12345\r\n",
                     help="Payload to send in loopback test (default is a text line)")
+    ap.add_argument("--bench", action="store_true", help="Sustained throughput + latency benchmark (loopback)")
+    ap.add_argument("--duration", type=float, default=5.0, help="Throughput phase length (seconds, default: 5)")
+    ap.add_argument("--frames", type=int, default=200, help="Latency phase frame count (default: 200)")
+    ap.add_argument("--frame-size", type=int, default=8, help="Latency phase frame size in bytes (default: 8)")
+    ap.add_argument("--json", metavar="FILE", help="With --bench/--all: also write results as JSON ('-' for stdout)")
+    ap.add_argument("--settle", type=float, default=0.1, help="Wait after opening a port (seconds, default: 0.1)")
+    ap.add_argument("--all", action="store_true", help="Test every (matched) port concurrently and print a table")
+    ap.add_argument("--match", action="append", default=[], metavar="VID[:PID]",
+                    help="Only ports with this USB VID[:PID] in hex, e.g. 0403:6001 (repeatable)")
+    ap.add_argument("--desc", help="Only ports whose description contains this text (e.g. CP210)")
+    ap.add_argument("--jobs", type=int, default=0, help="Max ports tested at once (default: all)")
 
     args = ap.parse_args()
 
@@ -140,13 +449,28 @@ def main() -> int:
         list_serial_ports()
         return 0
 
+    if args.all or args.match or args.desc:
+        ports = match_ports(args.match, args.desc)
+        if not ports:
+            print("No matching serial ports found.")
+            return 2
+        results = run_fleet(ports, args)
+        if args.json:
+            write_json({"baud": args.baud, "ports": results}, args.json)
+        return 0 if all(r["ok"] for r in results) else 1
+
     if not args.port:
-        print("ERROR: --port is required unless --list is used.\n")
+        print("ERROR: --port is required unless --list or --all is used.\n")
         list_serial_ports()
         return 2
 
-    ser = open_port(args.port, args.baud, args.timeout)
+    ser = open_port(args.port, args.baud, args.timeout, args.settle)
     try:
+        if args.bench:
+            result = run_bench(ser, args.duration, args.frames, args.frame_size, args.read_deadline)
+            if args.json:
+                write_json(result, args.json)
+            return 0 if result["ok"] else 1
         ok = loopback_test(ser, args.payload.encode("utf-8"), args.read_deadline)
         if args.interactive:
             interactive_mode(ser)
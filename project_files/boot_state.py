@@ -0,0 +1,279 @@
+"""
+boot_state.py - Persisted hardware state and the start-up profile (Pi side;
+flask_app.py only uses parse_profile)
+
+After a crash or a reboot main_listener.py used to come up with every output
+at its default: LED off, display blank, PWM stopped. Now each command that
+sets the state of a target (the coalesce= targets of command_registry.py,
+e.g. 'worker') is journaled as the last desired state of that target. The
+listener replays the journal straight after "Pi System Ready".
+
+The journal is one small JSON file, rewritten whole on every change:
+
+    {"targets": {"worker": "CMD:PWM:START", "telemetry_rate": "CMD:TELEMETRY:RATE:5"},
+     "state": {"pwm_step": 0.0222}}
+
+Each write goes to a temporary file, is fsync'ed, renamed over the old one
+with os.replace() and the directory is fsync'ed. A power cut leaves the old
+or the new journal, never half of one. A worker that finishes on its own
+(a timer run out, a sequence program done) is cleared, so it isn't started
+again at the next boot. The running worker's pid is journaled too: after a
+listener crash the old worker is still running, and stop_orphan() stops it
+before the replay starts a new one.
+
+BootProfile times the start-up in stages (interpreter, imports, port open,
+...) from the moment the process was created, so the master sees where the
+boot-to-ready time goes:
+
+    BOOT_PROFILE:python=180:imports=420:init=35:handlers=60:state=2:port=12:mux=4:ready=713:restored=760:uptime=41.3
+
+(milliseconds per stage, 'ready' / 'restored' since process start, 'uptime'
+in seconds since the Pi booted).
+
+  python3 boot_state.py --bench     # import cost of the listener's modules, journal write cost
+"""
+import ast
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# --- CONFIGURATION ---
+STATE_FILE = "listener_state.json"
+EXEC_ENV = "BOOT_STATE_EXEC_AT"   # Set before an os.execv() restart (see mark_exec)
+BENCH_WRITES = 50
+
+
+def atomic_write(path, data):
+    """Replaces path with data (bytes) so a crash leaves the old or the new file."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)   # The rename itself must reach the card too
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """Last desired state per target, plus handler state (ctx.state)."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()   # The loop and the reaper thread both write
+        self.targets, self.state = {}, {}
+        self.worker = {}               # pid + command line of the running worker
+        self.error = None
+        self.writes = 0
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            self.targets = dict(saved.get("targets", {}))
+            self.state = dict(saved.get("state", {}))
+            self.worker = dict(saved.get("worker", {}))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            self.error = f"{type(e).__name__}: {e}"   # Start clean; the next write replaces it
+
+    def set(self, target, line):
+        with self.lock:
+            if self.targets.get(target) != line:
+                self.targets[target] = line
+                self._save()
+
+    def clear(self, target):
+        with self.lock:
+            if self.targets.pop(target, None) is not None:
+                self._save()
+
+    def keep_state(self, state):
+        """Journals a copy of the handlers' state dict if it changed."""
+        with self.lock:
+            if state != self.state:
+                self.state = dict(state)
+                self._save()
+
+    def set_worker(self, proc):
+        """Records the running worker (None: none), for stop_orphan() after a crash."""
+        with self.lock:
+            worker = {"pid": proc.pid, "args": list(proc.args)} if proc else {}
+            if worker != self.worker:
+                self.worker = worker
+                self._save()
+
+    def _save(self):
+        data = json.dumps({"targets": self.targets, "state": self.state, "worker": self.worker},
+                          sort_keys=True)
+        atomic_write(self.path, data.encode())
+        self.writes += 1
+
+    def replay(self, targets):
+        """Journaled command lines for the given targets, in that order."""
+        with self.lock:
+            return [self.targets[t] for t in targets if t in self.targets]
+
+
+def alive(pid):
+    """True while pid runs (a zombie waiting for init to reap it counts as gone)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def stop_orphan(worker, kill_after=2.0):
+    """Stops the worker a crashed listener left running (it has its own session,
+    so it outlives us and still holds its pins). Checks the command line, in
+    case the pid has been reused. Returns its pid, or None."""
+    pid = worker.get("pid")
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            args = [a.decode(errors="replace") for a in f.read().split(b"\0")[:-1]]
+    except (OSError, TypeError):
+        return None
+    if args != worker.get("args"):
+        return None
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            return pid
+        deadline = time.monotonic() + kill_after
+        while alive(pid) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if not alive(pid):
+            break
+    return pid
+
+
+def mark_exec():
+    """Call just before os.execv(): the process keeps its start time, so the
+    next BootProfile counts from here instead."""
+    up = uptime()
+    if up is not None:
+        os.environ[EXEC_ENV] = repr(up)
+
+
+def process_age():
+    """Seconds since this process was created (before the interpreter started), or None."""
+    try:
+        if EXEC_ENV in os.environ:
+            return time.clock_gettime(time.CLOCK_BOOTTIME) - float(os.environ.pop(EXEC_ENV))
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")   # starttime, ticks since boot
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def uptime():
+    """Seconds since the machine booted, or None."""
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (OSError, AttributeError):
+        return None
+
+
+class BootProfile:
+    """Start-up stages; create it before the slow imports."""
+
+    def __init__(self):
+        self.t0 = time.monotonic() - (process_age() or 0.0)
+        self.last = self.t0
+        self.stages = []
+        self.mark("python")   # Interpreter start-up, up to the first line of the script
+
+    def mark(self, stage):
+        now = time.monotonic()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def elapsed(self):
+        return time.monotonic() - self.t0
+
+    def line(self, **totals):
+        """BOOT_PROFILE:<stage>=<ms>:...:<total>=<ms>:uptime=<s>."""
+        fields = [f"{stage}={1000 * s:.0f}" for stage, s in self.stages]
+        fields += [f"{name}={1000 * s:.0f}" for name, s in totals.items()]
+        up = uptime()
+        if up is not None:
+            fields.append(f"uptime={up:.1f}")
+        return "BOOT_PROFILE:" + ":".join(fields)
+
+
+def parse_profile(text):
+    """BOOT_PROFILE:... (without the prefix) -> {name: number}."""
+    out = {}
+    for field in text.split(":"):
+        name, _, value = field.partition("=")
+        try:
+            out[name] = float(value)
+        except ValueError:
+            pass
+    return out
+
+
+# --- BENCH ---
+def run_bench(script="main_listener.py"):
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, script)) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [a.name for a in node.names if a.name not in modules]
+        elif isinstance(node, ast.ImportFrom) and node.module not in modules:
+            modules.append(node.module)
+
+    def cold(code):
+        """Seconds code takes in a fresh interpreter (nothing imported yet)."""
+        probe = f"import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True, text=True)
+        return float(out.stdout) if out.returncode == 0 else None
+
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    print(f"Start-up of {script} on this machine")
+    print(f"  {'python (empty interpreter)':34} {1000 * (time.perf_counter() - t):7.1f} ms")
+    timed = [(m, cold(f"import {m}")) for m in modules]
+    for m, s in sorted(timed, key=lambda x: -(x[1] or 0)):
+        print(f"  {'import ' + m:34} " + (f"{1000 * s:7.1f} ms" if s is not None else "  failed"))
+    total = cold("; ".join(f"import {m}" for m, s in timed if s is not None))
+    print(f"  {'all of them together':34} {1000 * total:7.1f} ms")
+
+    path = os.path.join(here, ".bench_state.json")
+    journal = Journal(path)
+    times = []
+    for i in range(BENCH_WRITES):
+        t = time.perf_counter()
+        journal.set("worker", f"CMD:GPIO:BLINK:{i}")
+        times.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    Journal(path)
+    loaded = time.perf_counter() - t
+    os.remove(path)
+    times.sort()
+    print(f"  journal write (fsync + rename)     {1000 * times[len(times) // 2]:7.2f} ms median, "
+          f"{1000 * times[-1]:.2f} ms max over {BENCH_WRITES}")
+    print(f"  journal load                       {1e6 * loaded:7.0f} us")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+        sys.exit(0)
+    journal = Journal()
+    if journal.error:
+        print(f"{STATE_FILE}: {journal.error}")
+        sys.exit(1)
+    print(json.dumps({"targets": journal.targets, "state": journal.state, "worker": journal.worker}, indent=2))
@@ -0,0 +1,308 @@
+"""
+clock_sync.py - PC <-> Pi clock sync and timed commands (shared by both sides)
+
+Commands used to run whenever they came off the UART and log lines carried
+no time, so PC and Pi events could not be lined up. Now:
+
+  * the master measures the Pi's clock the NTP way. A request stamped t1
+    (PC clock) is received at t2 and answered at t3 (Pi clock); the answer
+    arrives at t4 (PC clock):
+        offset = ((t2 - t1 - w_req) - (t4 - t3 - w_rep)) / 2
+        delay  = (t4 - t1) - (t3 - t2) - w_req - w_rep
+    w_req / w_rep are the two messages' wire times (bytes * 10 / baud), so a
+    long answer doesn't skew the offset, and delay is only the queueing.
+  * Queueing (bulk data ahead on the wire, the USB latency timer, the Pi's
+    loop) only ever adds delay. So each SEGMENTS-th of the window keeps only
+    its FILTER_SHARE of samples with the smallest delay (the NTP clock
+    filter), and offset + drift are fitted through those by least squares.
+    Drift is used once they span MIN_DRIFT_SPAN and its standard error is
+    below MAX_DRIFT_SE; until then the offset is the recent samples' mean.
+  * the Pi stamps every log line with its own clock: LOG:@<pi_us>:<message>
+  * "AT:<pi_us>:CMD:..." runs the command when the Pi clock reaches pi_us.
+    The listener sleeps until SPIN_MARGIN before it and spins the rest, so it
+    is not late by a scheduler tick.
+Both clocks are CLOCK_MONOTONIC in microseconds: never stepped, and the same
+clock for every process on the machine (workers can wait for a time too).
+
+Transport: with the mux, T/U frames stamped by the reader thread as they
+arrive and by the writer right before they go out (uart_mux.py). On the text
+link the master sends "TSYNC:<seq>:<t1>" and main_listener.py answers
+"TSYNCR:<seq>:<t1>:<t2>:<t3>" from its loop, which is coarser: t2 is only
+taken when the loop gets to the line.
+
+USB adapters hold received bytes for their latency timer (FTDI: 16 ms) before
+passing them on. Set it to 1 ms for sub-millisecond sync:
+    echo 1 > /sys/bus/usb-serial/devices/ttyUSB0/latency_timer
+
+    sync = ClockSync(send_request=mux.time_request, baud=115200)
+    mux.on_time = sync.on_reply
+    sync.start()
+    sync.to_remote(now_us() + 500000)   # -> Pi clock half a second from now
+
+  python3 clock_sync.py --demo     # two simulated Pis with skewed clocks firing "at the same time"
+"""
+import heapq
+import sys
+import threading
+import time
+from collections import deque
+
+# --- CONFIGURATION ---
+WINDOW = 64              # Samples kept
+SEGMENTS = 4             # The window is filtered in this many parts, so the fit spans all of it
+FILTER_SHARE = 0.25      # Lowest-delay share of each part used for the fit
+MIN_DRIFT_SPAN = 10.0    # Seconds the filtered samples must span before drift is fitted
+MAX_DRIFT_SE = 2e-6      # Standard error (2 ppm) above which the drift estimate is ignored
+BURST = 8                # Requests at start-up / after the link comes back...
+BURST_INTERVAL = 0.05    # ...this far apart
+SYNC_INTERVAL = 2.0      # Then one request this often
+STEP_RESET = 0.1         # Seconds off the prediction: the Pi rebooted (new clock), start over
+SPIN_MARGIN = 0.002      # Seconds before a due time that Scheduler.sleep() stops sleeping and spins
+
+
+def now_us():
+    return time.monotonic_ns() // 1000
+
+
+def wire_us(n_bytes, baud):
+    return n_bytes * 10e6 / baud
+
+
+class ClockSync:
+    """Master side. send_request(seq) -> False when it couldn't be sent."""
+
+    def __init__(self, send_request, baud=115200, on_state=None, clock=now_us,
+                 burst_interval=BURST_INTERVAL, sync_interval=SYNC_INTERVAL):
+        self.send_request = send_request
+        self.baud = baud
+        self.on_state = on_state or (lambda synced, msg: None)
+        self.clock = clock
+        self.burst_interval = burst_interval
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=WINDOW)   # (local time, offset, delay) in us
+        self.fit = None                        # (t0, offset at t0, drift) or None
+        self.drift_se = None
+        self.best_delay = None
+        self.seq = 0
+        self.running = False
+        self.stats = {"requests": 0, "replies": 0}
+
+    # --- PUBLIC ---
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    @property
+    def synced(self):
+        return self.fit is not None
+
+    def on_reply(self, seq, t1, t2, t3, t4, req_bytes=0, rep_bytes=0):
+        """One answered request, with the request's and reply's size on the wire."""
+        w_req, w_rep = wire_us(req_bytes, self.baud), wire_us(rep_bytes, self.baud)
+        offset = ((t2 - t1 - w_req) - (t4 - t3 - w_rep)) / 2
+        delay = max(0.0, (t4 - t1) - (t3 - t2) - w_req - w_rep)
+        mid = (t1 + t4) / 2
+        predicted = self.offset_at(mid)
+        if predicted is not None and abs(offset - predicted) > STEP_RESET * 1e6:
+            self.reset()
+        with self.lock:
+            first = self.fit is None
+            self.samples.append((mid, offset, delay))
+            self.stats["replies"] += 1
+            self._refit()
+        if first:
+            self.on_state(True, f"clock synced: Pi offset {offset / 1e3:+.3f} ms, delay {delay / 1e3:.2f} ms")
+
+    def offset_at(self, local_us):
+        """Pi clock minus PC clock at local_us, or None before the first reply."""
+        fit = self.fit
+        if fit is None:
+            return None
+        t0, offset, drift = fit
+        return offset + drift * (local_us - t0)
+
+    def to_remote(self, local_us):
+        offset = self.offset_at(local_us)
+        return None if offset is None else int(round(local_us + offset))
+
+    def to_local(self, remote_us):
+        offset = self.offset_at(remote_us)
+        if offset is None:
+            return None
+        # The offset is a function of local time: one more step puts it at the right place
+        return int(round(remote_us - self.offset_at(remote_us - offset)))
+
+    def reset(self):
+        """Forget the samples (the Pi restarted: new clock), and sync again in a burst."""
+        with self.lock:
+            self.samples.clear()
+            self.fit = self.best_delay = self.drift_se = None
+        self.on_state(False, "clock sync reset")
+
+    def status(self):
+        fit = self.fit
+        if fit is None:
+            return {"synced": False, **self.stats}
+        return {
+            "synced": True,
+            "offset_us": round(self.offset_at(self.clock()), 1),
+            "drift_ppm": round(fit[2] * 1e6, 3),
+            "drift_se_ppm": None if self.drift_se is None else round(self.drift_se * 1e6, 3),
+            "best_delay_us": round(self.best_delay, 1),
+            "error_bound_us": round(self.best_delay / 2, 1),   # Worst case if all delay were one-way
+            "samples": len(self.samples),
+            **self.stats,
+        }
+
+    # --- INTERNALS ---
+    def _refit(self):
+        samples = list(self.samples)
+        self.best_delay = min(d for _, _, d in samples)
+        size = -(-len(samples) // SEGMENTS)
+        parts = [sorted(samples[k:k + size], key=lambda s: s[2]) for k in range(0, len(samples), size)]
+        parts = [p[:max(1, int(len(p) * FILTER_SHARE))] for p in parts]
+        best = [s for p in parts for s in p]
+        ts = [s[0] for s in best]
+        recent = parts[-1]
+        self.fit = (recent[0][0], sum(s[1] for s in recent) / len(recent), 0.0)
+        self.drift_se = None
+        if len(best) < 3 or (max(ts) - min(ts)) / 1e6 < MIN_DRIFT_SPAN:
+            return
+        t0 = sum(ts) / len(ts)
+        mean = sum(s[1] for s in best) / len(best)
+        sxx = sum((t - t0) ** 2 for t in ts)
+        drift = sum((s[0] - t0) * (s[1] - mean) for s in best) / sxx
+        resid = sum((s[1] - mean - drift * (s[0] - t0)) ** 2 for s in best) / (len(best) - 2 or 1)
+        self.drift_se = (resid / sxx) ** 0.5
+        if self.drift_se <= MAX_DRIFT_SE:
+            self.fit = (t0, mean, drift)
+
+    def _run(self):
+        sent_since_reset = 0
+        while self.running:
+            if not self.samples:
+                sent_since_reset = 0
+            self.seq = (self.seq + 1) % (1 << 32)
+            if self.send_request(self.seq):
+                self.stats["requests"] += 1
+                sent_since_reset += 1
+            time.sleep(self.burst_interval if sent_since_reset < BURST else self.sync_interval)
+
+
+class Scheduler:
+    """Pi side: commands waiting for their time. Owned by one loop (no lock)."""
+
+    def __init__(self, clock=now_us):
+        self.clock = clock
+        self.heap = []
+        self.n = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, due_us, item):
+        self.n += 1
+        heapq.heappush(self.heap, (due_us, self.n, item))
+
+    def pop_due(self, now=None):
+        """[(due_us, item)] whose time has come, in time order."""
+        now = self.clock() if now is None else now
+        out = []
+        while self.heap and self.heap[0][0] <= now:
+            due, _, item = heapq.heappop(self.heap)
+            out.append((due, item))
+        return out
+
+    def sleep(self, max_s):
+        """Sleeps max_s, or until the next due time if that comes first."""
+        if not self.heap:
+            time.sleep(max_s)
+            return
+        due = self.heap[0][0]
+        wait = (due - self.clock()) / 1e6
+        if wait > max_s:
+            time.sleep(max_s)
+            return
+        if wait > SPIN_MARGIN:
+            time.sleep(wait - SPIN_MARGIN)   # time.sleep() may overshoot by a tick...
+        while self.clock() < due:            # ...so the rest is spun
+            pass
+
+
+def wait_until(t):
+    """For workers: blocks until time.monotonic() reaches t (seconds)."""
+    left = t - time.monotonic()
+    if left > SPIN_MARGIN:
+        time.sleep(left - SPIN_MARGIN)
+    while time.monotonic() < t:
+        pass
+
+
+# --- DEMO ---
+def run_demo(baud=115200, seconds=20.0, rounds=5):
+    import uart_mux
+
+    # Two Pis with their own clock offset and drift (ppm)
+    pis = [("pi-a", 3.2e6, 25.0, False), ("pi-b", -41.7e6, -12.0, True)]   # name, offset us, ppm, busy link
+    nodes = []
+    for name, offset, ppm, busy in pis:
+        clock = (lambda offset, ppm: lambda: int(now_us() * (1 + ppm * 1e-6) + offset))(offset, ppm)
+        master, pi = uart_mux.Mux(baud), uart_mux.Mux(baud, clock=clock)
+        master.attach(uart_mux.SimPort(baud, pi.feed))
+        pi.attach(uart_mux.SimPort(baud, master.feed))
+        sync = ClockSync(master.time_request, baud, burst_interval=0.02, sync_interval=0.25)
+        master.on_time = (lambda sync: lambda *t: sync.on_reply(
+            *t, uart_mux.TIME_FRAME_BYTES, uart_mux.TIME_FRAME_BYTES))(sync)
+        if busy:   # The Pi streams a file back the whole time: replies queue behind it
+            master.open(uart_mux.BULK).on_data = lambda d: None
+            def stream(ch=pi.open(uart_mux.BULK)):
+                while True:
+                    ch.write(b"R" * 239 + b"\n", timeout=0.1)
+            threading.Thread(target=stream, daemon=True).start()
+        nodes.append((name, clock, ppm, master, pi, sync.start()))
+
+    print(f"Syncing two simulated Pis over {baud} baud for {seconds:.0f} s (sync every 0.25 s; pi-b's link is busy)")
+    time.sleep(seconds)
+    for name, clock, ppm, master, pi, sync in nodes:
+        local = now_us()
+        err = sync.to_remote(local) - clock()   # Pi clock is read just after local, so err is slightly low
+        st = sync.status()
+        fitted = st['drift_se_ppm'] is not None and st['drift_se_ppm'] <= MAX_DRIFT_SE * 1e6
+        drift = (f"drift {st['drift_ppm']:+6.2f} ppm" if fitted else
+                 f"drift not fitted yet (+-{st['drift_se_ppm'] or 0:.0f} ppm)")
+        print(f"  {name}: offset {st['offset_us'] / 1e6:+8.3f} s, error {err:+5.0f} us  {drift} (true {ppm:+.1f})  "
+              f"least queueing {st['best_delay_us']:.0f} us  bound +-{st['error_bound_us']:.0f} us")
+
+    # Everyone fires at the same PC time, each on its own clock. The two "Pis"
+    # spin in one interpreter here, so let the GIL change hands more often
+    sys.setswitchinterval(0.0001)
+    def fire(name, clock, sync, target, fired):
+        sched = Scheduler(clock)
+        sched.add(sync.to_remote(target), name)
+        while not sched.pop_due():
+            sched.sleep(0.05)
+        fired[name] = now_us() - target
+    spreads = []
+    for _ in range(rounds):
+        target, fired = now_us() + 300000, {}
+        threads = [threading.Thread(target=fire, args=(name, clock, sync, target, fired))
+                   for name, clock, _, _, _, sync in nodes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        spreads.append(max(fired.values()) - min(fired.values()))
+        print("  AT <same instant>: " + "  ".join(f"{n} {v:+5.0f} us" for n, v in fired.items())
+              + f"  -> spread {spreads[-1]:4.0f} us")
+    print(f"Worst spread {max(spreads)} us between clocks {abs(pis[0][1] - pis[1][1]) / 1e6:.1f} s apart")
+
+if __name__ == '__main__':
+    if '--demo' in sys.argv:
+        run_demo()
+    else:
+        print("Usage: python3 clock_sync.py --demo")
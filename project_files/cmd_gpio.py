@@ -0,0 +1,35 @@
+"""cmd_gpio.py - CMD:GPIO:* handlers (LED on GPIO 17, see gpio_blink.py; input capture, see gpio_capture.py)."""
+from command_registry import command
+
+START_LEAD = 0.5   # Seconds: stopping the old worker + starting Python on a Pi 3, for AT: commands
+
+
+def start_args(ctx):
+    """gpio_blink.py's optional start time, when the command came as AT:<pi_us>:..."""
+    return [f"{ctx.due / 1e6:.6f}"] if ctx.due else []
+
+
+@command('GPIO', 'BLINK', args=['delay:float'], resources=['gpio17'], coalesce='worker', lead=START_LEAD)
+def blink(ctx, delay):
+    ctx.run_script('gpio_blink.py', [str(delay)] + start_args(ctx))
+    ctx.record('gpio_blink_s', delay)
+
+
+@command('GPIO', 'ON', resources=['gpio17'], coalesce='worker', lead=START_LEAD)
+def on(ctx):
+    ctx.run_script('gpio_blink.py', ['0'] + start_args(ctx))  # 0 delay = ON
+    ctx.record('gpio_led', 1)
+
+
+@command('GPIO', 'CAPTURE', args=['pins', 'debounce_ms:float?'], defaults={'debounce_ms': 2.0},
+         resources=['gpio_in'], coalesce='worker')
+def capture(ctx, pins, debounce_ms):
+    """Streams timestamped edges of comma-separated input pins, e.g. CMD:GPIO:CAPTURE:22,27:5"""
+    ctx.run_script('gpio_capture.py', [pins, f"{debounce_ms:g}"])
+
+
+@command('GPIO', 'OFF', resources=['gpio17'], coalesce='worker')
+def off(ctx):
+    ctx.kill_current_process()
+    ctx.log("GPIO Turned OFF")
+    ctx.record('gpio_led', 0)
@@ -0,0 +1,18 @@
+"""cmd_i2c.py - CMD:I2C:* handlers (TM1637 display and the sensor daemon)."""
+from command_registry import command
+
+
+@command('I2C', 'TIMER', args=['*duration'], resources=['tm1637'], coalesce='worker')
+def timer(ctx, duration):
+    ctx.run_script('i2c_timer.py', [duration])  # "05:00" arrives whole
+
+
+@command('I2C', 'CLOCK', resources=['tm1637'], coalesce='worker')
+def clock(ctx):
+    ctx.run_script('i2c_world_clock.py')
+
+
+@command('I2C', 'DAEMON', args=['config?'], defaults={'config': 'sensors.json'}, resources=['i2c1'], coalesce='worker')
+def daemon(ctx, config):
+    """Polls every sensor configured in <config>."""
+    ctx.run_script('i2c_daemon.py', [config])
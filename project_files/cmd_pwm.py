@@ -0,0 +1,74 @@
+"""cmd_pwm.py - CMD:PWM:* handlers (breathing LED on GPIO 12 and PWM input measurement, see pwm_monitor.py;
+multi-channel software PWM, see soft_pwm.py)."""
+from command_registry import command, CommandError
+
+DEFAULT_STEP = 0.05       # Seconds per 5% duty step, as in pwm_monitor.py
+STEP_LIMITS = (0.005, 0.5)
+STEP_FACTOR = 1.5         # FASTER / SLOWER
+
+
+def restart(ctx, step):
+    ctx.state['pwm_step'] = min(max(step, STEP_LIMITS[0]), STEP_LIMITS[1])
+    ctx.state['pwm_mode'] = 'breathe'
+    ctx.run_script('pwm_monitor.py', [f"{ctx.state['pwm_step']:.4g}"])
+
+
+def breathing(ctx):
+    """pwm_monitor.py runs the breathing LED (not a measurement)."""
+    return ctx.current_script() == 'pwm_monitor.py' and ctx.state.get('pwm_mode') != 'measure'
+
+
+@command('PWM', 'START', args=['step:float?'], resources=['gpio12'], coalesce='worker')
+def start(ctx, step):
+    restart(ctx, step or ctx.state.get('pwm_step', DEFAULT_STEP))
+
+
+@command('PWM', 'STOP', resources=['gpio12'], coalesce='worker')
+def stop(ctx):
+    ctx.kill_current_process()
+    ctx.log("PWM Stopped")
+
+
+@command('PWM', 'MEASURE', args=['pin:int', 'window:float?'], defaults={'window': 1.0},
+         resources=['gpio_in'], coalesce='worker')
+def measure(ctx, pin, window):
+    """Frequency, duty, jitter and missing pulses of the signal on <pin>, every <window> s."""
+    if not 0 <= pin <= 27:
+        raise CommandError(f"PWM:MEASURE bad pin {pin}")
+    ctx.state['pwm_mode'] = 'measure'
+    ctx.run_script('pwm_monitor.py', ['--measure', str(pin), f"{min(max(window, 0.1), 60):g}"])
+
+
+@command('PWM', 'MULTI', args=['pins', 'duties', 'hz:float?'], defaults={'hz': 100.0},
+         resources=['gpio'], coalesce='worker')
+def multi(ctx, pins, duties, hz):
+    """Software PWM on <pins> (e.g. 5,6,13) at <duties> % (one per pin, or one for all), one scheduler."""
+    try:
+        pin_list = [int(p) for p in pins.split(',')]
+        duty_list = [float(d) for d in duties.split(',')]
+    except ValueError:
+        raise CommandError(f"PWM:MULTI bad pins/duties {pins} {duties}")
+    if not all(0 <= p <= 27 for p in pin_list) or len(duty_list) not in (1, len(pin_list)) or not 0 < hz <= 10000:
+        raise CommandError(f"PWM:MULTI bad pins/duties/Hz {pins} {duties} {hz:g}")
+    ctx.state['pwm_mode'] = 'multi'
+    ctx.run_script('soft_pwm.py', [pins, duties, f"{hz:g}"])
+
+
+# Relative steps: every click counts, so these are never coalesced. A burst
+# of them still costs one restart (the worker slot only starts the last one).
+@command('PWM', 'FASTER', resources=['gpio12'])
+def faster(ctx):
+    step = ctx.state.get('pwm_step', DEFAULT_STEP) / STEP_FACTOR
+    if breathing(ctx):
+        restart(ctx, step)
+    else:
+        ctx.state['pwm_step'] = max(step, STEP_LIMITS[0])
+
+
+@command('PWM', 'SLOWER', resources=['gpio12'])
+def slower(ctx):
+    step = ctx.state.get('pwm_step', DEFAULT_STEP) * STEP_FACTOR
+    if breathing(ctx):
+        restart(ctx, step)
+    else:
+        ctx.state['pwm_step'] = min(step, STEP_LIMITS[1])
@@ -0,0 +1,65 @@
+"""cmd_seq.py - CMD:SEQ:* handlers (sequence programs, see seqc.py / seq_runner.py)."""
+import base64
+import binascii
+import os
+import re
+
+import seqc
+from command_registry import command, CommandError
+
+PROGRAM_DIR = "seq_programs"
+START_LEAD = 0.5   # Seconds, for AT: commands (worker start-up, as in cmd_gpio.py)
+
+
+def program_path(name, suffix=".seqb"):
+    if not re.fullmatch(r"[\w-]{1,32}", name):
+        raise CommandError(f"SEQ bad program name '{name}'")
+    return os.path.join(PROGRAM_DIR, name + suffix)
+
+
+@command('SEQ', 'PUT', args=['name', 'offset:int', 'data'])
+def put(ctx, name, offset, data):
+    """One base64 chunk of a compiled program; offset 0 starts a new upload."""
+    part = program_path(name, ".part")
+    os.makedirs(PROGRAM_DIR, exist_ok=True)
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset not in (0, have):
+        raise CommandError(f"SEQ {name}: chunk at {offset}, expected {have}")
+    try:
+        chunk = base64.b64decode(data, validate=True)
+    except binascii.Error:
+        raise CommandError(f"SEQ {name}: bad base64 at {offset}")
+    with open(part, "wb" if offset == 0 else "ab") as f:
+        f.write(chunk)
+
+
+@command('SEQ', 'RUN', args=['name'], resources=['gpio'], coalesce='worker', lead=START_LEAD)
+def run(ctx, name):
+    """Checks a finished upload and runs the program in one worker."""
+    path, part = program_path(name), program_path(name, ".part")
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            code = f.read()
+        try:
+            seqc.decode(code)
+        except seqc.SeqError as e:
+            raise CommandError(f"SEQ {name}: {e}")
+        os.replace(part, path)
+    if not os.path.exists(path):
+        raise CommandError(f"SEQ {name}: no such program")
+    ctx.run_script('seq_runner.py', [path] + ([f"{ctx.due / 1e6:.6f}"] if ctx.due else []))
+
+
+@command('SEQ', 'STOP', resources=['gpio'], coalesce='worker')
+def stop(ctx):
+    """Stops the running worker, like GPIO:OFF / PWM:STOP: as the last word
+    on the 'worker' target it must leave nothing running (and nothing to restore)."""
+    ctx.kill_current_process()
+
+
+@command('SEQ', 'LIST')
+def list_programs(ctx):
+    names = sorted(f for f in os.listdir(PROGRAM_DIR) if f.endswith(".seqb")) if os.path.isdir(PROGRAM_DIR) else []
+    for f in names:
+        ctx.log(f"SEQ_PROGRAM:{f[:-5]}:{os.path.getsize(os.path.join(PROGRAM_DIR, f))}")
+    ctx.log(f"{len(names)} sequence program(s)")
@@ -0,0 +1,48 @@
+"""cmd_spi.py - CMD:SPI:* handlers (SD card, see spi_sd_card.py)."""
+import subprocess
+
+from command_registry import command
+
+
+@command('SPI', 'READ', args=['fname', 'offset?', 'length?'], resources=['sd_card'], coalesce='transfer')
+def read(ctx, fname, offset, length):
+    """Streams a file range in the background."""
+    ctx.start_transfer('READ', [a for a in (fname, offset, length) if a is not None])
+
+
+@command('SPI', 'BLOCK_READ', args=['lba', 'count', 'offset?'], resources=['sd_card'], coalesce='transfer')
+def block_read(ctx, lba, count, offset):
+    ctx.start_transfer('BLOCK_READ', [a for a in (lba, count, offset) if a is not None])
+
+
+@command('SPI', 'CANCEL', coalesce='transfer')
+def cancel(ctx):
+    ctx.cancel_transfer()
+    ctx.log("Transfer Cancelled")
+
+
+@command('SPI', 'APPEND', args=['name', '*record'], resources=['sd_card'])
+def append(ctx, name, record):
+    """Silent, one per sample; the writer batches the fsyncs."""
+    try:
+        ctx.append_record(name, record)
+    except OSError as e:
+        ctx.log(f"SPI Error: {e}")
+
+
+@command('SPI', 'FLUSH', resources=['sd_card'])
+def flush(ctx):
+    ctx.flush_loggers()
+    ctx.log(f"Flushed {len(ctx.loggers)} log(s)")
+
+
+@command('SPI', '*', args=['*args?'], resources=['sd_card'])
+def short_action(ctx, action, args):
+    """Short SPI actions (CREATE, WRITE, LIST, ...) run to completion, so we wait for them."""
+    result = subprocess.run(['python3', 'spi_sd_card.py', action] + (args.split(':') if args else []),
+                            capture_output=True, text=True)
+    for out in result.stdout.splitlines():
+        if out.strip():
+            ctx.log(out.strip())
+    if result.stderr:
+        ctx.log(f"Error: {result.stderr.strip()}")
@@ -0,0 +1,16 @@
+"""cmd_sys.py - CMD:SYS:* handlers for the listener itself."""
+from command_registry import command
+
+
+@command('SYS', 'RELOAD')
+def reload(ctx):
+    """Re-imports changed cmd_*.py files; running workers are left alone."""
+    ctx.reload_commands()
+
+
+@command('SYS', 'COMMANDS', args=['module?'])
+def commands(ctx, module):
+    """One LOG line per registered command."""
+    for cmd in ctx.registry.commands():
+        if module is None or cmd.module == module.upper():
+            ctx.log(f"{cmd.usage()}  ({cmd.source})")
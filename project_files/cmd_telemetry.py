@@ -0,0 +1,16 @@
+"""cmd_telemetry.py - CMD:TELEMETRY:* handlers (live chart feed, see telemetry.py)."""
+from command_registry import command
+
+
+@command('TELEMETRY', 'RATE', args=['hz:float'], coalesce='telemetry_rate')
+def rate(ctx, hz):
+    """Frames per second; the byte budget per second stays the same."""
+    hz = min(max(hz, 0.2), 20.0)   # The listener loop ticks at 20 Hz
+    ctx.live.budget = max(64, int(ctx.live.budget * ctx.live.period * hz))
+    ctx.live.period = 1.0 / hz
+    ctx.log(f"Telemetry at {hz:g} frames/s")
+
+
+@command('TELEMETRY', 'STATS')
+def stats(ctx):
+    ctx.log("TELEMETRY: " + " ".join(f"{k}={v}" for k, v in ctx.live.stats.items()))
@@ -0,0 +1,18 @@
+"""cmd_tsdb.py - CMD:TSDB:* handlers (history kept by tsdb.py)."""
+import tsdb
+from command_registry import command
+
+
+@command('TSDB', 'QUERY', args=['series', 'start?', 'end?', 'step?'])
+def query(ctx, series, start, end, step):
+    """Aggregated TS_ROW lines; start/end epoch or negative seconds."""
+    try:
+        for row in tsdb.query_rows(ctx.history, series, start, end, step):
+            ctx.send_line(row)
+    except ValueError as e:
+        ctx.log(f"TSDB Error: {e}")
+
+
+@command('TSDB', 'LIST')
+def series(ctx):
+    ctx.log(f"TS_SERIES: {', '.join(ctx.history.names())}")
@@ -0,0 +1,91 @@
+"""cmd_upd.py - CMD:UPD:* handlers (file updates pushed from the PC, see delta_sync.py)."""
+import base64
+import binascii
+import os
+import re
+
+import delta_sync
+from command_registry import command, CommandError
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))   # Only files next to the listener
+STAGING = os.path.join(BASE_DIR, ".updates")
+
+
+def target(name):
+    if not re.fullmatch(r"[\w-]+\.(py|json|seq)", name):
+        raise CommandError(f"UPD bad file name '{name}'")
+    return os.path.join(BASE_DIR, name)
+
+
+def read(path):
+    if not os.path.exists(path):
+        return b""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def fail(ctx, name, reason):
+    ctx.send_line(f"UPD_FAIL:{name}:{reason}")
+
+
+@command('UPD', 'SIG', args=['name'])
+def sig(ctx, name):
+    """Block signature of the current file (empty for a new one), on the bulk channel."""
+    for line in delta_sync.signature_lines(name, read(target(name))):
+        ctx.send_line(line)
+
+
+@command('UPD', 'PUT', args=['name', 'offset:int', 'data'])
+def put(ctx, name, offset, data):
+    target(name)
+    os.makedirs(STAGING, exist_ok=True)
+    part = os.path.join(STAGING, name + ".delta")
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset not in (0, have):
+        return fail(ctx, name, f"delta chunk at {offset}, expected {have}")
+    try:
+        chunk = base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return fail(ctx, name, f"bad base64 at {offset}")
+    with open(part, "wb" if offset == 0 else "ab") as f:
+        f.write(chunk)
+
+
+@command('UPD', 'APPLY', args=['name', 'size:int', 'sha', 'base_sha'])
+def apply(ctx, name, size, sha, base_sha):
+    """Rebuilds, verifies and atomically swaps in the new file, then restarts its users."""
+    path = target(name)
+    part = os.path.join(STAGING, name + ".delta")
+    old = read(path)
+    if delta_sync.sha256(old) != base_sha:
+        return fail(ctx, name, "file changed since its signature was sent, push again")
+    try:
+        new = delta_sync.apply_delta(old, delta_sync.block_size(len(old)), read(part))
+    except Exception as e:   # zlib.error, struct.error, bad op
+        return fail(ctx, name, f"bad delta: {e}")
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    if len(new) != size or delta_sync.sha256(new) != sha:
+        return fail(ctx, name, "rebuilt file doesn't match its SHA-256")
+    if name.endswith(".py"):
+        try:
+            compile(new, name, "exec")
+        except SyntaxError as e:
+            return fail(ctx, name, f"not installed, line {e.lineno}: {e.msg}")
+
+    tmp = os.path.join(BASE_DIR, f".{name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(new)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+    os.replace(tmp, path)
+    dir_fd = os.open(BASE_DIR, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)   # The rename itself survives a power cut
+    finally:
+        os.close(dir_fd)
+    restarted = ctx.after_update(name)
+    ctx.send_line(f"UPD_DONE:{name}:{size}:{sha[:12]}:{restarted}")
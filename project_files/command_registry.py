@@ -0,0 +1,261 @@
+"""
+command_registry.py - Pluggable CMD:<MODULE>:<ACTION> dispatch for the Pi listener.
+
+Handler modules are plain files named cmd_*.py next to main_listener.py.
+Each one declares its commands with the @command decorator:
+
+    from command_registry import command
+
+    @command('GPIO', 'BLINK', args=['delay:float'], resources=['led'])
+    def blink(ctx, delay):
+        ctx.run_script('gpio_blink.py', [str(delay)])
+
+Argument schema, one string per ':'-separated field after the action:
+    'name'          required string
+    'name:int'      converted with int() (also float, str)
+    'name?'         optional (handler gets None, or the default from defaults=)
+    '*name'         last only: the rest of the line, ':' kept ("05:00", records)
+Extra fields are ignored. ACTION '*' catches every other action of the module
+and receives the action name as its first argument.
+
+coalesce='<target>' marks commands that only set the state of one target
+(e.g. 'worker': whichever micro-app runs last is the one that counts).
+coalesce() drops every such command in a burst that a later one for the
+same target supersedes; commands without it (appends, queries, relative
+steps like PWM:FASTER) always run, in order.
+
+lead=<seconds> is for "AT:<pi_us>:CMD:..." (see clock_sync.py): the command
+is dispatched that much before its time with ctx.due set, and waits for the
+time itself - for workers, whose start-up takes longer than the accuracy asked.
+
+The dispatch table is a dict keyed by (MODULE, ACTION), built once per load,
+so a command costs one lookup plus its argument conversions.
+
+reload() re-imports the cmd_*.py files whose mtime changed (and picks up new
+ones), builds a new table and swaps it in only if every module imported and no
+two commands collide - a broken file leaves the old handlers running. Only the
+handler code is replaced: the listener's state (running worker, transfers,
+loggers) lives in main_listener.py and is reached through ctx.
+
+  python3 command_registry.py            # lists the commands it finds
+  python3 command_registry.py --demo     # coalesces a sample burst
+"""
+import glob
+import importlib
+import os
+import sys
+
+# --- CONFIGURATION ---
+HANDLER_PATTERN = "cmd_*.py"
+TYPES = {"str": str, "int": int, "float": float}
+
+
+class CommandError(Exception):
+    """Unknown command or bad arguments; the message is sent back as a LOG line."""
+
+
+def command(module, action, args=(), defaults=None, resources=(), coalesce=None, lead=0.0, help=""):
+    """Marks a function as the handler of CMD:<module>:<action>."""
+    def mark(func):
+        specs = getattr(func, "_commands", [])
+        specs.append((module.upper(), action.upper(), tuple(args), dict(defaults or {}),
+                      tuple(resources), coalesce, lead, help or (func.__doc__ or "").strip()))
+        func._commands = specs
+        return func
+    return mark
+
+
+def compile_args(schema, defaults):
+    """Turns the schema strings into [(name, convert, optional, default)] + rest flag."""
+    fields, rest = [], False
+    for i, spec in enumerate(schema):
+        if spec.startswith("*"):
+            if i != len(schema) - 1:
+                raise ValueError(f"'{spec}' must be the last argument")
+            rest, spec = True, spec[1:]
+        optional = spec.endswith("?")
+        name, _, type_name = spec.rstrip("?").partition(":")
+        if (type_name or "str") not in TYPES:
+            raise ValueError(f"unknown type in '{spec}'")
+        fields.append((name, TYPES[type_name or "str"], optional or name in defaults, defaults.get(name)))
+    return fields, rest
+
+
+class Command:
+    def __init__(self, module, action, func, schema, defaults, resources, coalesce, lead, help, source):
+        self.module = module
+        self.action = action
+        self.func = func
+        self.schema = schema
+        self.fields, self.rest = compile_args(schema, defaults)
+        self.resources = resources
+        self.coalesce = coalesce
+        self.lead = lead
+        self.help = help
+        self.source = source
+
+    def parse(self, fields):
+        values = []
+        for i, (name, convert, optional, default) in enumerate(self.fields):
+            if self.rest and i == len(self.fields) - 1:
+                raw = ':'.join(fields[i:])
+            else:
+                raw = fields[i] if i < len(fields) else ''
+            if raw == '':
+                if not optional:
+                    raise CommandError(f"{self.module}:{self.action} needs <{name}>")
+                values.append(default)
+                continue
+            try:
+                values.append(convert(raw))
+            except ValueError:
+                raise CommandError(f"{self.module}:{self.action} bad {name} '{raw}'")
+        return values
+
+    def usage(self):
+        args = ''.join(f":<{s}>" for s in self.schema)
+        res = f" [{', '.join(self.resources)}]" if self.resources else ""
+        last = f" (last wins: {self.coalesce})" if self.coalesce else ""
+        return f"CMD:{self.module}:{self.action}{args}{res}{last}"
+
+
+class Registry:
+    def __init__(self, directory=None, pattern=HANDLER_PATTERN):
+        self.directory = os.path.abspath(directory or os.path.dirname(__file__))
+        self.pattern = pattern
+        self.table = {}       # (MODULE, ACTION) -> Command
+        self.modules = {}     # module name -> (module, mtime)
+        self.generation = 0   # Bumped on every successful (re)load
+        if self.directory not in sys.path:
+            sys.path.insert(0, self.directory)
+
+    # --- LOADING ---
+    def _files(self):
+        return sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+
+    def changed(self):
+        """Handler files that are new, modified or deleted since the last load."""
+        found = {os.path.basename(p)[:-3]: os.path.getmtime(p) for p in self._files()}
+        out = [n for n, m in found.items() if n not in self.modules or self.modules[n][1] != m]
+        return out + [n for n in self.modules if n not in found]
+
+    def load(self, force=False):
+        """(Re)imports changed handler modules and swaps in a new table.
+
+        Returns (reloaded module names, None) or ([], error message); on error
+        the current table stays in place.
+        """
+        names = [os.path.basename(p)[:-3] for p in self._files()] if force else self.changed()
+        if not names:
+            return [], None
+        modules = dict(self.modules)
+        try:
+            for name in names:
+                path = os.path.join(self.directory, name + ".py")
+                if not os.path.exists(path):
+                    modules.pop(name, None)
+                    sys.modules.pop(name, None)
+                    continue
+                mtime = os.path.getmtime(path)
+                if name in sys.modules:
+                    mod = importlib.reload(sys.modules[name])
+                else:
+                    mod = importlib.import_module(name)
+                modules[name] = (mod, mtime)
+            table = self._build(modules)
+        except Exception as e:  # SyntaxError, ImportError, bad schema, clashes
+            return [], f"{type(e).__name__}: {e}"
+        self.modules, self.table = modules, table   # One assignment: dispatch never sees half a table
+        self.generation += 1
+        return names, None
+
+    def _build(self, modules):
+        table = {}
+        for name, (mod, _) in modules.items():
+            for obj in vars(mod).values():
+                for module, action, schema, defaults, resources, coalesce, lead, help in getattr(obj, "_commands", ()):
+                    if getattr(obj, "__module__", None) != mod.__name__:
+                        continue  # Imported from another handler file
+                    key = (module, action)
+                    if key in table:
+                        raise ValueError(f"CMD:{module}:{action} defined in {table[key].source} and {name}")
+                    table[key] = Command(module, action, obj, schema, defaults, resources, coalesce, lead, help, name)
+        return table
+
+    # --- DISPATCH ---
+    def lookup(self, module, action):
+        table = self.table
+        return table.get((module, action)) or table.get((module, '*'))
+
+    def dispatch(self, ctx, line):
+        """Runs one CMD:<MODULE>:<ACTION>[:args] line. Returns False if it
+        isn't a command; raises CommandError for unknown commands/bad args."""
+        parts = line.split(':')
+        if len(parts) < 3 or parts[0] != 'CMD':
+            return False
+        module, action = parts[1].upper(), parts[2].upper()
+        cmd = self.lookup(module, action)
+        if cmd is None:
+            raise CommandError(f"Unknown command {module}:{action}")
+        if cmd.action == '*':
+            cmd.func(ctx, action, *cmd.parse(parts[3:]))
+        else:
+            cmd.func(ctx, *cmd.parse(parts[3:]))
+        return True
+
+    def coalesce(self, lines):
+        """Drops superseded commands from a burst.
+
+        Returns (lines to run in order, {"MODULE:ACTION": dropped count}).
+        A command with bad arguments never supersedes anything.
+        """
+        last = {}      # coalesce target -> index of the command that wins
+        targets = []
+        for i, line in enumerate(lines):
+            target = None
+            parts = line.split(':')
+            if len(parts) >= 3 and parts[0] == 'CMD':
+                cmd = self.lookup(parts[1].upper(), parts[2].upper())
+                if cmd is not None and cmd.coalesce:
+                    try:
+                        cmd.parse(parts[3:])
+                        target = cmd.coalesce
+                    except CommandError:
+                        pass
+            targets.append(target)
+            if target:
+                last[target] = i
+        kept, dropped = [], {}
+        for i, (line, target) in enumerate(zip(lines, targets)):
+            if target and last[target] != i:
+                name = ':'.join(p.upper() for p in line.split(':')[1:3])
+                dropped[name] = dropped.get(name, 0) + 1
+            else:
+                kept.append(line)
+        return kept, dropped
+
+    def commands(self):
+        return [self.table[k] for k in sorted(self.table)]
+
+
+DEMO_BURST = [
+    "CMD:GPIO:BLINK:0.5", "CMD:GPIO:BLINK:0.2", "CMD:PWM:FASTER", "CMD:PWM:FASTER",
+    "CMD:SPI:APPEND:temps:21.5", "CMD:GPIO:BLINK:fast", "CMD:TELEMETRY:RATE:5",
+    "CMD:GPIO:OFF", "CMD:TELEMETRY:RATE:20", "CMD:I2C:CLOCK",
+]
+
+
+if __name__ == '__main__':
+    reg = Registry()
+    loaded, err = reg.load()
+    if err:
+        print(f"Load failed: {err}")
+        sys.exit(1)
+    if '--demo' in sys.argv:
+        kept, dropped = reg.coalesce(DEMO_BURST)
+        for line in DEMO_BURST:
+            print(f"  {line:28} {'run' if line in kept else 'superseded'}")
+        print(f"{len(DEMO_BURST)} commands -> {len(kept)} run, dropped {dropped}")
+        sys.exit(0)
+    for cmd in reg.commands():
+        print(f"{cmd.usage():55} {cmd.source}")
@@ -0,0 +1,323 @@
+"""
+delta_sync.py - rsync-style file updates over the UART (shared by both sides)
+
+Deploying a fix to a Pi-side file used to mean logging in to the Pi. Now the
+master pushes it through the serial link and sends only what changed:
+
+  1. PC -> CMD:UPD:SIG:<file>             Pi answers with the file's signature:
+     Pi -> UPD_SIG:<file>:<size>:<block>:<sha256>:<blocks>
+           UPD_SIGB:<file>:<first block>:<base64 of (weak u32, strong 8 bytes) per block>
+  2. The PC slides over its new version with the rsync rolling checksum
+     (a = sum of bytes, b = sum of weighted bytes, both mod 2**16, updated in
+     O(1) per byte). A block whose weak sum matches and whose strong hash
+     (BLAKE2b, 8 bytes) matches too is sent as "copy block i"; everything
+     else goes as literal bytes. The delta is zlib-compressed.
+     PC -> CMD:UPD:PUT:<file>:<offset>:<base64>   (chunks of the delta)
+     PC -> CMD:UPD:APPLY:<file>:<new size>:<new sha256>:<old sha256>
+  3. The Pi rebuilds the file from its current copy + the delta and checks:
+       * the old SHA-256 (the file didn't change since the signature)
+       * the new SHA-256 and size
+       * that a .py file still compiles
+     Only then does it write a temp file, fsync it and os.replace() it over
+     the old one. The file is either the old or the new version, never half.
+     Then only what uses the file restarts (see main_listener.after_update):
+     cmd_*.py -> handler reload; the running worker if it is or imports the
+     file; the listener itself (re-exec) if it imports it.
+     Pi -> UPD_DONE:<file>:<size>:<sha256 prefix>:<what was restarted>  or  UPD_FAIL:<file>:<reason>
+
+Block size is sqrt(size * signature bytes per block), clamped to
+BLOCK_MIN..BLOCK_MAX. That balances the signature the Pi sends against the
+literal block a one-line change costs.
+
+    updater = Updater(send=link.send)       # + updater.handle_line(line) in the line handler
+    updater.push("gpio_blink.py", open("gpio_blink.py", "rb").read())
+
+  python3 delta_sync.py --bench                      # bytes and time at 115200 baud vs whole files
+  python3 delta_sync.py --push gpio_blink.py ...     # through the running flask_app.py (POST /update)
+"""
+import base64
+import hashlib
+import math
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# --- CONFIGURATION ---
+BLOCK_MIN = 64
+BLOCK_MAX = 4096
+STRONG_BYTES = 8
+SIG = struct.Struct(">I8s")     # weak, strong per block
+SIG_PER_LINE = 16               # Blocks per UPD_SIGB line
+CHUNK = 180                     # Delta bytes per CMD:UPD:PUT line
+MOD = 1 << 16
+TIMEOUT = 10.0                  # Seconds to wait for each answer from the Pi
+PUSH_URL = "http://localhost:5000/update"
+
+
+# --- ALGORITHM ---
+def block_size(size):
+    b = int(math.sqrt(size * SIG.size))
+    return max(BLOCK_MIN, min(BLOCK_MAX, (b + 63) // 64 * 64))
+
+
+def weak_sum(data):
+    """rsync weak checksum: (b << 16) | a."""
+    n = len(data)
+    a = sum(data) % MOD
+    b = sum((n - i) * x for i, x in enumerate(data)) % MOD
+    return (b << 16) | a
+
+
+def strong_sum(data):
+    return hashlib.blake2b(data, digest_size=STRONG_BYTES).digest()
+
+
+def signature(data, block=None):
+    """-> (block size, [(weak, strong)]) of data's blocks (the last may be short)."""
+    block = block or block_size(len(data))
+    return block, [(weak_sum(data[i:i + block]), strong_sum(data[i:i + block]))
+                   for i in range(0, len(data), block)]
+
+
+def make_delta(new, block, sigs, old_size):
+    """new + the old file's signature -> compressed delta."""
+    index = {}
+    full = old_size // block     # Blocks of full length; a short tail is matched separately
+    for i, (weak, strong) in enumerate(sigs[:full]):
+        index.setdefault(weak, []).append((i, strong))
+    tail = sigs[full] if len(sigs) > full else None
+    tail_len = old_size - full * block
+
+    out = bytearray()
+    literal = bytearray()
+    run = None                   # [first block, count] being extended
+
+    def flush_literal():
+        if literal:
+            out.extend(b"L" + struct.pack(">I", len(literal)) + literal)
+            literal.clear()
+
+    def flush_run():
+        nonlocal run
+        if run:
+            out.extend(b"C" + struct.pack(">IH", *run))
+            run = None
+
+    def copy(i):
+        nonlocal run
+        flush_literal()
+        if run and run[0] + run[1] == i and run[1] < 0xFFFF:
+            run[1] += 1
+        else:
+            flush_run()
+            run = [i, 1]
+
+    n, pos = len(new), 0
+    a = b = None
+    while pos + block <= n:
+        if a is None:
+            w = weak_sum(new[pos:pos + block])
+            a, b = w & 0xFFFF, w >> 16
+        hit = None
+        for i, strong in index.get((b << 16) | a, ()):
+            if strong_sum(new[pos:pos + block]) == strong:
+                hit = i
+                break
+        if hit is not None:
+            copy(hit)
+            pos += block
+            a = None
+            continue
+        flush_run()
+        x = new[pos]
+        literal.append(x)
+        if pos + block < n:
+            a = (a - x + new[pos + block]) % MOD       # Roll one byte forward
+            b = (b - block * x + a) % MOD
+        else:
+            a = None
+        pos += 1
+    rest = new[pos:]
+    if tail and len(rest) == tail_len and weak_sum(rest) == tail[0] and strong_sum(rest) == tail[1]:
+        copy(full)
+    else:
+        flush_run()
+        literal.extend(rest)
+    flush_literal()
+    flush_run()
+    return zlib.compress(bytes(out), 9)
+
+
+def apply_delta(old, block, delta):
+    data = zlib.decompress(delta)
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        op = data[pos:pos + 1]
+        if op == b"C":
+            first, count = struct.unpack_from(">IH", data, pos + 1)
+            out += old[first * block:(first + count) * block]
+            pos += 7
+        elif op == b"L":
+            (length,) = struct.unpack_from(">I", data, pos + 1)
+            out += data[pos + 5:pos + 5 + length]
+            pos += 5 + length
+        else:
+            raise ValueError(f"bad delta op at {pos}")
+    return bytes(out)
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# --- PROTOCOL (Pi side builds these lines, PC side parses them) ---
+def signature_lines(name, data):
+    block, sigs = signature(data)
+    lines = [f"UPD_SIG:{name}:{len(data)}:{block}:{sha256(data)}:{len(sigs)}"]
+    for k in range(0, len(sigs), SIG_PER_LINE):
+        packed = b"".join(SIG.pack(*s) for s in sigs[k:k + SIG_PER_LINE])
+        lines.append(f"UPD_SIGB:{name}:{k}:{base64.b64encode(packed).decode()}")
+    return lines
+
+
+def delta_lines(name, delta):
+    return [f"CMD:UPD:PUT:{name}:{off}:{base64.b64encode(delta[off:off + CHUNK]).decode()}"
+            for off in range(0, len(delta), CHUNK)]
+
+
+class Updater:
+    """Master side: pushes files one at a time. send(line) -> 'sent' / 'queued'."""
+
+    def __init__(self, send, timeout=TIMEOUT):
+        self.send = send
+        self.timeout = timeout
+        self.lock = threading.Lock()      # One push at a time
+        self.cond = threading.Condition()
+        self.name = None
+        self.sig = None                   # {size, block, sha, count, blocks{}}
+        self.result = None
+        self.rx_bytes = 0                 # UPD_* bytes received for the current push
+
+    def handle_line(self, line):
+        """Feeds UPD_* lines from the Pi; True if consumed."""
+        if not line.startswith("UPD_"):
+            return False
+        kind, rest = line.split(":", 1)
+        name, _, rest = rest.partition(":")
+        with self.cond:
+            if name != self.name:
+                return True   # Answer to an abandoned push
+            self.rx_bytes += len(line) + 1
+            if kind == "UPD_SIG":
+                size, block, sha, count = rest.split(":")
+                self.sig = {"size": int(size), "block": int(block), "sha": sha, "count": int(count), "blocks": {}}
+            elif kind == "UPD_SIGB" and self.sig is not None:
+                first, data = rest.split(":", 1)
+                raw = base64.b64decode(data)
+                for k in range(len(raw) // SIG.size):
+                    self.sig["blocks"][int(first) + k] = SIG.unpack_from(raw, k * SIG.size)
+            elif kind in ("UPD_DONE", "UPD_FAIL"):
+                self.result = (kind == "UPD_DONE", rest)
+            self.cond.notify_all()
+        return True
+
+    def push(self, name, new):
+        """Updates <name> on the Pi to the bytes new. Returns a stats dict; raises RuntimeError."""
+        with self.lock:
+            t0 = time.monotonic()
+            with self.cond:
+                self.name, self.sig, self.result, self.rx_bytes = name, None, None, 0
+            try:
+                self._send(f"CMD:UPD:SIG:{name}")
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.result or (
+                            self.sig and len(self.sig["blocks"]) == self.sig["count"]), self.timeout):
+                        raise RuntimeError(f"{name}: no signature from the Pi")
+                    if self.result:
+                        raise RuntimeError(f"{name}: {self.result[1]}")
+                    sig = self.sig
+                t_sig = time.monotonic()
+                if sig["sha"] == sha256(new):
+                    return {"file": name, "unchanged": True, "size": len(new), "seconds": round(t_sig - t0, 3)}
+                blocks = [sig["blocks"][i] for i in range(sig["count"])]
+                delta = make_delta(new, sig["block"], blocks, sig["size"])
+                lines = delta_lines(name, delta)
+                lines.append(f"CMD:UPD:APPLY:{name}:{len(new)}:{sha256(new)}:{sig['sha']}")
+                for line in lines:
+                    self._send(line)
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.result, self.timeout):
+                        raise RuntimeError(f"{name}: no answer to APPLY")
+                    ok, info = self.result
+                if not ok:
+                    raise RuntimeError(f"{name}: {info}")
+                return {
+                    "file": name, "size": len(new), "delta_bytes": len(delta),
+                    "link_bytes": self.rx_bytes + sum(len(l) + 1 for l in lines) + len(f"CMD:UPD:SIG:{name}\n"),
+                    "whole_file_bytes": sum(len(l) + 1 for l in delta_lines(name, new)),
+                    "restarted": info.split(":")[-1], "seconds": round(time.monotonic() - t0, 3),
+                }
+            finally:
+                with self.cond:
+                    self.name = None
+
+    def _send(self, line):
+        if self.send(line) != 'sent':
+            raise RuntimeError("serial link is down (or its send buffer is full)")
+
+
+# --- BENCH ---
+def one_line_fix(data):
+    """Changes one line in the middle of a file, as a small fix would."""
+    lines = data.split(b"\n")
+    k = len(lines) // 2
+    lines[k] = lines[k] + b"  # fixed"
+    return b"\n".join(lines)
+
+
+def run_bench(baud=115200, files=("gpio_blink.py", "main_listener.py", "uart_mux.py", "flask_app.py")):
+    import os
+    here = os.path.dirname(os.path.abspath(__file__))
+    wire = lambda n: n * 10 / baud
+    print(f"One-line fix pushed over {baud} baud (signature + delta lines vs the whole file in base64 lines)")
+    for name in files:
+        old = open(os.path.join(here, name), "rb").read()
+        new = one_line_fix(old)
+        t = time.perf_counter()
+        sig_lines = signature_lines(name, old)
+        block, sigs = signature(old)
+        t_sig = time.perf_counter() - t
+        t = time.perf_counter()
+        delta = make_delta(new, block, sigs, len(old))
+        t_delta = time.perf_counter() - t
+        assert apply_delta(old, block, delta) == new
+        up = delta_lines(name, delta) + [f"CMD:UPD:APPLY:{name}:{len(new)}:{sha256(new)}:{sha256(old)}"]
+        link = sum(len(l) + 1 for l in sig_lines) + sum(len(l) + 1 for l in up) + len(f"CMD:UPD:SIG:{name}\n")
+        whole = sum(len(l) + 1 for l in delta_lines(name, new))
+        print(f"  {name:18} {len(old):6} B, block {block:4}: signature {len(sigs):3} blocks, delta {len(delta):4} B "
+              f"-> {link:6} B on the link = {1000 * wire(link):5.0f} ms (+{1000 * (t_sig + t_delta):.0f} ms CPU)  "
+              f"| whole file {whole:6} B = {1000 * wire(whole):6.0f} ms")
+
+
+def run_push(paths, url=PUSH_URL):
+    import json
+    import os
+    import urllib.request
+    files = {os.path.basename(p): base64.b64encode(open(p, "rb").read()).decode() for p in paths}
+    req = urllib.request.Request(url, data=json.dumps({"files": files}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=60 * len(files)) as r:
+        for item in json.loads(r.read()):
+            print(item)
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+    elif len(sys.argv) > 2 and sys.argv[1] == '--push':
+        run_push(sys.argv[2:])
+    else:
+        print("Usage: python3 delta_sync.py --bench | --push <file> ...")
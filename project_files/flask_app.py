@@ -1,8 +1,19 @@
-import serial
+import base64
+import re
 import threading
 import time
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, render_template_string, request, jsonify, Response, stream_with_context
 from flask_socketio import SocketIO
+import boot_state
+import sd_transfer
+import seqc
+import clock_sync
+import delta_sync
+import gpio_capture
+import link_health
+import serial_link
+import telemetry
+import uart_mux
 
 app = Flask(__name__)
 socketio = SocketIO(app)
@@ -11,13 +22,25 @@ socketio = SocketIO(app)
 # CHANGE THIS to your USB-Serial port (e.g., 'COM3' on Windows, '/dev/ttyUSB0' on Linux)
 SERIAL_PORT = 'COM3' 
 BAUD_RATE = 115200
+# Optional: follow the adapter itself, whatever port it enumerates as.
+# e.g. ADAPTER_VID_PID = '0403:6001' (FTDI), '10C4:EA60' (CP210x), '1A86:7523' (CH340)
+ADAPTER_VID_PID = None
+ADAPTER_SERIAL = None   # USB serial number, to pick one adapter out of several
+# Channelised link (see uart_mux.py); must match UART_MUX in main_listener.py
+UART_MUX = True
 
-try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    print(f"✅ Connected to {SERIAL_PORT}")
-except:
-    print(f"❌ Could not connect to {SERIAL_PORT}. Running in simulation mode.")
-    ser = None
+# Reassembles chunked SD reads into ./downloads as they stream in
+assembler = sd_transfer.ChunkAssembler(
+    "downloads", retry_after=lambda: health.timeout(sd_transfer.RESUME_RETRY_S))
+
+# Recent telemetry per variable (NumPy rings), served downsampled to the chart width
+live = telemetry.TelemetryStore()
+
+# Recent input edges from CMD:GPIO:CAPTURE (EDGES: frames)
+edges = gpio_capture.EdgeLog()
+
+# The Pi listener's last start-up: ms per stage, ready / restored (see boot_state.py)
+pi_boot = {}
 
 # --- EMBEDDED FRONTEND (HTML/JS/CSS) ---
 HTML_TEMPLATE = """
@@ -42,6 +65,7 @@ HTML_TEMPLATE = """
 </head>
 <body>
     <h1>📟 Micro-SCADA Dashboard</h1>
+    <div class="status" id="linkStatus">Link: checking...</div>
     
     <div class="container">
         <div class="card">
@@ -62,6 +86,10 @@ HTML_TEMPLATE = """
             <br><br>
             <button onclick="sendCommand('CMD:PWM:START')">Start Breathing</button>
             <button onclick="sendCommand('CMD:PWM:STOP')">Stop</button>
+            <hr>
+            <label>Measure input on GPIO:</label>
+            <input type="number" id="measurePin" value="5" min="0" max="27">
+            <button onclick="sendCommand('CMD:PWM:MEASURE:' + document.getElementById('measurePin').value)">Measure</button>
         </div>
 
         <div class="card">
@@ -82,7 +110,35 @@ HTML_TEMPLATE = """
             <button onclick="sendCommand('CMD:SPI:WRITE:' + document.getElementById('fileName').value + ':' + document.getElementById('fileData').value)">Write Data</button>
             <br>
             <button onclick="sendCommand('CMD:SPI:READ:' + document.getElementById('fileName').value)">Read File</button>
-            <button onclick="sendCommand('CMD:SPI:LIST')">List All Files</button>
+            <button onclick="window.open('/files/' + encodeURIComponent(document.getElementById('fileName').value))">Download</button>
+            <br>
+            <input type="text" id="listFilter" placeholder="prefix or *.log">
+            <button onclick="listFiles('')">List Files</button>
+            <button onclick="listFiles(nextCursor)">Next Page</button>
+        </div>
+
+        <div class="card">
+            <h2>Sequence Program</h2>
+            <input type="text" id="seqName" value="pattern">
+            <textarea id="seqSource" rows="7" style="width:100%; background:#000; color:#0f0;">loop 10
+  set 17 on
+  wait 100ms
+  set 17 off
+  wait 400ms
+end
+event "done"</textarea>
+            <button onclick="runSequence()">Upload &amp; Run</button>
+            <button onclick="sendCommand('CMD:SEQ:STOP')">Stop</button>
+            <div class="status" id="seqStatus"></div>
+        </div>
+
+        <div class="card">
+            <h2>Live Telemetry</h2>
+            <select id="liveVar"></select>
+            <select id="liveSpan"><option value="10">10 s</option><option value="60" selected>1 min</option><option value="120">2 min</option></select>
+            <select id="liveMethod"><option value="lttb">LTTB</option><option value="minmax">min/max</option></select>
+            <canvas id="liveChart" width="300" height="120" style="background:#000; margin-top:8px;"></canvas>
+            <div class="status" id="liveValue"></div>
         </div>
     </div>
 
@@ -102,11 +158,93 @@ HTML_TEMPLATE = """
             addLog(">> SENT: " + cmd);
         }
 
+        // Compiled on the PC, uploaded in a few lines and run on the Pi in one go
+        function runSequence() {
+            fetch('/seq/' + encodeURIComponent(document.getElementById('seqName').value), {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({source: document.getElementById('seqSource').value, run: true})
+            }).then(r => r.json()).then(d => {
+                document.getElementById('seqStatus').innerText =
+                    d.error ? d.error : d.bytes + ' bytes, ' + d.instructions + ' instructions, ' + d.lines + ' lines';
+            });
+        }
+
+        // LIST is paginated: remember where the last page ended
+        var nextCursor = '';
+        function listFiles(cursor) {
+            sendCommand('CMD:SPI:LIST:' + document.getElementById('listFilter').value + ':name:' + cursor);
+        }
+
         // Receive Log from Flask
         socket.on('new_log', function(msg) {
-            addLog("<< RECV: " + msg.data);
+            var page = msg.data.indexOf('FILE_PAGE:');
+            if (page >= 0) {
+                var cur = msg.data.substring(page).split(':')[2];
+                nextCursor = (cur === '-') ? '' : cur;
+            }
+            addLog((msg.t ? '[' + new Date(msg.t * 1000).toISOString().substring(11, 23) + '] ' : '') +
+                   "<< RECV: " + msg.data);
         });
 
+        // Live chart: the server reduces the series to one point per canvas pixel
+        function refreshVars() {
+            fetch('/telemetry').then(r => r.json()).then(vars => {
+                var sel = document.getElementById('liveVar');
+                Object.keys(vars).forEach(function(name) {
+                    if (![...sel.options].some(o => o.value === name)) sel.add(new Option(name, name));
+                });
+            });
+        }
+        function drawChart() {
+            var name = document.getElementById('liveVar').value;
+            if (!name) return;
+            var canvas = document.getElementById('liveChart');
+            var url = '/telemetry/' + encodeURIComponent(name) + '?width=' + canvas.width +
+                      '&seconds=' + document.getElementById('liveSpan').value +
+                      '&method=' + document.getElementById('liveMethod').value;
+            fetch(url).then(r => r.json()).then(d => {
+                var ctx = canvas.getContext('2d');
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                if (!d.t || !d.t.length) return;
+                var t0 = d.t[0], dt = (d.t[d.t.length - 1] - t0) || 1;
+                var lo = Math.min(...d.v), hi = Math.max(...d.v), dv = (hi - lo) || 1;
+                ctx.strokeStyle = '#0f0';
+                ctx.beginPath();
+                d.t.forEach(function(t, i) {
+                    var x = (t - t0) / dt * (canvas.width - 1);
+                    var y = canvas.height - 2 - (d.v[i] - lo) / dv * (canvas.height - 4);
+                    i ? ctx.lineTo(x, y) : ctx.moveTo(x, y);
+                });
+                ctx.stroke();
+                document.getElementById('liveValue').innerText = name + ' = ' + d.v[d.v.length - 1] +
+                    '  (' + d.raw_points + ' samples -> ' + d.t.length + ' points, ' + lo + '..' + hi + ')';
+            });
+        }
+        refreshVars();
+        setInterval(refreshVars, 5000);
+        setInterval(drawChart, 500);
+
+        // Heartbeat-based link state (RTT, jitter, loss, frame errors)
+        function refreshLink() {
+            fetch('/link_status').then(r => r.json()).then(s => {
+                var h = s.health, el = document.getElementById('linkStatus');
+                var text = 'Link: ' + (s.connected ? h.state : 'unplugged');
+                if (s.connected && h.srtt_ms !== null) {
+                    text += ' | RTT ' + h.srtt_ms + ' ms \u00b1 ' + h.rttvar_ms + ' | jitter ' + h.jitter_ms +
+                            ' ms | timeout ' + h.rto_ms + ' ms | loss ' + (100 * h.loss).toFixed(1) + '%';
+                    if (h.fer !== null) text += ' | FER ' + (100 * h.fer).toFixed(2) + '%';
+                }
+                if (s.clock.synced) text += ' | Pi clock ' + (s.clock.offset_us / 1e6).toFixed(6) + ' s \u00b1 ' +
+                                            s.clock.error_bound_us + ' us';
+                if (s.queued) text += ' | ' + s.queued + ' queued';
+                el.innerText = text;
+                el.style.color = (s.connected && h.state === 'up') ? '#0f0' : (h.state === 'degraded' ? '#fc0' : '#f44');
+            });
+        }
+        refreshLink();
+        setInterval(refreshLink, 1000);
+
         function addLog(text) {
             var logDiv = document.getElementById("logs");
             logDiv.innerHTML += "<div>" + text + "</div>";
@@ -122,33 +260,235 @@ HTML_TEMPLATE = """
 def index():
     return render_template_string(HTML_TEMPLATE)
 
+def send_to_pi(cmd):
+    """Writes one command line to the Pi ('sent'), or queues it while the adapter is unplugged ('queued')."""
+    return link.send(cmd)
+
+def pi_time(at):
+    """Unix time -> Pi clock (us), or None before the clock is synced."""
+    return sync.to_remote(clock_sync.now_us() + int((at - time.time()) * 1e6))
+
+def pc_time(pi_us):
+    """Pi clock (us) -> Unix time, or None before the clock is synced."""
+    local = sync.to_local(pi_us)
+    return None if local is None else time.time() + (local - clock_sync.now_us()) / 1e6
+
 @app.route('/send_command', methods=['POST'])
 def send_command():
+    """{command, [at: unix time]}: with 'at' the Pi runs it at that moment on its synced clock."""
     data = request.json
     cmd = data.get('command')
-    if ser and ser.is_open:
-        ser.write((cmd + '\n').encode('utf-8'))
+    if data.get('at') is not None:
+        due = pi_time(float(data['at']))
+        if due is None:
+            return jsonify({"status": "error", "cmd": cmd, "msg": "Pi clock not synced yet"}), 409
+        cmd = f"AT:{due}:{cmd}"
+    status = send_to_pi(cmd)
+    if status == 'sent':
         return jsonify({"status": "sent", "cmd": cmd})
-    return jsonify({"status": "error", "msg": "Serial not connected"})
+    return jsonify({"status": status, "cmd": cmd, "msg": "Serial not connected, will send on reconnect"})
+
+@app.route('/seq/<name>', methods=['POST'])
+def upload_sequence(name):
+    """{source, [run], [at: unix time]}: compiles a sequence program and uploads it to the Pi."""
+    data = request.json
+    try:
+        code = seqc.compile_source(data.get('source', ''))
+    except seqc.SeqError as e:
+        return jsonify({"error": str(e)}), 400
+    lines = seqc.upload_lines(name, code)
+    if data.get('run'):
+        run = f"CMD:SEQ:RUN:{name}"
+        if data.get('at') is not None:
+            due = pi_time(float(data['at']))
+            if due is None:
+                return jsonify({"error": "Pi clock not synced yet"}), 409
+            run = f"AT:{due}:{run}"
+        lines.append(run)
+    statuses = [send_to_pi(line) for line in lines]
+    return jsonify({"status": "sent" if all(st == 'sent' for st in statuses) else "queued",
+                    "bytes": len(code), "instructions": len(seqc.decode(code)[1]), "lines": len(lines)})
+
+@app.route('/update', methods=['POST'])
+def update_files():
+    """{files: {name: base64 content}} -> pushes each file to the Pi as an rsync-style delta.
+
+    Used by `python3 delta_sync.py --push <file> ...`. Blocks until the Pi has
+    installed (or refused) every file."""
+    results = []
+    for name, content in request.json.get('files', {}).items():
+        try:
+            results.append(updater.push(name, base64.b64decode(content)))
+        except RuntimeError as e:
+            results.append({"file": name, "error": str(e)})
+        socketio.emit('new_log', {'data': f"Update {name}: {results[-1]}"})
+    return jsonify(results)
+
+@app.route('/link_status')
+def link_status():
+    """Connection state, queued commands, the disconnect history, heartbeat health and the Pi's last boot."""
+    return jsonify(dict(link.status(), health=health.status(), clock=sync.status(), boot=pi_boot))
+
+@app.route('/gpio/edges')
+def gpio_edges():
+    """?n=<count>&pin=<bcm> -> the latest captured input edges, on PC time (null before clock sync)."""
+    pin = request.args.get('pin')
+    recent = edges.recent(int(request.args.get('n', 100)), int(pin) if pin else None)
+    return jsonify({"edges": [{"t": pc_time(t // 1000), "pi_ns": t, "pin": p, "level": level}
+                              for t, p, level in recent], "stats": edges.stats})
+
+@app.route('/telemetry')
+def telemetry_vars():
+    """Latest value of every live variable."""
+    return jsonify(live.variables())
+
+@app.route('/telemetry/<name>')
+def telemetry_chart(name):
+    """?width=<px>&seconds=<span>&method=lttb|minmax -> {t: [...], v: [...]}, about width points."""
+    method = request.args.get('method', 'lttb')
+    if method not in telemetry.METHODS:
+        return jsonify({"error": f"method must be one of {list(telemetry.METHODS)}"}), 400
+    width = min(max(int(request.args.get('width', 800)), 3), 4000)
+    chart = live.chart(name, width, float(request.args.get('seconds', 60)), method)
+    if chart is None:
+        return jsonify({"error": f"no telemetry for {name}"}), 404
+    return jsonify(chart)
+
+@app.route('/files/<fname>')
+def download_file(fname):
+    """Serves an SD file over HTTP while its chunks are still arriving."""
+    state = assembler.files.get(fname)
+    if request.args.get('refresh') or not (state and state['done']):
+        offset = 0 if request.args.get('refresh') else assembler.resume_offset(fname)
+        send_to_pi(resume_command(fname, offset))  # Queued until reconnect if the adapter is out
+        # Make sure there is a spool file to stream from before READ_BEGIN lands
+        open(assembler.spool_path(fname), 'ab').close()
+    return Response(stream_with_context(assembler.iter_file(fname)),
+                    mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename="{fname}"'})
 
 # --- SERIAL LISTENER THREAD ---
-def read_from_serial():
+def resume_command(fname, offset):
+    """READ resumes a stored file (up to the end of the requested range);
+    blocks_<lba>_<count>.img resumes a raw card read."""
+    m = re.fullmatch(r"blocks_(\d+)_(\d+)\.img", fname)
+    if m:
+        return f"CMD:SPI:BLOCK_READ:{m.group(1)}:{m.group(2)}:{offset}"
+    length = assembler.resume_length(fname, offset)
+    return f"CMD:SPI:READ:{fname}:{offset}" + (f":{length}" if length >= 0 else "")
+
+def handle_transfer_line(line):
+    """Routes READ_* lines to the assembler. Returns True if consumed."""
+    result = assembler.handle_line(line)
+    if result is None:
+        return False
+    fname, resume = result
+    if resume is not None:
+        # Bad or missing chunk: pick the stream back up from the verified prefix
+        send_to_pi(resume_command(fname, resume))
+        socketio.emit('new_log', {'data': f"{fname}: {assembler.files[fname]['error']}, resuming at {resume}"})
+    elif line.startswith("READ_END"):
+        state = assembler.files[fname]
+        if state['done']:
+            socketio.emit('new_log', {'data': f"{fname}: {state['received'] - state['start']} bytes received -> /files/{fname}"})
+    return True
+
+def resend_lost_resumes():
+    """Re-sends resume requests the Pi never answered (a lost command line
+    would otherwise stall the download for good)."""
     while True:
-        if ser and ser.is_open:
-            if ser.in_waiting > 0:
-                try:
-                    line = ser.readline().decode('utf-8').strip()
-                    if line:
-                        print(f"UART Received: {line}")
-                        socketio.emit('new_log', {'data': line})
-                except Exception as e:
-                    print(f"Serial Error: {e}")
-        time.sleep(0.1)
+        time.sleep(sd_transfer.RESUME_RETRY_S / 4)
+        for fname, resume in assembler.overdue():
+            send_to_pi(resume_command(fname, resume))
+            socketio.emit('new_log', {'data': f"{fname}: no answer to the resume request, asking again at {resume}"})
+
+def handle_serial_line(line):
+    """Called by the link's reader thread for every line from the Pi."""
+    if line.startswith('HBACK:'):
+        health.on_pong(int(line[6:]))  # Text-link heartbeat reply
+        return
+    if line.startswith('TSYNCR:'):
+        # Text-link clock sync reply; the two lines differ in length, on_reply corrects for it
+        seq, t1, t2, t3 = (int(x) for x in line[7:].split(':'))
+        sync.on_reply(seq, t1, t2, t3, clock_sync.now_us(),
+                      len(f"TSYNC:{seq}:{t1}") + 1, len(line) + 1)
+        return
+    if updater.handle_line(line) and not line.startswith(('UPD_DONE', 'UPD_FAIL')):
+        return  # Signature lines for a running push
+    if edges.handle_line(line):
+        return  # EDGES: input capture frame
+    if live.handle_line(line):
+        return  # TM: telemetry frame (text link only; the mux has its own channel)
+    if not handle_transfer_line(line):
+        t = None
+        m = re.match(r"LOG:@(\d+):", line)
+        if m:
+            # Pi-stamped: shown at the PC time it happened, not when it got here
+            t = pc_time(int(m.group(1)))
+            line = "LOG:" + line[m.end():]
+        if line.startswith("LOG:BOOT_PROFILE:"):
+            pi_boot.clear()
+            pi_boot.update(boot_state.parse_profile(line[17:]))
+        print(f"UART Received: {line}" if t is None else
+              f"UART Received [{time.strftime('%H:%M:%S', time.localtime(t))}{f'{t % 1:.6f}'[1:]}]: {line}")
+        socketio.emit('new_log', {'data': line, 't': t})
+
+def handle_link_state(connected, msg):
+    socketio.emit('new_log', {'data': msg})
+
+def send_heartbeat(seq):
+    """Ping for link_health: a mux 'P' frame, or an HB line on the text link."""
+    if not link.connected:
+        return False
+    if mux:
+        return mux.ping(seq)
+    return link.send(f"HB:{seq}") == 'sent'
+
+def send_time_request(seq):
+    """Clock sync request: a mux 'T' frame (stamped as it goes out), or a TSYNC line."""
+    if not link.connected:
+        return False
+    if mux:
+        return mux.time_request(seq)
+    return link.send(f"TSYNC:{seq}:{clock_sync.now_us()}") == 'sent'
+
+def handle_health_state(state, msg):
+    socketio.emit('new_log', {'data': f"Link {state}: {msg}"})
+
+# Commands go out on the control channel; logs and file data come back on their own
+mux = uart_mux.Mux(BAUD_RATE) if UART_MUX else None
+if mux:
+    for channel in (uart_mux.CONTROL, uart_mux.LOG, uart_mux.BULK):
+        mux.open(channel).on_line = handle_serial_line
+    mux.open(uart_mux.TELEMETRY).on_data = live.feed_stream
+
+# Heartbeats: RTT-based timeouts and dead/degraded link detection within a few RTTs
+health = link_health.LinkHealth(
+    send_heartbeat, on_state=handle_health_state,
+    frame_stats=(lambda: (mux.stats["frames_in"], mux.stats["bad_frames"])) if mux else None)
+if mux:
+    mux.on_pong = health.on_pong
+
+# Pi clock offset + drift, for AT: commands and for placing Pi log lines on our timeline
+sync = clock_sync.ClockSync(send_time_request, BAUD_RATE, on_state=handle_link_state)
+if mux:
+    # T and U frames have the same length, so the wire time cancels out of the offset
+    mux.on_time = lambda *t: sync.on_reply(*t, uart_mux.TIME_FRAME_BYTES, uart_mux.TIME_FRAME_BYTES)
+
+# Pushes changed Pi files as rsync-style deltas (POST /update)
+updater = delta_sync.Updater(send_to_pi)
+
+# Reconnects on its own when the adapter is unplugged or re-enumerates
+link = serial_link.SerialLink(SERIAL_PORT, BAUD_RATE, vid_pid=ADAPTER_VID_PID, serial_number=ADAPTER_SERIAL,
+                              on_line=handle_serial_line, on_state=handle_link_state, mux=mux)
 
 if __name__ == '__main__':
-    # Start serial reading in background
-    t = threading.Thread(target=read_from_serial)
-    t.daemon = True
-    t.start()
+    # Start serial reading (and hotplug watching) in background
+    link.start()
+    health.start()
+    sync.start()
+    threading.Thread(target=resend_lost_resumes, daemon=True).start()
+    if mux:
+        uart_mux.ChannelServer(mux).start()  # pc_chat.py can open the 'chat' channel
     
     socketio.run(app, debug=True, port=5000)
@@ -18,6 +18,16 @@ signal.signal(signal.SIGTERM, cleanup)
 
 try:
     delay = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        # Start time from an AT: command, on CLOCK_MONOTONIC like the listener's
+        start_at = float(sys.argv[2])
+        if start_at < time.monotonic():
+            print(f"Started {1000 * (time.monotonic() - start_at):.1f} ms late (raise START_LEAD in cmd_gpio.py)")
+        left = start_at - time.monotonic()
+        if left > 0.002:
+            time.sleep(left - 0.002)
+        while time.monotonic() < start_at:
+            pass  # Spin the last 2 ms: sleep() can overshoot by a scheduler tick
     
     if delay == 0:
         # Static ON
@@ -30,8 +40,10 @@ try:
         print(f"Blinking LED every {delay} seconds")
         while True:
             GPIO.output(LED_PIN, GPIO.HIGH)
+            print("SAMPLE:gpio_led:1", flush=True)  # Live chart + history, not sent as a log
             time.sleep(delay)
             GPIO.output(LED_PIN, GPIO.LOW)
+            print("SAMPLE:gpio_led:0", flush=True)
             time.sleep(delay)
 
 except Exception as e:
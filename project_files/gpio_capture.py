@@ -0,0 +1,363 @@
+"""
+gpio_capture.py - Timestamped GPIO input capture (WORKER, shared frame format)
+
+Started by CMD:GPIO:CAPTURE:<pins>[:<debounce ms>] (cmd_gpio.py). Watches
+input pins (buttons, encoders, pulse sensors) by edge detection instead of
+polling. RPi.GPIO's event thread calls edge() for every edge, which stamps
+it with time.monotonic_ns(), the clock the listener's LOG:@ stamps use. Edges
+go into a ring buffer allocated once (RING_SIZE): the callback never
+allocates, and if the reader falls behind new edges are counted as lost
+instead of growing memory.
+
+Debounce is done here, not by RPi.GPIO's bouncetime (whole ms, and it hides
+the count). An edge is dropped if it comes within the debounce time of the
+pin's last kept edge, or if it repeats the last kept level.
+
+Every BATCH_S the worker prints what it captured as one line:
+
+    EDGES:<base64>   FRAME (t0 ns u64, edge count u16, edges lost u16), then
+                     per edge: zigzag varint ns since the previous edge,
+                     u8 pin << 1 | level
+
+The listener passes these lines on as they are (no LOG wrapper), and the
+master decodes them with EdgeLog (flask_app.py /gpio/edges). A button edge
+costs about 5 bytes on the wire, and a steady pulse train 4-6.
+
+With --sim (off the Pi) a simulated backend presses a bouncing button on
+each pin twice a second. Without RPi.GPIO and without --sim the worker stops
+with an error, so simulated edges never reach the master as real ones.
+
+  python3 gpio_capture.py <pins, e.g. 22,27> [debounce ms] [--sim]
+  python3 gpio_capture.py --bench      # max edge rate and capture latency (simulated)
+"""
+import base64
+import collections
+import signal
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from tsdb import _zigzag, _unzigzag, _put_varint, _get_varint   # Same varints as telemetry.py
+
+# --- CONFIGURATION ---
+RING_SIZE = 1 << 16        # Edges buffered between batches
+BATCH_S = 0.05             # Seconds between EDGES: lines
+MAX_BATCH = 512            # Edges per line (~2.7 KB of base64 at 4 bytes per edge)
+DEBOUNCE_MS = 2.0
+FRAME_PREFIX = "EDGES:"
+EDGE_HISTORY = 10000       # Edges the master keeps
+LINK_BYTES_S = 115200 / 10
+
+FRAME = struct.Struct(">QHH")
+
+
+# --- FRAMES ---
+def encode_frame(times, codes, lost=0):
+    """EDGES:<base64> line for edges (ns timestamps, pin << 1 | level codes)."""
+    out = bytearray(FRAME.pack(times[0] if len(times) else 0, len(times), min(lost, 0xFFFF)))
+    prev = times[0] if len(times) else 0
+    for t, code in zip(times, codes):
+        _put_varint(out, _zigzag(t - prev))
+        out.append(code)
+        prev = t
+    return FRAME_PREFIX + base64.b64encode(out).decode()
+
+
+def decode_frame(text):
+    """base64 payload -> ([(t_ns, pin, level)], lost). Raises ValueError on a bad frame."""
+    try:
+        data = base64.b64decode(text, validate=True)
+        t, count, lost = FRAME.unpack_from(data)
+        pos, events = FRAME.size, []
+        for _ in range(count):
+            delta, pos = _get_varint(data, pos)
+            t += _unzigzag(delta)
+            code = data[pos]
+            pos += 1
+            events.append((t, code >> 1, code & 1))
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"bad edge frame: {e}")
+    return events, lost
+
+
+# --- CAPTURE ---
+class Capture:
+    """Debounce + ring buffer. edge() runs on the event thread, drain() on ours."""
+
+    def __init__(self, debounce_ms=DEBOUNCE_MS, size=RING_SIZE):
+        self.size = size
+        self.times = array('q', bytes(8 * size))
+        self.codes = bytearray(size)
+        self.head = 0              # Edges written, ever (only edge() moves it)
+        self.tail = 0              # Edges read, ever (only drain() moves it)
+        self.debounce_ns = int(debounce_ms * 1e6)
+        self.last = {}             # pin -> (t_ns, level) of its last kept edge
+        self.stats = {"edges": 0, "bounced": 0, "lost": 0}
+        self.lost_sent = 0
+
+    def edge(self, pin, level, t_ns):
+        last = self.last.get(pin)
+        if last is not None and (level == last[1] or t_ns - last[0] < self.debounce_ns):
+            self.stats["bounced"] += 1
+            return
+        self.last[pin] = (t_ns, level)
+        head = self.head
+        if head - self.tail >= self.size:
+            self.stats["lost"] += 1     # Reader behind: keep the older edges
+            return
+        i = head % self.size
+        self.times[i] = t_ns
+        self.codes[i] = pin << 1 | level
+        self.head = head + 1           # Published last, so drain() never sees a half-written edge
+        self.stats["edges"] += 1
+
+    def drain(self, limit=MAX_BATCH):
+        """Up to limit captured edges as (times array, codes bytes), oldest first."""
+        tail = self.tail
+        n = min(self.head - tail, limit)
+        i, j = tail % self.size, (tail + n) % self.size
+        if n == 0:
+            times, codes = array('q'), b""
+        elif i < j:
+            times, codes = self.times[i:j], bytes(self.codes[i:j])
+        else:
+            times, codes = self.times[i:] + self.times[:j], bytes(self.codes[i:] + self.codes[:j])
+        self.tail = tail + n
+        return times, codes
+
+    def frames(self):
+        """EDGES: lines for everything captured so far."""
+        out = []
+        while True:
+            times, codes = self.drain()
+            lost = self.stats["lost"] - self.lost_sent
+            if not times and not lost:
+                return out
+            self.lost_sent += lost
+            out.append(encode_frame(times, codes, lost))
+            if not times:
+                return out
+
+    def summary(self):
+        return f"CAPTURE_DONE:{self.stats['edges']}:{self.stats['bounced']}:{self.stats['lost']}"
+
+
+# --- BACKENDS ---
+class GPIOBackend:
+    """RPi.GPIO edge detection (one event thread for all pins)."""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        self.pins = []
+
+    def watch(self, pin, on_edge):
+        GPIO, monotonic_ns = self.GPIO, time.monotonic_ns
+
+        def callback(channel):
+            t = monotonic_ns()   # Before anything else: this is the capture latency
+            on_edge(channel, GPIO.input(channel), t)
+
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(pin, GPIO.BOTH, callback=callback)
+        self.pins.append(pin)
+
+    def close(self):
+        for pin in self.pins:
+            self.GPIO.remove_event_detect(pin)
+        self.GPIO.cleanup()
+
+
+class SimBackend:
+    """Edges generated on a thread and delivered like RPi.GPIO's event thread does.
+
+    lag holds how far behind its schedule each edge was delivered (ns): when
+    it grows, edge() can't keep up with the rate."""
+
+    def __init__(self):
+        self.callbacks = {}
+        self.stopped = threading.Event()
+        self.threads = []
+        self.lag = []
+
+    def watch(self, pin, on_edge):
+        self.callbacks[pin] = on_edge
+
+    def play(self, pin, offsets_ns, first_level=1):
+        """Delivers edges at the given ns offsets from now, alternating levels."""
+        def run():
+            on_edge, monotonic_ns, lag = self.callbacks[pin], time.monotonic_ns, self.lag
+            start = monotonic_ns()
+            level = first_level
+            for off in offsets_ns:
+                due = start + off
+                now = monotonic_ns()
+                if due - now > 2000000:
+                    time.sleep((due - now - 1000000) / 1e9)
+                while now < due:
+                    now = monotonic_ns()
+                on_edge(pin, level, now)
+                lag.append(now - due)
+                level ^= 1
+                if self.stopped.is_set():
+                    return
+        thread = threading.Thread(target=run, daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def buttons(self, seconds=3600.0, bounces=3):
+        """A button press and release on every watched pin twice a second, each edge bouncing."""
+        for n, pin in enumerate(self.callbacks):
+            offsets = []
+            for k in range(int(seconds * 2)):
+                t = int((k + n * 0.1) * 5e8)
+                for edge in range(2):
+                    # The real edge, then bounces: pairs 50-150 us apart
+                    offsets += [t + edge * 120000000 + b * 100000 for b in range(2 * bounces + 1)]
+            self.play(pin, offsets)
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(1.0)
+
+
+# --- MASTER SIDE ---
+class EdgeLog:
+    """Decodes EDGES: lines into the last `keep` edges (flask_app.py /gpio/edges)."""
+
+    def __init__(self, keep=EDGE_HISTORY):
+        self.events = collections.deque(maxlen=keep)
+        self.lock = threading.Lock()   # Link reader thread writes, web requests read
+        self.stats = {"frames": 0, "edges": 0, "lost": 0, "bad_frames": 0}
+
+    def handle_line(self, line):
+        """True if the line was an edge frame (consumed)."""
+        if not line.startswith(FRAME_PREFIX):
+            return False
+        try:
+            events, lost = decode_frame(line[len(FRAME_PREFIX):])
+        except ValueError:
+            self.stats["bad_frames"] += 1
+            return True
+        with self.lock:
+            self.events.extend(events)
+            self.stats["frames"] += 1
+            self.stats["edges"] += len(events)
+            self.stats["lost"] += lost
+        return True
+
+    def recent(self, n=100, pin=None):
+        with self.lock:
+            events = [e for e in self.events if pin is None or e[1] == pin]
+        return events[-n:]
+
+
+# --- BENCH ---
+def measure(rate, seconds=1.0, debounce_ms=0.0):
+    """Square wave at rate edges/s on one simulated pin, read the way the worker reads.
+    Returns (edges/s captured, lag p99 / at the end in us, latency p50 / p99 ms, lost, bytes per edge).
+    The lag at the end (median of the last 1% of edges) only grows if capture falls behind."""
+    cap = Capture(debounce_ms)
+    sim = SimBackend()
+    sim.watch(17, cap.edge)
+    n = int(rate * seconds)
+    period = 1e9 / rate
+    sim.play(17, [int(k * period) for k in range(n)])
+    latency, wire, first, last = [], 0, None, None
+    start = time.monotonic()
+    while sim.threads[0].is_alive() or cap.head > cap.tail:
+        time.sleep(BATCH_S)
+        while True:
+            times, codes = cap.drain()
+            if not times:
+                break
+            line = encode_frame(times, codes)
+            now = time.monotonic_ns()
+            first, last = first or times[0], times[-1]
+            wire += len(line) + 1
+            latency.extend(now - t for t in times[::max(1, len(times) // 32)])
+        if time.monotonic() - start > seconds + 5:
+            break
+    sim.close()
+    end = sorted(sim.lag[-max(1, n // 100):])
+    lag, latency = sorted(sim.lag), sorted(latency)
+    return (cap.stats["edges"] / max(1e-9, (last - first) / 1e9 + 1 / rate), lag[int(0.99 * (len(lag) - 1))] / 1000, end[len(end) // 2] / 1000,
+            latency[len(latency) // 2] / 1e6, latency[int(0.99 * (len(latency) - 1))] / 1e6,
+            cap.stats["lost"], wire / max(1, cap.stats["edges"]))
+
+
+def run_bench():
+    print("Edge capture on the simulated backend (one pin, square wave, 1 s per rate)")
+    sys.setswitchinterval(0.0001)   # The generator and the reader share the GIL, as RPi.GPIO's thread does
+    cap = Capture(0.0)
+    t = time.perf_counter()
+    for k in range(200000):
+        cap.edge(17, k & 1, k * 1000)
+        if cap.head - cap.tail > 10000:
+            cap.drain(10000)
+    print(f"  edge() alone: {1e9 * (time.perf_counter() - t) / 200000:.0f} ns per edge")
+    best = None
+    for rate in (1000, 10000, 100000, 200000, 400000, 800000, 1600000):
+        got, lag, behind, p50, p99, lost, per_edge = measure(rate)
+        kept_up = got >= 0.98 * rate and behind < 1000 and not lost
+        print(f"  {rate:7} edges/s: captured {got:8.0f}/s  edge lag p99 {lag:7.1f} us, at the end {behind:8.1f} us  "
+              f"latency p50 {p50:5.1f} ms p99 {p99:5.1f} ms  lost {lost:6}  "
+              f"{per_edge:.1f} B/edge on the link  {'ok' if kept_up else 'falling behind'}")
+        if not kept_up:
+            break       # A faster rate that happens to keep up doesn't make this one sustained
+        best = rate
+    print(f"  sustained up to {best} edges/s in the worker. The UART carries "
+          f"~{LINK_BYTES_S / 5.5:.0f} edges/s at 115200 baud; faster signals are for")
+    print("  on-Pi analysis (pwm_monitor.py MEASURE), not for streaming every edge. Latency is "
+          f"mostly the {BATCH_S * 1000:.0f} ms batch.")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+        sys.exit(0)
+    args = [a for a in sys.argv[1:] if a != '--sim']
+    if not args:
+        print("Usage: python3 gpio_capture.py <pins, e.g. 22,27> [debounce ms] [--sim] | --bench")
+        sys.exit(1)
+    try:
+        pins = [int(p) for p in args[0].split(",")]
+        if not all(0 <= p <= 27 for p in pins):
+            raise ValueError("pins are BCM GPIO numbers 0-27")
+        debounce = float(args[1]) if len(args) > 1 else DEBOUNCE_MS
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    capture = Capture(debounce)
+    if '--sim' in sys.argv:
+        backend = SimBackend()
+    else:
+        try:
+            backend = GPIOBackend()
+        except ImportError:
+            print("Error: RPi.GPIO not installed (run on the Pi, or --sim for simulated buttons)")
+            sys.exit(1)
+    for p in pins:
+        backend.watch(p, capture.edge)
+    if isinstance(backend, SimBackend):
+        backend.buttons()
+
+    def stop(signum, frame):
+        backend.close()
+        for line in capture.frames():
+            print(line)
+        print(capture.summary(), flush=True)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Capturing pins {pins} ({'RPi.GPIO' if isinstance(backend, GPIOBackend) else 'simulated'}, "
+          f"debounce {debounce:g} ms)", flush=True)
+    while True:
+        time.sleep(BATCH_S)
+        for line in capture.frames():
+            print(line, flush=True)   # Through the pipe to the listener: one line per batch
@@ -0,0 +1,249 @@
+"""
+i2c_daemon.py - Multi-sensor I2C polling daemon (WORKER)
+
+Polls many sensors at their own rates on one bus. Every poll round, the
+register blocks of all sensors that are due are packed into as few
+i2c_rdwr() transactions as the kernel allows (write-reg + read pairs,
+up to 42 messages each), instead of one round trip per register.
+
+Samples are timestamped (midpoint of the transaction, time.time_ns())
+and go to:
+  * stdout -> main_listener -> UART  (rate-limited per sensor, uart_hz)
+  * <csv>_YYYYMMDD_n.csv             (rotating, via SDLogWriter)
+  * <binary>_YYYYMMDD_n.bin          (rotating, fixed-header records)
+
+Config (JSON), e.g. sensors.json:
+  {"bus": 1, "csv": "i2c", "binary": "i2c",
+   "sensors": [
+     {"name": "mpu6050", "addr": "0x68", "rate_hz": 100, "uart_hz": 1,
+      "blocks": [["0x3B", 14]]},
+     {"name": "bme280",  "addr": "0x76", "rate_hz": 10,
+      "blocks": [["0xF7", 8]]}]}
+
+Usage:
+  python3 i2c_daemon.py sensors.json
+  python3 i2c_daemon.py sensors.json --sim   # simulated bus (off the Pi)
+  python3 i2c_daemon.py --bench        # samples/s at 100 kHz vs 400 kHz
+"""
+import heapq
+import json
+import signal
+import struct
+import sys
+import time
+
+import i2c_sim
+import sd_logger
+
+try:
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    SMBus, i2c_msg = None, None
+
+# --- CONFIGURATION ---
+I2C_BUS = 1
+RDWR_MAX_MSGS = 42      # Kernel limit per I2C_RDWR ioctl
+DEFAULT_UART_HZ = 1.0   # UART is shared; only a preview of each sensor goes there
+
+# Binary record: t_ns, sensor index, block index, data length, then data
+BIN_HEADER = struct.Struct("<QBBH")
+
+
+class Sensor:
+    def __init__(self, idx, cfg):
+        self.idx = idx
+        self.name = cfg["name"]
+        self.addr = int(str(cfg["addr"]), 0)
+        self.blocks = [(int(str(reg), 0), int(length)) for reg, length in cfg["blocks"]]
+        rate = float(cfg.get("rate_hz", 1))
+        self.period = 1.0 / rate if rate > 0 else 0.0   # 0 = as fast as possible
+        uart_hz = float(cfg.get("uart_hz", DEFAULT_UART_HZ))
+        self.uart_period = 1.0 / uart_hz if uart_hz > 0 else None
+        self.next_due = 0.0
+        self.next_uart = 0.0
+        self.samples = 0
+        self.errors = 0
+        self.overruns = 0
+
+    def __lt__(self, other):
+        return self.next_due < other.next_due
+
+
+class Outputs:
+    """Fans each sample out to the UART preview, CSV and binary logs."""
+
+    def __init__(self, csv_name=None, bin_name=None, uart=True):
+        self.uart = uart
+        self.csv = sd_logger.SDLogWriter(csv_name, ext=".csv") if csv_name else None
+        self.bin = sd_logger.SDLogWriter(bin_name, ext=".bin") if bin_name else None
+
+    def sample(self, t_ns, sensor, block_idx, data, now):
+        if self.csv:
+            reg = sensor.blocks[block_idx][0]
+            self.csv.append(f"{t_ns},{sensor.name},0x{reg:02X},{data.hex()}")
+        if self.bin:
+            self.bin.append(BIN_HEADER.pack(t_ns, sensor.idx, block_idx, len(data)) + data, sep=b"")
+        if self.uart and sensor.uart_period is not None and now >= sensor.next_uart:
+            sensor.next_uart = now + sensor.uart_period
+            print(f"I2C:{sensor.name}:{t_ns // 1_000_000}:{data.hex()}", flush=True)
+
+    def tick(self):
+        for log in (self.csv, self.bin):
+            if log:
+                log.tick()
+
+    def close(self):
+        for log in (self.csv, self.bin):
+            if log:
+                log.close()
+
+
+class PollScheduler:
+    def __init__(self, bus, msg, sensors, outputs, batch=True):
+        self.bus = bus
+        self.msg = msg            # smbus2.i2c_msg or i2c_sim.i2c_msg
+        self.sensors = sensors
+        self.outputs = outputs
+        self.batch = batch
+        self.heap = []
+        self.transactions = 0
+        now = time.monotonic()
+        for s in sensors:
+            s.next_due = now
+            heapq.heappush(self.heap, s)
+
+    def _collect_due(self, now):
+        due = []
+        while self.heap and self.heap[0].next_due <= now:
+            s = heapq.heappop(self.heap)
+            due.append(s)
+            if not s.period:
+                s.next_due = now
+                continue
+            s.next_due += s.period
+            if s.next_due < now - s.period:
+                # Fell more than a period behind: skip ahead instead of bursting
+                missed = int((now - s.next_due) / s.period)
+                s.overruns += missed
+                s.next_due += missed * s.period
+        return due
+
+    def _transfer(self, group, now):
+        """Runs one combined transaction; group is [(sensor, block_idx), ...]."""
+        msgs = []
+        for sensor, b in group:
+            reg, length = sensor.blocks[b]
+            msgs.append(self.msg.write(sensor.addr, [reg]))
+            msgs.append(self.msg.read(sensor.addr, length))
+        t0 = time.time_ns()
+        self.bus.i2c_rdwr(*msgs)
+        t_ns = (t0 + time.time_ns()) // 2
+        self.transactions += 1
+        for i, (sensor, b) in enumerate(group):
+            self.outputs.sample(t_ns, sensor, b, bytes(msgs[2 * i + 1]), now)
+            sensor.samples += 1
+
+    def poll_once(self):
+        now = time.monotonic()
+        due = self._collect_due(now)
+        reads = [(s, b) for s in due for b in range(len(s.blocks))]
+        per_group = RDWR_MAX_MSGS // 2 if self.batch else 1
+        for i in range(0, len(reads), per_group):
+            group = reads[i:i + per_group]
+            try:
+                self._transfer(group, now)
+            except OSError:
+                # One NACKing sensor fails the whole combined transaction:
+                # retry the group one read at a time so the others still land
+                for item in group:
+                    try:
+                        self._transfer([item], now)
+                    except OSError as e:
+                        item[0].errors += 1
+                        if item[0].errors in (1, 10, 100, 1000):
+                            print(f"I2C:{item[0].name}:ERROR:{e}", flush=True)
+        for s in due:
+            heapq.heappush(self.heap, s)
+        self.outputs.tick()
+
+    def run(self, duration=None):
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            self.poll_once()
+            wait = self.heap[0].next_due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+
+def load_sensors(cfg):
+    return [Sensor(i, s) for i, s in enumerate(cfg["sensors"])]
+
+
+def open_bus(busno, bus_hz=100_000, simulate=False):
+    if simulate:
+        return i2c_sim.SimulatedSMBus(busno, bus_hz=bus_hz, realtime=True), i2c_sim.i2c_msg
+    return SMBus(busno), i2c_msg
+
+
+# --- BENCHMARK ---
+BENCH_SENSORS = [
+    {"name": "mpu6050", "addr": "0x68", "rate_hz": 0, "blocks": [["0x3B", 14]]},
+    {"name": "bme280", "addr": "0x76", "rate_hz": 0, "blocks": [["0xF7", 8]]},
+    {"name": "oled", "addr": "0x3C", "rate_hz": 0, "blocks": [["0x00", 1]]},
+]
+
+
+def run_benchmark(duration=1.0):
+    print("Flat-out polling of 3 sensors on the simulated bus (bus timing modelled)")
+    print(f"{'bus':>8} {'mode':>12} {'samples/s':>10} {'transactions/s':>15} {'bus busy':>9}")
+    for bus_hz in (100_000, 400_000):
+        for batch in (False, True):
+            bus, msg = open_bus(I2C_BUS, bus_hz, simulate=True)
+            sensors = load_sensors({"sensors": BENCH_SENSORS})
+            sched = PollScheduler(bus, msg, sensors, Outputs(uart=False), batch=batch)
+            t0 = time.monotonic()
+            sched.run(duration)
+            elapsed = time.monotonic() - t0
+            samples = sum(s.samples for s in sensors)
+            print(f"{bus_hz // 1000:>5}kHz {'i2c_rdwr x' + str(RDWR_MAX_MSGS) if batch else 'per-block':>12} "
+                  f"{samples / elapsed:10.0f} {sched.transactions / elapsed:15.0f} "
+                  f"{100 * bus.bus_seconds / elapsed:8.0f}%")
+
+
+# --- MAIN (run by main_listener.py) ---
+def main():
+    with open(sys.argv[1]) as f:
+        cfg = json.load(f)
+    simulate = '--sim' in sys.argv
+    if SMBus is None and not simulate:
+        print("Error: smbus2 not installed (pip install smbus2, or --sim for the simulated bus)")
+        sys.exit(1)
+    bus, msg = open_bus(cfg.get("bus", I2C_BUS), simulate=simulate)
+    sensors = load_sensors(cfg)
+    outputs = Outputs(cfg.get("csv"), cfg.get("binary"))
+    sched = PollScheduler(bus, msg, sensors, outputs)
+
+    def cleanup(signum, frame):
+        sys.exit(0)  # Unwinds into the finally below, which flushes the logs
+
+    signal.signal(signal.SIGTERM, cleanup)
+    print(f"I2C Daemon Started: {len(sensors)} sensor(s) on {'simulated ' if simulate else ''}"
+          f"bus {cfg.get('bus', I2C_BUS)}", flush=True)
+    try:
+        sched.run()
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        outputs.close()
+        bus.close()
+        total = sum(s.samples for s in sensors)
+        print(f"I2C Daemon Stopped ({total} samples, {sched.transactions} transactions).")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_benchmark()
+    elif len(sys.argv) > 1:
+        main()
+    else:
+        print("Usage: python3 i2c_daemon.py <sensors.json> [--sim] | --bench")
@@ -0,0 +1,193 @@
+"""
+i2c_regmap.py - Shadow register cache for I2C devices.
+
+Wraps one device on an smbus2 bus and keeps a copy of every register that
+is known not to change on its own, so:
+  * reads of cached registers never touch the bus
+  * update_bits()/set_field() do read-modify-write from the cache and
+    only write when the value actually changes
+  * writes inside `with regmap.batch():` are combined into one block
+    write per run of adjacent registers
+  * invalidate() drops entries after a reset or when the device may have
+    changed them behind our back
+
+Counters (regmap.stats) show how many bus transactions the cache saved.
+
+Example (MPU6050):
+    regs = RegisterMap(bus, 0x68, volatile=range(0x3A, 0x49))
+    regs.define_field("DLPF_CFG", 0x1A, shift=0, width=3)
+    regs.define_field("FS_SEL",   0x1B, shift=3, width=2)
+    with regs.batch():
+        regs.write(0x6B, 0x00)        # wake up
+        regs.set_field("DLPF_CFG", 3)
+        regs.set_field("FS_SEL", 1)   # 0x1A + 0x1B -> one block write
+
+  python3 i2c_regmap.py --demo       # counters on the simulated bus
+"""
+import sys
+from contextlib import contextmanager
+
+import i2c_sim
+
+# --- CONFIGURATION ---
+MAX_BLOCK = 32   # SMBus block writes carry at most 32 data bytes
+
+
+class RegisterMap:
+    def __init__(self, bus, addr, volatile=(), max_block=MAX_BLOCK):
+        self.bus = bus
+        self.addr = addr
+        self.volatile = set(volatile)   # Status/data registers: never cached
+        self.max_block = max_block
+        self.cache = {}
+        self.fields = {}
+        self.pending = None             # reg -> value while batching
+        self.stats = {
+            "bus_reads": 0, "bus_writes": 0,
+            "reads_saved": 0, "writes_saved": 0, "writes_combined": 0,
+        }
+
+    # --- CACHE CONTROL ---
+    def invalidate(self, reg=None):
+        """Forgets one register, or all of them (e.g. after a soft reset)."""
+        if reg is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(reg, None)
+
+    def _cacheable(self, reg):
+        return reg not in self.volatile
+
+    # --- READS ---
+    def read(self, reg):
+        if self.pending is not None and reg in self.pending:
+            return self.pending[reg]
+        if self._cacheable(reg) and reg in self.cache:
+            self.stats["reads_saved"] += 1
+            return self.cache[reg]
+        val = self.bus.read_byte_data(self.addr, reg)
+        self.stats["bus_reads"] += 1
+        if self._cacheable(reg):
+            self.cache[reg] = val
+        return val
+
+    def read_block(self, reg, length):
+        """Reads adjacent registers; one bus transaction unless all are cached."""
+        regs = range(reg, reg + length)
+        if all(self._cacheable(r) and r in self.cache for r in regs):
+            self.stats["reads_saved"] += 1
+            return bytes(self.cache[r] for r in regs)
+        data = bytes(self.bus.read_i2c_block_data(self.addr, reg, length))
+        self.stats["bus_reads"] += 1
+        for r, v in zip(regs, data):
+            if self._cacheable(r):
+                self.cache[r] = v
+        return data
+
+    # --- WRITES ---
+    def write(self, reg, val):
+        val &= 0xFF
+        if self._cacheable(reg) and self.cache.get(reg) == val and \
+                (self.pending is None or reg not in self.pending):
+            self.stats["writes_saved"] += 1
+            return
+        if self.pending is not None:
+            self.pending[reg] = val
+            return
+        self.bus.write_byte_data(self.addr, reg, val)
+        self.stats["bus_writes"] += 1
+        if self._cacheable(reg):
+            self.cache[reg] = val
+
+    def update_bits(self, reg, mask, val):
+        """Read-modify-write of the bits in mask; no bus traffic if unchanged."""
+        old = self.read(reg)
+        new = (old & ~mask) | (val & mask)
+        if new == old:
+            self.stats["writes_saved"] += 1
+            return
+        self.write(reg, new)
+
+    def define_field(self, name, reg, shift, width):
+        self.fields[name] = (reg, shift, ((1 << width) - 1) << shift)
+
+    def set_field(self, name, value):
+        reg, shift, mask = self.fields[name]
+        self.update_bits(reg, mask, value << shift)
+
+    def get_field(self, name):
+        reg, shift, mask = self.fields[name]
+        return (self.read(reg) & mask) >> shift
+
+    # --- WRITE COMBINING ---
+    @contextmanager
+    def batch(self):
+        """Stages writes and flushes adjacent registers as block writes."""
+        if self.pending is not None:
+            yield self  # Nested batch: the outer one flushes
+            return
+        self.pending = {}
+        try:
+            yield self
+        finally:
+            pending, self.pending = self.pending, None
+            self._flush(pending)
+
+    def _flush(self, pending):
+        regs = sorted(r for r, v in pending.items()
+                      if not (self._cacheable(r) and self.cache.get(r) == v))
+        i = 0
+        while i < len(regs):
+            j = i
+            while j + 1 < len(regs) and regs[j + 1] == regs[j] + 1 and j + 1 - i < self.max_block:
+                j += 1
+            run = regs[i:j + 1]
+            if len(run) == 1:
+                self.bus.write_byte_data(self.addr, run[0], pending[run[0]])
+            else:
+                self.bus.write_i2c_block_data(self.addr, run[0], [pending[r] for r in run])
+                self.stats["writes_combined"] += len(run) - 1
+            self.stats["bus_writes"] += 1
+            for r in run:
+                if self._cacheable(r):
+                    self.cache[r] = pending[r]
+            i = j + 1
+
+    def saved(self):
+        """Bus transactions avoided so far."""
+        s = self.stats
+        return s["reads_saved"] + s["writes_saved"] + s["writes_combined"]
+
+
+# --- DEMO ---
+def run_demo():
+    bus = i2c_sim.SimulatedSMBus(devices=(0x68,))
+    regs = RegisterMap(bus, 0x68, volatile=range(0x3A, 0x49))
+    regs.define_field("DLPF_CFG", 0x1A, shift=0, width=3)
+    regs.define_field("FS_SEL", 0x1B, shift=3, width=2)
+    regs.define_field("AFS_SEL", 0x1C, shift=3, width=2)
+
+    # Typical driver bring-up followed by repeated "make sure it's configured"
+    with regs.batch():
+        regs.write(0x19, 7)          # SMPLRT_DIV
+        regs.set_field("DLPF_CFG", 3)
+        regs.set_field("FS_SEL", 1)
+        regs.set_field("AFS_SEL", 2)
+    for _ in range(100):
+        regs.set_field("FS_SEL", 1)  # No change -> no bus traffic
+        regs.get_field("AFS_SEL")
+        regs.read_block(0x3B, 14)    # Sensor data is volatile: always read
+
+    s = regs.stats
+    uncached = s["bus_reads"] + s["bus_writes"] + regs.saved()
+    print(f"Bus transactions: {bus.transactions} (without the cache: ~{uncached})")
+    for k, v in s.items():
+        print(f"  {k:16} {v}")
+    print(f"  {'saved total':16} {regs.saved()}")
+
+
+if __name__ == '__main__':
+    if '--demo' in sys.argv:
+        run_demo()
+    else:
+        print("Usage: python3 i2c_regmap.py --demo")
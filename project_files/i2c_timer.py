@@ -25,6 +25,7 @@ try:
         m, s = divmod(total_seconds, 60)
         # Show digits and colon in one command to prevent flicker
         tm.numbers(m, s, colon=True)
+        print(f"SAMPLE:timer_s:{total_seconds}", flush=True)  # Live chart + history
         time.sleep(1)
         total_seconds -= 1
         
@@ -0,0 +1,270 @@
+"""
+link_health.py - Heartbeats, RTT estimation and link state (shared by both sides)
+
+The master pings the Pi all the time and keeps:
+  * SRTT / RTTVAR / RTO as in RFC 6298 (alpha 1/8, beta 1/4, RTO = SRTT +
+    max(G, 4 * RTTVAR), doubled on every miss), with a floor of MIN_RTO
+    instead of the RFC's 1 s: a UART round trip is milliseconds
+  * jitter as in RFC 3550 (smoothed |difference| of consecutive RTTs)
+  * heartbeat loss and the mux frame error rate over the last WINDOW pings
+
+Pings go out every HB_RTT_MULT * SRTT (between HB_MIN_INTERVAL and
+HB_MAX_INTERVAL). A ping not answered within RTO makes the link 'degraded'
+and is re-probed at once with the backed-off RTO; DEAD_AFTER misses in a row
+make it 'down'. So a dead link is reported a few RTTs after it died, not
+after a fixed multi-second timeout. High loss, FER or an RTT far above the
+best one seen also count as 'degraded'.
+
+Transport: with the mux, ping = a 'P' frame answered by the Pi's reader
+thread (uart_mux.Mux.ping/on_pong). On the text link the master sends
+"HB:<seq>" and main_listener.py answers "HBACK:<seq>" from its loop (adds up
+to one loop period, 50 ms, to the RTT).
+
+    health = LinkHealth(send_ping=mux.ping, frame_stats=lambda: (...), on_state=cb)
+    mux.on_pong = health.on_pong
+    health.start()
+    health.timeout()       # -> seconds to wait for a reply to a request
+
+  python3 link_health.py --demo    # detection time after a cut on a simulated UART
+"""
+import sys
+import threading
+import time
+from collections import deque
+
+# --- CONFIGURATION ---
+ALPHA, BETA, K = 1 / 8, 1 / 4, 4   # RFC 6298 gains
+CLOCK_G = 0.001                    # Timer granularity (s)
+INITIAL_RTO = 1.0                  # Until the first sample (RFC 6298 2.1)
+MIN_RTO = 0.02
+MAX_RTO = 5.0
+HB_RTT_MULT = 4                    # Ping every 4 SRTT...
+HB_MIN_INTERVAL = 0.05             # ...but not more often than this
+HB_MAX_INTERVAL = 1.0              # ...and at least this often
+DEAD_AFTER = 2                     # Consecutive missed pings -> 'down'
+WINDOW = 50                        # Pings in the loss / FER window
+DEGRADED_LOSS = 0.05               # Heartbeat loss ratio
+DEGRADED_FER = 0.01                # Bad frames / all frames
+DEGRADED_RTT = 8.0                 # SRTT this many times the best RTT seen (a busy link alone is ~4x)
+
+
+class RttEstimator:
+    """RFC 6298 retransmission timer."""
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.min_rtt = None
+        self.jitter = 0.0
+        self.last = None
+
+    def sample(self, r):
+        if self.srtt is None:
+            self.srtt, self.rttvar = r, r / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - r)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * r
+        if self.last is not None:
+            self.jitter += (abs(r - self.last) - self.jitter) / 16
+        self.last = r
+        self.min_rtt = r if self.min_rtt is None else min(self.min_rtt, r)
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + max(CLOCK_G, K * self.rttvar)))
+
+    def backoff(self):
+        self.rto = min(self.max_rto, self.rto * 2)
+
+
+class LinkHealth:
+    """Heartbeat loop. send_ping(seq) -> False when it couldn't be sent;
+    frame_stats() -> cumulative (good_frames, bad_frames) or None."""
+
+    def __init__(self, send_ping, on_state=None, frame_stats=None):
+        self.send_ping = send_ping
+        self.on_state = on_state or (lambda state, msg: None)
+        self.frame_stats = frame_stats or (lambda: None)
+        self.est = RttEstimator()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.state = "unknown"
+        self.since = time.time()
+        self.seq = 0
+        self.outstanding = None       # (seq, sent_at)
+        self.misses = 0
+        self.missed_after = None      # RTO the last miss waited for
+        self.next_ping = 0.0
+        self.results = deque(maxlen=WINDOW)        # 1 = lost, 0 = answered
+        self.frames = deque(maxlen=WINDOW + 1)     # (good, bad) snapshots
+        self.stats = {"pings": 0, "pongs": 0, "late_pongs": 0, "lost": 0}
+
+    # --- PUBLIC ---
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def timeout(self, extra=0.0):
+        """How long to wait for a reply: the current RTO plus e.g. the reply's wire time."""
+        return self.est.rto + extra
+
+    def on_pong(self, seq):
+        now = time.monotonic()
+        with self.lock:
+            if self.outstanding is None or self.outstanding[0] != int(seq) % (1 << 32):
+                self.stats["late_pongs"] += 1   # Answered after we gave up: no RTT sample (Karn)
+                return
+            self.est.sample(now - self.outstanding[1])
+            self.outstanding = None
+            self.misses = 0
+            self.results.append(0)
+            self.stats["pongs"] += 1
+            self.next_ping = now + self.interval()
+            state, msg = self._evaluate()
+        self._set_state(state, msg)
+        self.wake.set()
+
+    def interval(self):
+        if self.est.srtt is None:
+            return HB_MIN_INTERVAL
+        return min(HB_MAX_INTERVAL, max(HB_MIN_INTERVAL, HB_RTT_MULT * self.est.srtt))
+
+    def loss(self):
+        return sum(self.results) / len(self.results) if self.results else 0.0
+
+    def fer(self):
+        if len(self.frames) < 2 or None in (self.frames[0], self.frames[-1]):
+            return None
+        good = self.frames[-1][0] - self.frames[0][0]
+        bad = self.frames[-1][1] - self.frames[0][1]
+        return bad / (good + bad) if good + bad else 0.0
+
+    def status(self):
+        e = self.est
+        ms = lambda v: None if v is None else round(v * 1000, 2)
+        fer = self.fer()
+        return {
+            "state": self.state,
+            "since": self.since,
+            "srtt_ms": ms(e.srtt), "rttvar_ms": ms(e.rttvar), "rto_ms": ms(e.rto),
+            "min_rtt_ms": ms(e.min_rtt), "jitter_ms": ms(e.jitter if e.srtt is not None else None),
+            "loss": round(self.loss(), 4),
+            "fer": None if fer is None else round(fer, 5),
+            **self.stats,
+        }
+
+    # --- INTERNALS ---
+    def _evaluate(self):
+        e = self.est
+        if self.misses >= DEAD_AFTER:
+            return "down", f"no heartbeat reply in {self.misses} tries"
+        if self.misses:
+            return "degraded", f"heartbeat late (> {self.missed_after * 1000:.0f} ms)"
+        fer = self.fer()
+        if len(self.results) >= 10 and self.loss() > DEGRADED_LOSS:
+            return "degraded", f"heartbeat loss {100 * self.loss():.0f}%"
+        if fer is not None and fer > DEGRADED_FER:
+            return "degraded", f"frame errors {100 * fer:.1f}%"
+        if e.min_rtt and e.srtt > DEGRADED_RTT * max(e.min_rtt, 0.005):
+            return "degraded", f"RTT {e.srtt * 1000:.0f} ms (best {e.min_rtt * 1000:.0f} ms)"
+        return "up", f"RTT {e.srtt * 1000:.1f} ms"
+
+    def _set_state(self, state, msg):
+        if state == self.state:
+            return
+        self.state, self.since = state, time.time()
+        self.on_state(state, msg)
+
+    def _run(self):
+        while self.running:
+            now = time.monotonic()
+            event = None
+            with self.lock:
+                if self.outstanding and now - self.outstanding[1] >= self.est.rto:
+                    # Missed: back off and probe again straight away
+                    self.outstanding = None
+                    self.misses += 1
+                    self.results.append(1)
+                    self.stats["lost"] += 1
+                    self.missed_after = self.est.rto
+                    self.est.backoff()
+                    event = self._evaluate()
+                    self.next_ping = now
+                if self.outstanding is None and now >= self.next_ping:
+                    self.seq = (self.seq + 1) % (1 << 32)
+                    self.frames.append(self.frame_stats())
+                    if self.send_ping(self.seq):
+                        self.outstanding = (self.seq, time.monotonic())
+                        self.stats["pings"] += 1
+                    else:
+                        self.next_ping = now + HB_MAX_INTERVAL   # Port closed: nothing to measure
+                        event = ("offline", "serial port not open")
+                if self.outstanding:
+                    wait = self.outstanding[1] + self.est.rto - now
+                else:
+                    wait = self.next_ping - now
+            if event:
+                self._set_state(*event)
+            self.wake.wait(max(0.001, wait))
+            self.wake.clear()
+
+
+# --- DEMO ---
+def run_demo(baud=115200):
+    import uart_mux
+
+    cut = threading.Event()
+    side_a, side_b = uart_mux.Mux(baud), uart_mux.Mux(baud)
+    side_a.attach(uart_mux.SimPort(baud, lambda d: None if cut.is_set() else side_b.feed(d)))
+    side_b.attach(uart_mux.SimPort(baud, lambda d: None if cut.is_set() else side_a.feed(d)))
+    changes = []
+    health = LinkHealth(side_a.ping, on_state=lambda s, m: changes.append((time.monotonic(), s, m)),
+                        frame_stats=lambda: (side_a.stats["frames_in"], side_a.stats["bad_frames"]))
+    side_a.on_pong = health.on_pong
+    health.start()
+
+    time.sleep(2.0)
+    st = health.status()
+    print(f"Idle link:  SRTT {st['srtt_ms']} ms  RTTVAR {st['rttvar_ms']} ms  RTO {st['rto_ms']} ms  "
+          f"jitter {st['jitter_ms']} ms  ({st['pongs']} pongs)")
+
+    stop = threading.Event()
+    def bulk():
+        ch = side_a.open(uart_mux.BULK)
+        while not stop.is_set():
+            ch.write(b"R" * 239 + b"\n", timeout=0.1)
+    side_b.open(uart_mux.BULK).on_data = lambda d: None
+    threading.Thread(target=bulk, daemon=True).start()
+    time.sleep(2.0)
+    st = health.status()
+    print(f"Bulk load:  SRTT {st['srtt_ms']} ms  RTTVAR {st['rttvar_ms']} ms  RTO {st['rto_ms']} ms  "
+          f"jitter {st['jitter_ms']} ms  state {st['state']}")
+    stop.set()
+    time.sleep(1.0)
+
+    srtt = health.est.srtt
+    changes.clear()
+    t_cut = time.monotonic()
+    cut.set()
+    while not any(s == "down" for _, s, _ in changes) and time.monotonic() - t_cut < 10:
+        time.sleep(0.001)
+    for t, s, m in changes:
+        print(f"  +{(t - t_cut) * 1000:6.1f} ms  {s:8} {m}")
+    down = next((t for t, s, _ in changes if s == "down"), None)
+    if down:
+        print(f"Cut detected as 'down' after {(down - t_cut) * 1000:.0f} ms = {(down - t_cut) / srtt:.1f} SRTT "
+              f"(incl. up to one ping interval, {health.interval() * 1000:.0f} ms), vs 1000-2000 ms fixed timeouts")
+    health.stop()
+
+
+if __name__ == '__main__':
+    if '--demo' in sys.argv:
+        run_demo()
+    else:
+        print("Usage: python3 link_health.py --demo")
@@ -1,132 +1,522 @@
+import boot_state
+boot = boot_state.BootProfile()   # First, so the imports below are timed
+
+import ast
+import importlib
 import serial
 import subprocess
 import time
 import os
 import signal
 import sys
+import threading
+import queue
+import sd_transfer
+import sd_logger
+import sd_index
+import tsdb
+import uart_mux
+import telemetry
+import reaper
+import clock_sync
+import command_registry
+import gpio_capture
+from types import SimpleNamespace
+boot.mark('imports')
 
 # --- CONFIGURATION ---
 # Check your Pi's UART pins. Pi 3/4 usually use /dev/serial0
 SERIAL_PORT = '/dev/serial0' 
 BAUD_RATE = 115200
+# Split the UART into channels (control / log / bulk / chat), see uart_mux.py.
+# Must match UART_MUX in the PC's app.py.
+UART_MUX = True
+MAX_BURST = 64   # Commands read per loop pass; superseded ones are coalesced (see command_registry.py)
+AT_MAX_LATE = 1.0  # Seconds; an AT: command this late (e.g. replayed after a reconnect) is dropped
+# coalesce= targets whose last command is journaled and replayed at start-up, in
+# this order (not 'transfer': a half-done SD read is the PC's to resume)
+RESTORE_TARGETS = ('telemetry_rate', 'worker')
 
-# Store the currently running process ID
-current_process = None
+# The running micro-app lives in `workers` (defined below): stopping it never blocks the loop
 
-def log_to_uart(message):
-    """Sends a log message to the PC."""
+# SD file transfers run beside the hardware worker, not instead of it
+transfer_process = None
+transfer_cancelled = None
+
+# Open append loggers (name -> SDLogWriter); records never spawn a process
+loggers = {}
+sd_files = sd_index.SDIndex(sd_logger.SD_PATH)
+
+# Sampled values (GPIO state, PWM duty, worker SAMPLE: lines) for history queries
+history = tsdb.TSDB(sd_logger.SD_PATH)
+
+# Worker stdout lines, filled by a reader thread so the loop never blocks on readline()
+worker_output = queue.Queue()
+
+# AT:<pi_us>:CMD:... commands waiting for their time on our clock (see clock_sync.py)
+timers = clock_sync.Scheduler()
+
+# Transfer threads and the kernel loop share the UART; whole lines only
+uart_lock = threading.Lock()
+
+# Channel mux (when UART_MUX): commands in on 'control', logs out on 'log',
+# file/series data out on 'bulk' so it can't hold up the logs
+mux = uart_mux.Mux(BAUD_RATE) if UART_MUX else None
+BULK_PREFIXES = (sd_transfer.READ_PREFIX, 'TS_', 'FILE_', 'UPD_SIG')
+
+# Bulk lines from the kernel loop (series rows, file pages, signatures) wait
+# here for bulk_writer(), so a bulk channel out of credit never holds up commands
+bulk_queue = queue.Queue()
+
+def bulk_writer():
+    """Drains bulk_queue onto the bulk channel, blocking on its credit instead of the loop."""
+    channel = mux.open(uart_mux.BULK)
+    while True:
+        channel.send_line(bulk_queue.get())
+
+def send_line(line, wait=False):
+    """Sends one raw protocol line to the PC. Bulk lines are queued, unless
+    wait: then the caller (a transfer thread) blocks until the channel takes it."""
+    if mux:
+        if line.startswith(BULK_PREFIXES):
+            if wait:
+                mux.open(uart_mux.BULK).send_line(line)
+            else:
+                bulk_queue.put(line)
+            return
+        # Logs never block the kernel loop (dropped if the PC stops reading)
+        mux.open(uart_mux.LOG).send_line(line, block=False)
+        return
     try:
-        full_msg = f"LOG:{message}\n"
-        ser.write(full_msg.encode('utf-8'))
-        print(f"Sent: {message}")
+        with uart_lock:
+            ser.write(f"{line}\n".encode('utf-8'))
     except Exception as e:
         print(f"UART Error: {e}")
 
+# Live values for the dashboard charts: changed samples only, RATE_HZ frames a second
+live = telemetry.Publisher(telemetry.mux_emitter(mux.open(uart_mux.TELEMETRY)) if mux
+                           else telemetry.text_emitter(send_line))
+live.register('gpio_led', scale=1)
+live.register('pwm_duty', scale=1)
+live.register('timer_s', scale=1)
+live.register('pwm_in_hz', scale=1000)
+live.register('pwm_in_duty', scale=100)
+
+def next_command():
+    """Returns one raw command line from the PC, or None."""
+    if mux:
+        return mux.open(uart_mux.CONTROL).readline()
+    if ser.in_waiting > 0:
+        return ser.readline()
+    return None
+
+def read_burst():
+    """Every command line already waiting (up to MAX_BURST), decoded."""
+    lines = []
+    while len(lines) < MAX_BURST:
+        raw = next_command()
+        received = clock_sync.now_us()
+        if raw is None:
+            break
+        try:
+            line = raw.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            continue  # Ignore noise
+        if line.startswith('HB:'):
+            send_line(f"HBACK:{line[3:]}")  # Text-link heartbeat (the mux answers its own)
+        elif line.startswith('TSYNC:'):
+            # Text-link clock sync (the mux stamps its own T frames)
+            send_line(f"TSYNCR:{line[6:]}:{received}:{clock_sync.now_us()}")
+        elif line:
+            lines.append(line)
+    return lines
+
+def log_line(message, t_us=None):
+    """LOG:@<pi_us>:<message>, stamped with our clock so the PC can place it on its own."""
+    return f"LOG:@{clock_sync.now_us() if t_us is None else t_us}:{message}"
+
+def log_to_uart(message, t_us=None):
+    """Sends a log message to the PC."""
+    send_line(log_line(message, t_us))
+    print(f"Sent: {message}")
+
+def forward_transfer(proc, cancelled):
+    """Pumps READ_* lines from an SD transfer to the UART, one chunk at a time.
+
+    ser.write() blocks at line rate, which back-pressures the reader through
+    the pipe, so neither side ever holds more than a few chunks in memory.
+    """
+    for line in proc.stdout:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        if mux:
+            if cancelled.is_set():
+                break
+            # Blocks on the bulk channel's credit only; logs and commands keep flowing
+            send_line(line if line.startswith(sd_transfer.READ_PREFIX) else log_line(line), wait=True)
+            continue
+        with uart_lock:
+            if cancelled.is_set():
+                break  # A newer request replaced us; drop the stale tail
+            try:
+                if line.startswith(sd_transfer.READ_PREFIX):
+                    ser.write(f"{line}\n".encode('utf-8'))
+                else:
+                    ser.write(f"{log_line(line)}\n".encode('utf-8'))
+            except Exception as e:
+                print(f"UART Error: {e}")
+                break
+    proc.stdout.close()
+    proc.wait()
+
+def cancel_transfer():
+    """Stops the running SD transfer, if any."""
+    global transfer_process
+    if transfer_process:
+        with uart_lock:
+            transfer_cancelled.set()
+        workers.reaper.terminate(transfer_process)  # Reaped in the background, no zombie
+        transfer_process = None
+
+def start_transfer(action, args):
+    """Streams an SD range in the background (READ <fname> [offset] [length],
+    BLOCK_READ <lba> <count> [offset])."""
+    global transfer_process, transfer_cancelled
+    cancel_transfer()
+    transfer_cancelled = threading.Event()
+    transfer_process = subprocess.Popen(
+        ['python3', 'spi_sd_card.py', action] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        bufsize=1,
+        start_new_session=True  # Own process group, so terminating it can't signal us
+    )
+    threading.Thread(target=forward_transfer,
+                     args=(transfer_process, transfer_cancelled),
+                     daemon=True).start()
+
 def kill_current_process():
-    """Stops the active micro-app."""
-    global current_process
-    if current_process:
-        log_to_uart(f"Stopping active script (PID {current_process.pid})...")
+    """Stops the active micro-app: SIGTERM to its process group now, SIGKILL
+    after reaper.KILL_AFTER. Returns at once; the exit is logged when it happens."""
+    proc = workers.stop()
+    if proc:
+        log_to_uart(f"Stopping active script (PID {proc.pid})...")
+
+def append_record(name, record):
+    """Buffers one record for the named log; the writer batches the fsyncs."""
+    writer = loggers.get(name)
+    if writer is None:
+        writer = loggers[name] = sd_logger.SDLogWriter(name, index=sd_files)
+    writer.append(record)
+
+def flush_loggers(sync=True):
+    for writer in loggers.values():
+        writer.flush(sync=sync)
+
+def record(series, value, t_ms=None):
+    """Stores a sample in the history and publishes it to the live charts."""
+    history.append(series, value, t_ms)
+    live.update(series, value, None if t_ms is None else t_ms / 1000)
+
+def record_sample(line):
+    """Stores a worker line SAMPLE:<series>:<value>[:<t_ms>] in the history."""
+    parts = line.split(':')
+    try:
+        t_ms = float(parts[3]) if len(parts) > 3 and parts[3] else None
+        record(parts[1], float(parts[2]), t_ms)
+    except (IndexError, ValueError):
+        log_to_uart(f"Bad sample line: {line}")
+
+def read_worker_output(proc):
+    """Moves a worker's stdout onto worker_output, one line at a time."""
+    name = proc.args[1]
+    for line in proc.stdout:
+        worker_output.put((name, line.rstrip('\n'), clock_sync.now_us()))  # Stamped as it's printed
+
+def run_script(script_name, args=[]):
+    """Launches a new micro-app once the previous one has released the hardware."""
+    if workers.current:
+        log_to_uart(f"Stopping active script (PID {workers.current.pid})...")
+    workers.run(['python3', script_name] + args)
+
+def current_script():
+    """The micro-app running (or about to start), e.g. 'pwm_monitor.py', or None."""
+    cmd = workers.pending or (workers.current.args if workers.current else None)
+    return cmd[1] if cmd else None
+
+def worker_started(proc):
+    journal.set_worker(proc)
+    threading.Thread(target=read_worker_output, args=(proc,), daemon=True).start()
+    log_to_uart(f"Started {proc.args[1]} with args {proc.args[2:]}")
+
+def worker_exited(proc, how):
+    if workers.current is None:
+        journal.set_worker(None)
+    if how == 'exited':
+        log_to_uart("Task finished.")
+        if workers.current is None and workers.pending is None:
+            journal.clear('worker')  # Done on its own (timer, program): nothing to bring back
+    elif how == 'killed':
+        log_to_uart(f"PID {proc.pid} ignored SIGTERM, killed after {reaper.KILL_AFTER} s")
+    else:
+        log_to_uart(f"PID {proc.pid} stopped")
+
+def worker_failed(cmd, e):
+    log_to_uart(f"Error: Could not start {cmd[1]}: {e}")
+
+# Each worker gets its own process group (crucial for clean kills); exits are
+# picked up through pidfds, so no zombies and no polling in the loop
+workers = reaper.WorkerSlot(
+    on_start=worker_started, on_exit=worker_exited, on_error=worker_failed,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT,  # One pipe, so a chatty stderr can't fill up and hang the worker
+    universal_newlines=True,
+    bufsize=1  # Line buffered
+)
+
+def reload_commands():
+    """Swaps in changed cmd_*.py handlers; the worker and transfers keep running."""
+    reload_requested.clear()
+    names, error = registry.load()
+    if error:
+        log_to_uart(f"Reload failed, keeping previous commands: {error}")
+    elif names:
+        log_to_uart(f"Reloaded {', '.join(names)} ({len(registry.table)} commands)")
+    else:
+        log_to_uart("Commands up to date")
+
+def imports_of(script):
+    """Module names a script imports, read from its source."""
+    try:
+        with open(script) as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError):
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(a.name.split('.')[0] for a in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module.split('.')[0])
+    return names
+
+def core_modules():
+    """Local modules the listener itself is built from: its imports, and theirs."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    core, todo = set(), [os.path.basename(__file__)]
+    while todo:
+        for module in imports_of(os.path.join(here, todo.pop())):
+            if module not in core and os.path.exists(os.path.join(here, module + '.py')):
+                core.add(module)
+                todo.append(module + '.py')
+    return core
+
+def after_update(name):
+    """Restarts only what uses a file CMD:UPD just replaced; returns what it restarted.
+    Only main_listener.py and its core modules re-exec the listener (which stops
+    the worker); anything else leaves an unrelated worker running."""
+    module = name[:-3] if name.endswith('.py') else None
+    loaded = sys.modules.get(module) if module else None
+    done = []
+    if module and module.startswith('cmd_'):
+        reload_commands()
+        done.append('handlers')
+    elif name == os.path.basename(__file__) or module in core_modules():
+        restart_requested.set()   # Re-exec'd from the loop, after UPD_DONE has gone out
+        return 'listener'
+    elif loaded is not None:
+        # A library only handlers import (seqc, delta_sync): reload it in place
         try:
-            # Send SIGTERM to the entire process group
-            os.killpg(os.getpgid(current_process.pid), signal.SIGTERM)
-            current_process.wait(timeout=1) # Wait for it to die
+            importlib.reload(loaded)
+            done.append(module)
         except Exception as e:
-            log_to_uart(f"Error killing process: {e}")
-        current_process = None
+            log_to_uart(f"Reload of {module} failed, keeping the previous one: {e}")
+    cmd = workers.pending or (workers.current.args if workers.current else None)
+    if cmd and (cmd[1] == name or name in cmd[2:] or module in imports_of(cmd[1])):
+        workers.run(cmd)
+        done.append(cmd[1])
+    return '+'.join(done) or 'nothing'
 
-def run_script(script_name, args=[]):
-    """Launches a new micro-app."""
-    kill_current_process() # Ensure hardware is free
-    
-    cmd = ['python3', script_name] + args
+def shutdown():
+    """Stops transfers, closes the logs and waits (briefly) for the worker to exit."""
+    cancel_transfer()
+    for writer in loggers.values():
+        writer.close()
+    history.close()
+    kill_current_process()
+    deadline = time.monotonic() + reaper.KILL_AFTER + 1
+    while workers.reaper.busy() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+def restart_listener():
+    """Re-executes this script after an update of itself or a module it imports."""
+    log_to_uart("Restarting the listener for the update...")
+    shutdown()
+    deadline = time.monotonic() + 2
+    while mux and time.monotonic() < deadline and (not bulk_queue.empty() or any(
+            st['queued'] for st in mux.channel_stats().values())):
+        time.sleep(0.01)   # Let the last lines out before the mux goes away
+    ser.flush()
+    boot_state.mark_exec()  # Same process, so the next boot profile starts here
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+boot.mark('init')
+
+# --- COMMANDS ---
+# Handlers only see the listener through this object, so reloading them keeps all state
+registry = command_registry.Registry()
+ctx = SimpleNamespace(
+    log=log_to_uart, send_line=send_line, run_script=run_script,
+    kill_current_process=kill_current_process, start_transfer=start_transfer,
+    cancel_transfer=cancel_transfer, append_record=append_record,
+    flush_loggers=flush_loggers, loggers=loggers, history=history,
+    record=record, live=live, current_script=current_script,
+    due=None,  # Pi clock (us) an AT: command is for, while its handler runs
+    state={},  # Handler state that must survive a reload (e.g. the PWM step)
+    registry=registry, reload_commands=reload_commands, after_update=after_update,
+)
+_, error = registry.load()
+if error:
+    sys.exit(f"Command handlers failed to load: {error}")
+boot.mark('handlers')
+
+# Last desired state per target, replayed after a crash or reboot (see boot_state.py)
+journal = boot_state.Journal()
+ctx.state.update(journal.state)
+boot.mark('state')
+
+# `kill -HUP <pid>` after deploying new cmd_*.py files; handled between commands
+reload_requested = threading.Event()
+signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+restart_requested = threading.Event()
+
+def run_command(line):
+    """Dispatches one CMD line; errors go back to the PC as LOG lines."""
+    # Expected format: CMD:TYPE:ACTION:ARGS, handled by the cmd_*.py modules
     try:
-        # start_new_session=True creates a new process group (crucial for clean kills)
-        global current_process
-        current_process = subprocess.Popen(
-            cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            preexec_fn=os.setsid,
-            universal_newlines=True,
-            bufsize=1  # Line buffered
-        )
-        log_to_uart(f"Started {script_name} with args {args}")
-    except FileNotFoundError:
-        log_to_uart(f"Error: Could not find {script_name}")
+        handled = registry.dispatch(ctx, line)
+    except command_registry.CommandError as e:
+        log_to_uart(str(e))
+        return
+    except Exception as e:
+        # A bad handler must not take the listener (and the running worker) down
+        log_to_uart(f"Command Error: {type(e).__name__}: {e}")
+        return
+    try:
+        if handled:
+            journal_command(line)
+    except OSError as e:
+        log_to_uart(f"State journal write failed: {e}")
+
+def journal_command(line):
+    """Keeps the line as its target's desired state if it sets one (see RESTORE_TARGETS)."""
+    parts = line.split(':')
+    c = registry.lookup(parts[1].upper(), parts[2].upper())
+    if c.coalesce in RESTORE_TARGETS:
+        journal.set(c.coalesce, line)
+    journal.keep_state(ctx.state)
+
+def restore_state():
+    """Replays the journaled commands; returns how many ran."""
+    if journal.error:
+        log_to_uart(f"State journal unreadable, starting from defaults: {journal.error}")
+    pid = boot_state.stop_orphan(journal.worker, reaper.KILL_AFTER)
+    if pid:
+        log_to_uart(f"Stopped {journal.worker['args'][1]} (PID {pid}) left running by the last listener")
+    lines = journal.replay(RESTORE_TARGETS)
+    for line in lines:
+        log_to_uart(f"Restoring {line}")
+        run_command(line)
+    return len(lines)
+
+def schedule(line):
+    """AT:<pi_us>:CMD:... -> runs the command when our clock reaches pi_us.
+
+    Commands declared with lead= are handed over that much earlier, with
+    ctx.due set, and wait for the time themselves (e.g. in a worker)."""
+    try:
+        _, due, cmd = line.split(':', 2)
+        due = int(due)
+    except ValueError:
+        log_to_uart(f"Bad timed command: {line}")
+        return
+    parts = cmd.split(':')
+    c = registry.lookup(parts[1].upper(), parts[2].upper()) if len(parts) >= 3 else None
+    timers.add(due - int(1e6 * getattr(c, 'lead', 0)), (due, cmd))
+
+def run_due_commands():
+    for start, (due, cmd) in timers.pop_due():
+        late = clock_sync.now_us() - start
+        if late > AT_MAX_LATE * 1e6:
+            log_to_uart(f"Dropped {cmd}: {late / 1e6:.1f} s past its time")
+            continue
+        ctx.due = due
+        try:
+            run_command(cmd)
+        finally:
+            ctx.due = None
+        log_to_uart(f"Timed {cmd} dispatched {late} us after its slot", start + late)
 
 # --- MAIN LOOP ---
 try:
     ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
     print(f"Listening on {SERIAL_PORT}...")
+    boot.mark('port')
+    if mux:
+        mux.attach(ser)
+        mux.start_reader(ser)
+        uart_mux.ChannelServer(mux).start()  # pi_chat.py can open the 'chat' channel
+        threading.Thread(target=bulk_writer, daemon=True).start()
+        boot.mark('mux')
     log_to_uart("Pi System Ready")
+    ready = boot.elapsed()
+    restored = restore_state()
+    log_to_uart(boot.line(ready=ready, restored=boot.elapsed()))
+    if restored:
+        log_to_uart(f"Restored {restored} target(s) from {journal.path}")
 
     while True:
+        if reload_requested.is_set():
+            reload_commands()
+
+        # 0. TIMED COMMANDS WHOSE TIME HAS COME (the sleep below wakes up for them)
+        run_due_commands()
+
         # 1. READ INCOMING COMMANDS
-        if ser.in_waiting > 0:
-            try:
-                line = ser.readline().decode('utf-8').strip()
-                if not line: continue
-                
-                parts = line.split(':')
-                # Expected format: CMD:TYPE:ACTION:ARGS
-                if len(parts) >= 3 and parts[0] == 'CMD':
-                    module = parts[1]
-                    action = parts[2]
-                    
-                    if module == 'GPIO':
-                        if action == 'BLINK':
-                            run_script('gpio_blink.py', [parts[3]])
-                        elif action == 'ON':
-                            run_script('gpio_blink.py', ['0']) # 0 delay = ON
-                        elif action == 'OFF':
-                            kill_current_process()
-                            log_to_uart("GPIO Turned OFF")
-
-                    elif module == 'PWM':
-                        if action == 'START':
-                            run_script('pwm_monitor.py') # Default args inside script
-                        elif action == 'STOP':
-                            kill_current_process()
-                            log_to_uart("PWM Stopped")
-                    
-                    elif module == 'I2C':
-                        if action == 'TIMER':
-                            run_script('i2c_timer.py', [parts[3]])
-                        elif action == 'CLOCK':
-                            run_script('i2c_world_clock.py')
-
-                    elif module == 'SPI':
-                        # SPI is non-blocking (runs and finishes), so we wait for it
-                        p3 = parts[3] if len(parts) > 3 else ""
-                        p4 = parts[4] if len(parts) > 4 else ""
-                        subprocess.run(['python3', 'spi_sd_card.py', action, p3, p4])
-                        # The SPI script itself prints to stdout, which we capture below? 
-                        # Actually, for non-blocking subprocess.run, we can't capture stdout easily in the loop below.
-                        # Let's trust the SPI script to print, and we capture it via a Pipe if needed, 
-                        # or just let it print to system console. 
-                        # For better logs, we should read the output here:
-                        result = subprocess.run(['python3', 'spi_sd_card.py', action, p3, p4], capture_output=True, text=True)
-                        if result.stdout: log_to_uart(result.stdout.strip())
-                        if result.stderr: log_to_uart(f"Error: {result.stderr.strip()}")
-
-            except UnicodeDecodeError:
-                pass # Ignore noise
-
-        # 2. READ OUTPUT FROM RUNNING SCRIPT (LOGS)
-        if current_process:
-            # Non-blocking read of the sub-process output
-            output = current_process.stdout.readline()
-            if output:
-                log_to_uart(f"[{current_process.args[1]}] {output.strip()}")
-            
-            # Check if process died
-            if current_process.poll() is not None:
-                current_process = None
-                log_to_uart("Task finished.")
-
-        time.sleep(0.05)
+        # A burst (dashboard double-clicks, a queue flushed after a reconnect)
+        # is read in one go; only the last command per target actually runs
+        lines, dropped = registry.coalesce(read_burst())
+        if dropped:
+            counts = ', '.join(f"{name} x{n}" for name, n in dropped.items())
+            log_to_uart(f"Coalesced {sum(dropped.values())} superseded command(s): {counts}")
+        for line in lines:
+            if line.startswith('AT:'):
+                schedule(line)
+            else:
+                run_command(line)
+        if restart_requested.is_set():
+            restart_listener()
+
+        # 2. SYNC APPEND LOGS WHOSE FSYNC BUDGET RAN OUT
+        for writer in loggers.values():
+            writer.tick()
+        history.tick()
+        live.tick()
+
+        # 3. READ OUTPUT FROM RUNNING SCRIPT (LOGS)
+        while not worker_output.empty():
+            name, output, t_us = worker_output.get_nowait()
+            if output.startswith('SAMPLE:'):
+                record_sample(output)  # Kept on the Pi, queried with CMD:TSDB:QUERY
+            elif output.startswith(gpio_capture.FRAME_PREFIX):
+                send_line(output)  # Input edges, already batched and stamped by the worker
+            elif output.strip():
+                log_to_uart(f"[{name}] {output.strip()}", t_us)
+
+        timers.sleep(0.05)
 
 except KeyboardInterrupt:
-    kill_current_process()
+    shutdown()
     print("Shutting down.")
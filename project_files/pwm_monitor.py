@@ -1,39 +1,268 @@
-import RPi.GPIO as GPIO
-import time
+"""
+pwm_monitor.py - Breathing LED on GPIO 12, or PWM input measurement (WORKER)
+
+  python3 pwm_monitor.py [step s]                 # breathe (CMD:PWM:START / FASTER / SLOWER)
+  python3 pwm_monitor.py --measure <pin> [window s] [--sim]   # measure a PWM input (CMD:PWM:MEASURE)
+  python3 pwm_monitor.py --bench                  # analysis speed + accuracy on synthetic edges
+
+Measuring: edges of the input pin are captured with gpio_capture.py (edge
+callbacks, ns stamps, ring buffer) and, every window, analysed with NumPy in
+whole arrays - no Python loop per edge:
+
+    frequency   1 / mean rising-to-rising period (missing pulses and glitches left out)
+    duty        median high time / that period
+    jitter      standard deviation and peak-to-peak of the periods
+    missing     periods longer than 1.5x the median, counted in pulses
+    glitches    periods shorter than half the median
+
+Each window prints PWM_MEASURE:<pin>:<Hz>:<duty %>:<jitter us>:<p-p us>:<missing>:<glitches>:<edges>
+(a log line) and SAMPLE:pwm_in_hz / SAMPLE:pwm_in_duty (history + live chart).
+The analysis keeps up with tens of kHz (see --bench); on the Pi, RPi.GPIO's
+callbacks top out well below that, so above a few kHz the capture sees
+missing pulses that aren't in the signal.
+
+With --sim (off the Pi) the input is a simulated 1 kHz, 30% signal with
+jitter and a dropped pulse now and then. Without RPi.GPIO and without --sim
+the measurement stops with an error instead.
+"""
 import signal
 import sys
+import time
+
+import gpio_capture
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
 
+# --- CONFIGURATION ---
 PWM_PIN = 12
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(PWM_PIN, GPIO.OUT)
+STEP_DELAY = 0.05          # Seconds per 5% step (PWM:FASTER/SLOWER)
+WINDOW_S = 1.0             # Measurement window
+MISSING_FACTOR = 1.5       # A period this many times the median = missing pulse(s)
+GLITCH_FACTOR = 0.5
+SIM_SIGNAL = (1000, 0.3, 2e-6, 200)   # Hz, duty, jitter (s), a pulse missing every N
 
-pwm = GPIO.PWM(PWM_PIN, 100) # 100Hz frequency
-pwm.start(0)
 
-# Safe Cleanup
-def cleanup(signum, frame):
-    pwm.stop()
-    GPIO.cleanup()
-    print("PWM Stopped.")
-    sys.exit(0)
+# --- BREATHING ---
+def breathe(step_delay):
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(PWM_PIN, GPIO.OUT)
 
-signal.signal(signal.SIGTERM, cleanup)
+    pwm = GPIO.PWM(PWM_PIN, 100) # 100Hz frequency
+    pwm.start(0)
 
-try:
-    print("Starting Breathing LED...")
+    # Safe Cleanup
+    def cleanup(signum, frame):
+        pwm.stop()
+        GPIO.cleanup()
+        print("PWM Stopped.")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, cleanup)
+
+    try:
+        print("Starting Breathing LED...")
+        while True:
+            # Fade In
+            for dc in range(0, 101, 5):
+                pwm.ChangeDutyCycle(dc)
+                print(f"SAMPLE:pwm_duty:{dc}:{int(time.time() * 1000)}", flush=True)  # Stored on the Pi, not sent
+                time.sleep(step_delay)
+            # Fade Out
+            for dc in range(100, -1, -5):
+                pwm.ChangeDutyCycle(dc)
+                print(f"SAMPLE:pwm_duty:{dc}:{int(time.time() * 1000)}", flush=True)
+                time.sleep(step_delay)
+
+            print("Breathing Cycle Complete", flush=True) # Sent to Logs
+
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        cleanup(None, None)
+
+
+# --- MEASURING ---
+def analyze(t_ns, levels):
+    """Edge times (int64 ns) and levels (0/1) -> dict of statistics, or None
+    with fewer than three rising edges. Levels are trusted to alternate only
+    where they say so: a repeated level is just another edge of that kind."""
+    import numpy as np
+
+    t_ns = np.asarray(t_ns, dtype=np.int64)
+    levels = np.asarray(levels, dtype=np.uint8)
+    rising, falling = t_ns[levels == 1], t_ns[levels == 0]
+    if len(rising) < 3:
+        return None
+    periods = np.diff(rising)
+    median = float(np.median(periods))
+    long_ = periods > MISSING_FACTOR * median
+    short = periods < GLITCH_FACTOR * median
+    normal = periods[~long_ & ~short]
+    period = float(np.mean(normal)) if len(normal) else median
+    # High time: from each rising edge to the first falling edge after it, if before the next rise
+    idx = np.searchsorted(falling, rising[:-1], side="right")
+    ok = idx < len(falling)
+    high = falling[idx[ok]] - rising[:-1][ok]
+    ok_high = high < periods[ok]
+    high = high[ok_high & ~long_[ok] & ~short[ok]]
+    return {
+        "hz": 1e9 / period,
+        "duty": 100.0 * float(np.median(high)) / period if len(high) else float("nan"),
+        "jitter_us": float(np.std(normal)) / 1000 if len(normal) > 1 else 0.0,
+        "pp_us": float(np.ptp(normal)) / 1000 if len(normal) else 0.0,
+        "missing": int(np.sum(np.rint(periods[long_] / median) - 1)),
+        "glitches": int(np.sum(short)),
+        "edges": len(t_ns),
+    }
+
+
+def analyze_loop(t_ns, levels):
+    """The same statistics with a Python loop per edge (the --bench baseline)."""
+    last_rise = None
+    periods, highs = [], []
+    for t, level in zip(t_ns, levels):
+        if level:
+            if last_rise is not None:
+                periods.append(t - last_rise)
+            last_rise = t
+        elif last_rise is not None:
+            highs.append(t - last_rise)
+    periods.sort()
+    median = periods[len(periods) // 2]
+    normal = [p for p in periods if GLITCH_FACTOR * median <= p <= MISSING_FACTOR * median]
+    mean = sum(normal) / len(normal)
+    return {"hz": 1e9 / median, "duty": 100.0 * sorted(highs)[len(highs) // 2] / median,
+            "jitter_us": (sum((p - mean) ** 2 for p in normal) / len(normal)) ** 0.5 / 1000}
+
+
+def synthetic_edges(hz, duty, seconds, jitter_s=0.0, missing_every=0, seed=1, start_ns=0):
+    """(t_ns int64, levels uint8) of a PWM signal; every missing_every-th pulse left out."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n = int(hz * seconds)
+    rise = start_ns + np.arange(n) * (1e9 / hz) + rng.normal(0, jitter_s * 1e9, n)
+    fall = rise + duty * 1e9 / hz + rng.normal(0, jitter_s * 1e9, n)
+    keep = np.ones(n, dtype=bool)
+    if missing_every:
+        keep[missing_every - 1::missing_every] = False
+    t = np.empty(2 * keep.sum(), dtype=np.int64)
+    t[0::2], t[1::2] = rise[keep], fall[keep]
+    levels = np.tile(np.array([1, 0], dtype=np.uint8), int(keep.sum()))
+    return t, levels
+
+
+def summary_lines(pin, stats):
+    s = stats
+    now = int(time.time() * 1000)
+    return [f"PWM_MEASURE:{pin}:{s['hz']:.3f}:{s['duty']:.2f}:{s['jitter_us']:.2f}:{s['pp_us']:.2f}:"
+            f"{s['missing']}:{s['glitches']}:{s['edges']}",
+            f"SAMPLE:pwm_in_hz:{s['hz']:.3f}:{now}",
+            f"SAMPLE:pwm_in_duty:{s['duty']:.2f}:{now}"]
+
+
+def measure(pin, window, simulate=False):
+    try:
+        import numpy as np
+    except ImportError:
+        print("Error: PWM measurement needs numpy (pip install numpy)")
+        sys.exit(1)
+    if GPIO is None and not simulate:
+        print("Error: RPi.GPIO not installed (run on the Pi, or --sim for a simulated signal)")
+        sys.exit(1)
+
+    capture = gpio_capture.Capture(debounce_ms=0)
+    if simulate:
+        backend = gpio_capture.SimBackend()
+    else:
+        backend = gpio_capture.GPIOBackend()
+    backend.watch(pin, capture.edge)
+    if simulate:
+        hz, duty, jitter, every = SIM_SIGNAL
+        t, levels = synthetic_edges(hz, duty, 3600, jitter, every)
+        sys.setswitchinterval(0.0001)   # The signal thread shares the GIL with the analysis
+        backend.play(pin, (t - t[0]).tolist())
+
+    def cleanup(signum, frame):
+        backend.close()
+        print(f"Measurement stopped: {capture.stats['edges']} edges, {capture.stats['lost']} lost", flush=True)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, cleanup)
+
+    print(f"Measuring PWM on GPIO {pin} ({'simulated' if simulate else 'RPi.GPIO'}), "
+          f"{window:g} s windows", flush=True)
+    times, codes = [], []
+    end = time.monotonic() + window
     while True:
-        # Fade In
-        for dc in range(0, 101, 5):
-            pwm.ChangeDutyCycle(dc)
-            time.sleep(0.05)
-        # Fade Out
-        for dc in range(100, -1, -5):
-            pwm.ChangeDutyCycle(dc)
-            time.sleep(0.05)
-        
-        print("Breathing Cycle Complete") # Sent to Logs
-
-except Exception as e:
-    print(f"Error: {e}")
-finally:
-    cleanup(None, None)
+        time.sleep(gpio_capture.BATCH_S)   # Drain often: the ring holds 65536 edges
+        while True:
+            t, c = capture.drain(gpio_capture.RING_SIZE)
+            if not t:
+                break
+            times.append(np.frombuffer(t, dtype=np.int64))
+            codes.append(np.frombuffer(c, dtype=np.uint8))
+        if time.monotonic() < end:
+            continue
+        end += window
+        stats = analyze(np.concatenate(times), np.concatenate(codes) & 1) if times else None
+        if stats is None:
+            print(f"PWM_MEASURE:{pin}:0:0:0:0:0:0:{sum(map(len, times))}", flush=True)   # No signal
+        else:
+            for line in summary_lines(pin, stats):
+                print(line, flush=True)
+        times, codes = [], []
+
+
+# --- BENCH ---
+def run_bench(seconds=1.0):
+    import numpy as np
+
+    print(f"PWM analysis of {seconds:g} s windows of synthetic edges (30% duty, 1% of pulses missing)")
+    for hz in (1000, 10000, 50000, 100000):
+        jitter = 0.01 / hz   # 1% of a period
+        t, levels = synthetic_edges(hz, 0.3, seconds, jitter, missing_every=100)
+        start = time.perf_counter()
+        stats = analyze(t, levels)
+        vector = time.perf_counter() - start
+        start = time.perf_counter()
+        analyze_loop(t.tolist(), levels.tolist())
+        loop = time.perf_counter() - start
+        print(f"  {hz:6} Hz, {len(t):6} edges: {stats['hz']:9.1f} Hz {stats['duty']:5.1f}% "
+              f"jitter {stats['jitter_us']:6.3f} us (true {jitter * 1e6 * 2 ** 0.5:.3f}) "
+              f"missing {stats['missing']:4} (true {(int(hz * seconds) - 1) // 100:4})  "
+              f"NumPy {1000 * vector:6.2f} ms, per-edge loop {1000 * loop:7.1f} ms, "
+              f"{seconds / vector:5.0f}x real time")
+
+    # Windows fed through the capture ring as the worker does (20 kHz on a simulated pin)
+    hz = 20000
+    capture = gpio_capture.Capture(debounce_ms=0)
+    sim = gpio_capture.SimBackend()
+    sim.watch(5, capture.edge)
+    t, levels = synthetic_edges(hz, 0.3, seconds)
+    sys.setswitchinterval(0.0001)
+    sim.play(5, (t - t[0]).tolist())
+    got = []
+    while sim.threads[0].is_alive() or capture.head > capture.tail:
+        time.sleep(gpio_capture.BATCH_S)
+        c_t, c_c = capture.drain(gpio_capture.RING_SIZE)
+        if c_t:
+            got.append((np.frombuffer(c_t, dtype=np.int64), np.frombuffer(c_c, dtype=np.uint8)))
+    stats = analyze(np.concatenate([g[0] for g in got]), np.concatenate([g[1] for g in got]) & 1)
+    print(f"  through the capture ring (simulated {hz} Hz): {stats['hz']:.1f} Hz {stats['duty']:.1f}%, "
+          f"{stats['edges']} edges, {capture.stats['lost']} lost")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+    elif len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        args = [a for a in sys.argv[2:] if a != '--sim']
+        measure(int(args[0]), float(args[1]) if len(args) > 1 else WINDOW_S, '--sim' in sys.argv)
+    elif GPIO is None:
+        print("Error: breathing needs RPi.GPIO (run on the Pi)")
+        sys.exit(1)
+    else:
+        breathe(float(sys.argv[1]) if len(sys.argv) > 1 else STEP_DELAY)
@@ -0,0 +1,303 @@
+"""
+reaper.py - Asynchronous worker stop/start for main_listener.py (LIBRARY)
+
+Stopping a worker used to block the kernel loop in wait(timeout=1), and a
+worker still busy after that second was abandoned: a zombie, and possibly
+a GPIO pin still claimed while the next worker started.
+
+Now:
+  * Reaper.terminate() sends SIGTERM to the worker's process group and
+    returns at once; SIGKILL follows if it is still alive KILL_AFTER later
+  * one thread waits for exits on pidfds (os.pidfd_open, Linux 5.3+), or on
+    SIGCHLD through a self-pipe, or polls every POLL_INTERVAL as a last
+    resort, and reaps every child it watches - no zombies
+  * WorkerSlot holds the single hardware worker: run() stops the current
+    one and starts the new one as soon as the old one has really exited
+    (its pins and device files are closed by then). Switches that arrive
+    while that is pending replace each other; only the last one starts.
+
+    slot = WorkerSlot(on_start=..., on_exit=...)
+    slot.run(['python3', 'gpio_blink.py', '0.5'])   # never blocks
+    slot.stop()
+
+  python3 reaper.py --bench       # back-to-back mode switches: blocking wait vs this
+"""
+import os
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# --- CONFIGURATION ---
+KILL_AFTER = 0.5       # Seconds between SIGTERM and SIGKILL
+POLL_INTERVAL = 0.01   # Without pidfd or SIGCHLD
+
+
+def signal_group(proc, sig):
+    try:
+        os.killpg(os.getpgid(proc.pid), sig)
+    except (ProcessLookupError, PermissionError):
+        pass   # Already gone (the pgid lookup races with its exit)
+
+
+class Reaper:
+    def __init__(self, kill_after=KILL_AFTER):
+        self.kill_after = kill_after
+        self.lock = threading.Lock()
+        self.watched = {}    # pid -> [proc, on_exit, kill_at or None, pidfd, signal sent]
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_w, False)
+        self.mode = "pidfd" if hasattr(os, "pidfd_open") else "poll"
+        if self.mode == "poll" and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGCHLD, lambda signum, frame: self._wake())
+            self.mode = "sigchld"
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # --- PUBLIC ---
+    def watch(self, proc, on_exit=None):
+        """Calls on_exit(proc, how) from the reaper thread once proc has exited."""
+        fd = None
+        if self.mode == "pidfd":
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except OSError:
+                fd = None   # Already reaped by someone else; poll() below sorts it out
+        with self.lock:
+            self.watched[proc.pid] = [proc, on_exit, None, fd, None]
+        self._wake()
+
+    def terminate(self, proc, on_exit=None):
+        """SIGTERM now, SIGKILL after kill_after; returns immediately."""
+        with self.lock:
+            new = proc.pid not in self.watched
+        if new:
+            self.watch(proc, on_exit)
+        with self.lock:
+            entry = self.watched.get(proc.pid)
+            if entry is None:
+                return   # Exited and reaped in the meantime
+            if on_exit is not None:
+                entry[1] = on_exit
+            if entry[2] is None:
+                entry[2] = time.monotonic() + self.kill_after
+                entry[4] = "SIGTERM"
+                signal_group(proc, signal.SIGTERM)
+        self._wake()
+
+    def busy(self):
+        with self.lock:
+            return len(self.watched)
+
+    # --- THREAD ---
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b"x")
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        while True:
+            with self.lock:
+                entries = list(self.watched.values())
+            now = time.monotonic()
+            timeout = None
+            fds = [self.wake_r]
+            for proc, _, kill_at, fd, _ in entries:
+                if fd is not None:
+                    fds.append(fd)
+                if kill_at is not None:
+                    left = max(0.0, kill_at - now)
+                    timeout = left if timeout is None else min(timeout, left)
+            if self.mode != "pidfd" and entries:
+                timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+            ready, _, _ = select.select(fds, [], [], timeout)
+            if self.wake_r in ready:
+                os.read(self.wake_r, 4096)
+            self._check()
+
+    def _check(self):
+        now = time.monotonic()
+        done = []
+        with self.lock:
+            for pid, entry in list(self.watched.items()):
+                proc, on_exit, kill_at, fd, sent = entry
+                if proc.poll() is not None:   # waitpid(WNOHANG): reaps it
+                    del self.watched[pid]
+                    if fd is not None:
+                        os.close(fd)
+                    done.append((proc, on_exit, sent))
+                elif kill_at is not None and now >= kill_at and sent != "SIGKILL":
+                    signal_group(proc, signal.SIGKILL)
+                    entry[4] = "SIGKILL"
+                    entry[2] = now + 5.0   # Only for the wakeup; SIGKILL can't be ignored
+        for proc, on_exit, sent in done:
+            how = "exited" if sent is None else ("killed" if sent == "SIGKILL" else "terminated")
+            if on_exit:
+                on_exit(proc, how)
+
+
+class WorkerSlot:
+    """The one hardware worker. on_start(proc), on_exit(proc, how) are called
+    from whichever thread starts / reaps it; on_error(cmd, exc) if Popen fails."""
+
+    def __init__(self, reaper=None, on_start=None, on_exit=None, on_error=None, **popen_args):
+        self.reaper = reaper or Reaper()
+        self.on_start = on_start or (lambda proc: None)
+        self.on_exit = on_exit or (lambda proc, how: None)
+        self.on_error = on_error or (lambda cmd, e: None)
+        self.popen_args = popen_args
+        self.lock = threading.RLock()
+        self.current = None
+        self.dying = set()
+        self.pending = None
+        self.requested_at = None
+
+    def run(self, cmd):
+        """Stops the current worker and starts cmd once it is gone."""
+        with self.lock:
+            self._stop_current()
+            self.pending = cmd
+            self.requested_at = time.monotonic()
+            self._maybe_start()
+
+    def stop(self):
+        with self.lock:
+            self.pending = None
+            return self._stop_current()
+
+    def _stop_current(self):
+        proc, self.current = self.current, None
+        if proc is not None:
+            self.dying.add(proc)
+            self.reaper.terminate(proc, self._reaped)
+        return proc
+
+    def _maybe_start(self):
+        if self.pending is None or self.dying:
+            return
+        cmd, self.pending = self.pending, None
+        try:
+            proc = subprocess.Popen(cmd, start_new_session=True, **self.popen_args)
+        except OSError as e:
+            self.on_error(cmd, e)
+            return
+        self.current = proc
+        self.reaper.watch(proc, self._reaped)
+        self.on_start(proc)
+
+    def _reaped(self, proc, how):
+        with self.lock:
+            self.dying.discard(proc)
+            if self.current is proc:
+                self.current = None
+            self.on_exit(proc, how)
+            self._maybe_start()
+
+
+# --- BENCH ---
+WORKER = """
+import signal, sys, time
+cleanup = float(sys.argv[1])
+def stop(signum, frame):
+    time.sleep(cleanup)        # Releasing the hardware
+    sys.exit(0)
+signal.signal(signal.SIGTERM, stop if cleanup >= 0 else signal.SIG_IGN)
+print("ready", flush=True)
+while True:
+    time.sleep(1)
+"""
+
+
+def blocking_switch(state, cmd):
+    """The old kill_current_process() + run_script()."""
+    proc = state.get("proc")
+    if proc:
+        try:
+            os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+            proc.wait(timeout=1)
+        except Exception:
+            state["abandoned"].append(proc)   # Still alive: it keeps its pins
+    state["proc"] = subprocess.Popen(cmd, stdout=subprocess.PIPE, start_new_session=True)
+    return state["proc"]
+
+
+def bench_case(label, cleanup, switches=5, burst=10):
+    """Mode switches with the worker up and running (its SIGTERM handler
+    installed), then a burst of switches with no gap."""
+    cmd = [sys.executable, "-c", WORKER, str(cleanup)]
+    ms = lambda v: f"{1000 * v:7.1f}"
+
+    # Old: every switch blocks the loop until the previous worker is gone (or 1 s)
+    state = {"abandoned": []}
+    blocking_switch(state, cmd).stdout.readline()
+    blocked, ready = [], []
+    for _ in range(switches):
+        t = time.perf_counter()
+        proc = blocking_switch(state, cmd)
+        blocked.append(time.perf_counter() - t)
+        proc.stdout.readline()
+        ready.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    for _ in range(burst):
+        blocking_switch(state, cmd)
+    state["proc"].stdout.readline()
+    old_burst = time.perf_counter() - t
+    overlap = sum(p.poll() is None for p in state["abandoned"])
+    for p in state["abandoned"] + [state["proc"]]:
+        signal_group(p, signal.SIGKILL)
+        p.wait()
+    print(f"  {label:24} old: loop blocked {ms(max(blocked))} ms, next worker ready {ms(statistics.mean(ready))} ms, "
+          f"burst of {burst} {ms(old_burst)} ms, {overlap} old worker(s) left running")
+
+    # New: run() returns at once; the new worker starts when the old one has exited
+    started = []
+    slot = WorkerSlot(on_start=started.append, stdout=subprocess.PIPE)
+
+    def switch():
+        n = len(started)
+        t = time.perf_counter()
+        slot.run(cmd)
+        call = time.perf_counter() - t
+        while len(started) == n or slot.pending is not None:
+            time.sleep(0.0002)
+        started[-1].stdout.readline()
+        return call, time.perf_counter() - t
+
+    switch()
+    results = [switch() for _ in range(switches)]
+    n0 = len(started)
+    t = time.perf_counter()
+    calls = []
+    for _ in range(burst):
+        c = time.perf_counter()
+        slot.run(cmd)
+        calls.append(time.perf_counter() - c)
+    while slot.pending is not None or slot.current is None:
+        time.sleep(0.0002)
+    started[-1].stdout.readline()
+    new_burst = time.perf_counter() - t
+    alive = sum(p.poll() is None for p in started)
+    slot.stop()
+    while slot.reaper.busy():
+        time.sleep(0.005)
+    print(f"  {'':24} new: loop blocked {ms(max(max(c for c, _ in results), max(calls)))} ms, "
+          f"next worker ready {ms(statistics.mean([r for _, r in results]))} ms, "
+          f"burst of {burst} {ms(new_burst)} ms ({len(started) - n0} started), {alive - 1} old worker(s) left running")
+
+
+def run_bench():
+    print(f"Mode switches (reaper mode: {Reaper().mode}, SIGKILL after {KILL_AFTER} s; "
+          f"worker start-up time included)")
+    bench_case("worker exits on SIGTERM", 0.0)
+    bench_case("200 ms cleanup", 0.2)
+    bench_case("ignores SIGTERM (hung)", -1, switches=2, burst=3)
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+    else:
+        print("Usage: python3 reaper.py --bench")
@@ -0,0 +1,360 @@
+"""
+sd_block.py - SD card block driver over raw SPI (spidev).
+
+Talks to the card directly in SPI mode instead of going through a mounted
+filesystem:
+  init : 80 clocks, CMD0 -> CMD8 -> (CMD55 + ACMD41)* -> CMD58 [-> CMD16]
+         at INIT_HZ, then switches to FAST_HZ
+  read : CMD17 (one block) / CMD18 + CMD12 (many blocks)
+  write: CMD24 (one block) / CMD25 + stop token (many blocks)
+
+Every command frame is sent together with its NCR polling bytes, and block
+data moves in large xfer3/xfer2 buffers, so a multi-block transfer costs a
+handful of ioctls instead of one per byte.
+
+The block-device API (read_blocks/write_blocks/num_blocks) is what
+spi_sd_card.py uses for BLOCK_READ / CARD_INFO, and BlockDeviceFile wraps
+it as a seekable file so sd_transfer can stream raw ranges.
+
+Benchmark. It writes the blocks it reads back, so on a real card it needs a
+scratch range (--lba, never 0: that is the MBR / partition table) that holds
+nothing you want - 2048 blocks (1 MiB) from there are overwritten:
+  python3 sd_block.py --bench --sim
+  python3 sd_block.py --bench --lba <first scratch block>
+"""
+import io
+import sys
+import time
+
+import spi_sim
+from spi_sim import crc7
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+# --- CONFIGURATION ---
+SPI_BUS = 0
+SPI_DEV = 0            # /dev/spidev0.0 (CE0, Pin 24)
+INIT_HZ = 400_000      # Cards must be initialised at <= 400 kHz
+FAST_HZ = 16_000_000   # Data transfer clock once the card is ready
+MAX_XFER = 4096        # spidev bufsiz; raise with spidev.bufsiz=65536 in cmdline.txt
+INIT_TIMEOUT = 1.0     # Seconds to wait for ACMD41 to leave idle
+BUSY_TIMEOUT = 0.5     # Seconds to wait for a write to finish
+
+BLOCK_SIZE = 512
+
+TOKEN_START = 0xFE          # Single block read/write, multi-block read
+TOKEN_MULTI_WRITE = 0xFC
+TOKEN_STOP_TRAN = 0xFD
+
+
+class SDError(Exception):
+    pass
+
+
+class SDCardSPI:
+    """Raw block access to an SD/SDHC card on a spidev bus."""
+
+    def __init__(self, spi=None, bus=SPI_BUS, device=SPI_DEV,
+                 init_hz=INIT_HZ, fast_hz=FAST_HZ, max_xfer=MAX_XFER):
+        if spi is None:
+            if spidev is None:
+                raise SDError("spidev not installed (use spi_sim.SimulatedSDCard off-device)")
+            spi = spidev.SpiDev()
+            spi.open(bus, device)
+        self.spi = spi
+        self.init_hz = init_hz
+        self.fast_hz = fast_hz
+        self.max_xfer = max_xfer
+        self.high_capacity = False
+        self.num_blocks = 0
+        # xfer3 takes buffers larger than bufsiz; older py-spidev only has xfer2
+        self._xfer = getattr(spi, 'xfer3', None)
+
+    def close(self):
+        self.spi.close()
+
+    # --- LOW LEVEL ---
+    def _transfer(self, data):
+        """Full-duplex transfer of any length, in as few calls as allowed."""
+        if self._xfer is not None:
+            return bytes(self._xfer(data))
+        if len(data) <= self.max_xfer:
+            return bytes(self.spi.xfer2(data))
+        out = bytearray()
+        for i in range(0, len(data), self.max_xfer):
+            out += bytes(self.spi.xfer2(data[i:i + self.max_xfer]))
+        return bytes(out)
+
+    def _command(self, cmd, arg=0, extra=0):
+        """Sends a command; returns (R1, bytes clocked in after R1).
+
+        The frame and 8 NCR polling bytes (plus room for R3/R7) go out in a
+        single transfer. Whatever followed R1 is handed back because the
+        start of a data block may already be in it.
+        """
+        frame = bytes([0x40 | cmd]) + arg.to_bytes(4, 'big')
+        frame += bytes([crc7(frame)])
+        rx = self._transfer(frame + b'\xFF' * (9 + extra))
+        for i in range(len(frame), len(rx)):
+            if not rx[i] & 0x80:
+                rest = rx[i + 1:]
+                if len(rest) < extra:
+                    rest += self._transfer(b'\xFF' * (extra - len(rest)))
+                return rx[i], rest
+        raise SDError(f"No response to CMD{cmd}")
+
+    def _acmd(self, cmd, arg=0):
+        self._command(55)
+        return self._command(cmd, arg)[0]
+
+    def _wait_ready(self, timeout=BUSY_TIMEOUT):
+        """Polls until the card releases MISO (0xFF) after a write."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rx = self._transfer(b'\xFF' * 16)
+            if rx[-1] == 0xFF:
+                return
+        raise SDError("Card stayed busy")
+
+    def _read_data(self, count, pending=b'', block=BLOCK_SIZE):
+        """Reads `count` data blocks (token + data + CRC each) as one stream."""
+        out = bytearray()
+        total = count * block
+        while True:
+            pos = 0
+            while len(out) < total:
+                while pos < len(pending) and pending[pos] == 0xFF:
+                    pos += 1
+                if pos >= len(pending):
+                    pos = len(pending)
+                    break
+                if pending[pos] != TOKEN_START:
+                    raise SDError(f"Read error token 0x{pending[pos]:02X}")
+                if len(pending) - pos < block + 3:
+                    break  # Block continues in the next transfer
+                out += pending[pos + 1:pos + 1 + block]
+                pos += block + 3
+            if len(out) == total:
+                return bytes(out)
+            pending = pending[pos:]
+            # Ask for every remaining block plus NAC slack in one transfer
+            want = (count - len(out) // block) * (block + 3) + 8 - len(pending)
+            if self._xfer is None:
+                want = min(want, self.max_xfer)
+            pending += self._transfer(b'\xFF' * max(want, 1))
+
+    def _write_data(self, token, data):
+        """Sends one data block and checks the data-response token."""
+        rx = self._transfer(b'\xFF' + bytes([token]) + data + b'\xFF\xFF' + b'\xFF' * 2)
+        for b in rx[-2:]:
+            if b != 0xFF:
+                if b & 0x1F != 0x05:
+                    raise SDError(f"Write rejected (0x{b:02X})")
+                return
+        raise SDError("No data response")
+
+    def _addr(self, lba):
+        return lba if self.high_capacity else lba * BLOCK_SIZE
+
+    # --- INIT ---
+    def init(self):
+        """Runs the SPI-mode init sequence, then switches to the fast clock."""
+        self.spi.max_speed_hz = self.init_hz
+        self.spi.mode = 0
+        # >= 74 clocks to wake the card, with CS deasserted (high) as the spec asks
+        self.spi.no_cs = True
+        try:
+            self._transfer(b'\xFF' * 10)
+        finally:
+            self.spi.no_cs = False
+
+        for _ in range(10):
+            r1, _ = self._command(0)
+            if r1 == 0x01:
+                break
+        else:
+            raise SDError(f"CMD0 failed (R1=0x{r1:02X})")
+
+        r1, r7 = self._command(8, 0x1AA, extra=4)
+        v2 = not r1 & 0x04
+        if v2 and r7[2:4] != b'\x01\xAA':
+            raise SDError(f"CMD8 echo mismatch ({r7[:4].hex()})")
+
+        deadline = time.monotonic() + INIT_TIMEOUT
+        while self._acmd(41, 0x40000000 if v2 else 0) != 0x00:
+            if time.monotonic() > deadline:
+                raise SDError("ACMD41 timeout (card stayed idle)")
+
+        if v2:
+            r1, ocr = self._command(58, extra=4)
+            self.high_capacity = bool(ocr[0] & 0x40)
+        if not self.high_capacity:
+            self._command(16, BLOCK_SIZE)
+
+        self.num_blocks = self._read_capacity()
+        self.spi.max_speed_hz = self.fast_hz
+        return self
+
+    def _read_capacity(self):
+        r1, rest = self._command(9)
+        if r1 != 0x00:
+            return 0
+        csd = self._read_data(1, rest, block=16)
+        if csd[0] >> 6 == 1:  # CSD v2 (SDHC/SDXC)
+            c_size = ((csd[7] & 0x3F) << 16) | (csd[8] << 8) | csd[9]
+            return (c_size + 1) * 1024
+        read_bl_len = csd[5] & 0x0F
+        c_size = ((csd[6] & 0x03) << 10) | (csd[7] << 2) | (csd[8] >> 6)
+        c_size_mult = ((csd[9] & 0x03) << 1) | (csd[10] >> 7)
+        return (c_size + 1) << (c_size_mult + 2 + read_bl_len - 9)
+
+    # --- BLOCK DEVICE API ---
+    def read_blocks(self, lba, count=1):
+        if count < 1:
+            return b''
+        if count == 1:
+            r1, rest = self._command(17, self._addr(lba))
+            if r1 != 0x00:
+                raise SDError(f"CMD17 failed (R1=0x{r1:02X})")
+            return self._read_data(1, rest)
+
+        r1, rest = self._command(18, self._addr(lba))
+        if r1 != 0x00:
+            raise SDError(f"CMD18 failed (R1=0x{r1:02X})")
+        data = self._read_data(count, rest)
+        self._command(12)
+        self._wait_ready()
+        return data
+
+    def write_blocks(self, lba, data):
+        if len(data) % BLOCK_SIZE:
+            raise ValueError("Data must be a whole number of 512-byte blocks")
+        count = len(data) // BLOCK_SIZE
+        view = memoryview(data)
+        if count == 1:
+            r1, _ = self._command(24, self._addr(lba))
+            if r1 != 0x00:
+                raise SDError(f"CMD24 failed (R1=0x{r1:02X})")
+            self._write_data(TOKEN_START, bytes(view))
+            self._wait_ready()
+            return
+
+        r1, _ = self._command(25, self._addr(lba))
+        if r1 != 0x00:
+            raise SDError(f"CMD25 failed (R1=0x{r1:02X})")
+        for i in range(count):
+            self._write_data(TOKEN_MULTI_WRITE, bytes(view[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]))
+            self._wait_ready()
+        self._transfer(bytes([TOKEN_STOP_TRAN, 0xFF]))
+        self._wait_ready()
+
+
+class BlockDeviceFile(io.RawIOBase):
+    """Read-only, seekable file view of a block range (for ranged streaming)."""
+
+    def __init__(self, dev, first_lba=0, count=None, max_blocks=8):
+        self.dev = dev
+        self.first_lba = first_lba
+        if count is None:
+            count = dev.num_blocks - first_lba
+        self.pos = 0
+        self.size = count * BLOCK_SIZE
+        self.max_blocks = max_blocks
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+        lba, skip = divmod(self.pos, BLOCK_SIZE)
+        want = min(len(b), self.size - self.pos)
+        count = min(self.max_blocks, -(-(skip + want) // BLOCK_SIZE))
+        data = self.dev.read_blocks(self.first_lba + lba, count)[skip:skip + want]
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+def open_card(simulate=False):
+    """Opens and initialises the card (the simulator only if asked for)."""
+    if simulate:
+        return SDCardSPI(spi_sim.SimulatedSDCard(num_blocks=8192)).init()
+    if spidev is None:
+        raise SDError("spidev not available")
+    return SDCardSPI().init()
+
+
+# --- BENCHMARK ---
+def run_benchmark(simulate=False, first_lba=None, total_bytes=1024 * 1024):
+    """Writes and reads back total_bytes from first_lba on (required, and not 0, on a real card)."""
+    sim = simulate
+    if not sim and not first_lba:
+        raise SDError("a real card needs --lba <first scratch block> (not 0: the MBR); the bench overwrites "
+                      f"{total_bytes // BLOCK_SIZE} blocks from there")
+    first_lba = first_lba or 0
+    t0 = time.perf_counter()
+    card = open_card(simulate=sim)
+    t_init = time.perf_counter() - t0
+    if first_lba + total_bytes // BLOCK_SIZE > card.num_blocks:
+        card.close()
+        raise SDError(f"scratch range {first_lba}+{total_bytes // BLOCK_SIZE} is past the card's "
+                      f"{card.num_blocks} blocks")
+    kind = "simulated card" if sim else f"/dev/spidev{SPI_BUS}.{SPI_DEV}"
+    print(f"{kind}: {card.num_blocks} blocks, "
+          f"{'SDHC' if card.high_capacity else 'SDSC'}, init {t_init * 1000:.1f} ms, "
+          f"clock {card.fast_hz / 1e6:.0f} MHz")
+    header = f"{'blocks/xfer':>11} {'read MB/s':>10} {'write MB/s':>11}"
+    if sim:
+        header += f" {'bus-limited read':>17} {'write':>8}"
+    print(header)
+
+    for per_xfer in (1, 2, 4, 8, 16, 32, 64):
+        rounds = max(1, total_bytes // (per_xfer * BLOCK_SIZE))
+        rounds = min(rounds, (card.num_blocks - first_lba) // per_xfer)
+        payload = bytes(range(256)) * (per_xfer * BLOCK_SIZE // 256)
+        results = []
+        for op in ('write', 'read'):
+            if sim:
+                card.spi.bytes_clocked = card.spi.calls = 0
+            t0 = time.perf_counter()
+            for r in range(rounds):
+                if op == 'write':
+                    card.write_blocks(first_lba + r * per_xfer, payload)
+                else:
+                    assert card.read_blocks(first_lba + r * per_xfer, per_xfer) == payload
+            wall = time.perf_counter() - t0
+            moved = rounds * per_xfer * BLOCK_SIZE / 1e6
+            results.append((op, moved / wall, moved / card.spi.modelled_seconds() if sim else 0))
+        (_, w, wm), (_, r, rm) = results
+        line = f"{per_xfer:11} {r:10.2f} {w:11.2f}"
+        if sim:
+            line += f" {rm:17.2f} {wm:8.2f}"
+        print(line)
+    card.close()
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        lba = int(sys.argv[sys.argv.index('--lba') + 1]) if '--lba' in sys.argv else None
+        try:
+            run_benchmark(simulate='--sim' in sys.argv, first_lba=lba)
+        except SDError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    else:
+        print("Usage: python3 sd_block.py --bench --sim | --bench --lba <first scratch block>")
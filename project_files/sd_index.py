@@ -0,0 +1,239 @@
+"""
+sd_index.py - Metadata index for the SD storage directory.
+
+Keeps name, size, mtime and CRC32 of every stored file in a small SQLite
+database next to the storage directory, so LIST can filter, sort and page
+through tens of thousands of files without an os.listdir() per request.
+
+Kept current two ways:
+  * on write  - spi_sd_card.py and SDLogWriter call update(name)
+  * on change - sync() rescans only when the directory mtime moved
+                (files created/deleted/renamed behind our back)
+
+CRC32s are filled in lazily, only for rows that end up on a page.
+
+Benchmark:
+  python3 sd_index.py --bench
+"""
+import base64
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+
+# --- CONFIGURATION ---
+SD_PATH = "sd_card_storage"   # Same storage directory as spi_sd_card.py
+PAGE_SIZE = 20                # Rows per LIST page (one page per UART reply)
+
+SORT_KEYS = ('name', 'size', 'mtime')
+
+
+def file_crc(fpath, block=64 * 1024):
+    crc = 0
+    with open(fpath, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return f"{crc & 0xFFFFFFFF:08X}"
+
+
+def encode_cursor(value, name):
+    raw = json.dumps([value, name]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    value, name = json.loads(raw)
+    return value, name
+
+
+class SDIndex:
+    def __init__(self, sd_path=SD_PATH, db_path=None):
+        self.sd_path = sd_path
+        os.makedirs(sd_path, exist_ok=True)
+        self.db = sqlite3.connect(db_path or os.path.normpath(sd_path) + ".index.db")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                name  TEXT PRIMARY KEY,
+                size  INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                crc   TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_size  ON files(size, name);
+            CREATE INDEX IF NOT EXISTS files_mtime ON files(mtime, name);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    # --- KEEPING IT CURRENT ---
+    def update(self, name):
+        """Refreshes one entry after we wrote (or deleted) it."""
+        fpath = os.path.join(self.sd_path, name)
+        try:
+            st = os.stat(fpath)
+        except FileNotFoundError:
+            self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+        else:
+            # CRC goes stale on every write; it is recomputed when listed
+            self.db.execute(
+                "INSERT INTO files(name, size, mtime, crc) VALUES (?, ?, ?, NULL) "
+                "ON CONFLICT(name) DO UPDATE SET size = excluded.size, "
+                "mtime = excluded.mtime, crc = NULL "
+                "WHERE size != excluded.size OR mtime != excluded.mtime",
+                (name, st.st_size, st.st_mtime))
+        self.db.commit()
+
+    def sync(self, force=False):
+        """Rescans the directory if entries were added or removed since last time."""
+        dir_mtime = os.stat(self.sd_path).st_mtime
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'dir_mtime'").fetchone()
+        if not force and row and row[0] == dir_mtime:
+            return False
+
+        known = {name: (size, mtime) for name, size, mtime in
+                 self.db.execute("SELECT name, size, mtime FROM files")}
+        seen = set()
+        changed = []
+        with os.scandir(self.sd_path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                seen.add(entry.name)
+                if known.get(entry.name) != (st.st_size, st.st_mtime):
+                    changed.append((entry.name, st.st_size, st.st_mtime))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files(name, size, mtime, crc) VALUES (?, ?, ?, NULL)", changed)
+        self.db.executemany("DELETE FROM files WHERE name = ?",
+                            [(name,) for name in known.keys() - seen])
+        self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('dir_mtime', ?)", (dir_mtime,))
+        self.db.commit()
+        return True
+
+    # --- QUERYING ---
+    def query(self, pattern="", sort="name", cursor="", limit=PAGE_SIZE):
+        """Returns (rows, next_cursor). rows are (name, size, mtime, crc).
+
+        pattern : prefix, or a glob if it contains * ? or [
+        sort    : name | size | mtime, prefix with '-' for descending
+        cursor  : next_cursor from the previous page ('' for the first page)
+        """
+        desc = sort.startswith('-')
+        key = sort.lstrip('-') or 'name'
+        if key not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {key}")
+
+        where, params = [], []
+        if pattern:
+            if any(c in pattern for c in '*?['):
+                where.append("name GLOB ?")
+                params.append(pattern)
+            else:
+                # Range scan on the primary key instead of LIKE 'prefix%'
+                where.append("name >= ? AND name < ?")
+                params += [pattern, pattern + '\U0010FFFF']
+        if cursor:
+            value, name = decode_cursor(cursor)
+            op = '<' if desc else '>'
+            if key == 'name':
+                where.append(f"name {op} ?")
+                params.append(name)
+            else:
+                where.append(f"({key}, name) {op} (?, ?)")
+                params += [value, name]
+
+        order = "DESC" if desc else "ASC"
+        order_by = "name" if key == 'name' else f"{key} {order}, name"
+        sql = (f"SELECT name, size, mtime, crc FROM files "
+               f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+               f"ORDER BY {order_by} {order} LIMIT ?")
+        rows = self.db.execute(sql, params + [limit + 1]).fetchall()
+
+        more = len(rows) > limit
+        rows = [self._with_crc(r) for r in rows[:limit]]
+        next_cursor = ""
+        if more:
+            last = rows[-1]
+            next_cursor = encode_cursor(last[SORT_KEYS.index(key)], last[0])
+        return rows, next_cursor
+
+    def _with_crc(self, row):
+        name, size, mtime, crc = row
+        if crc is None:
+            try:
+                crc = file_crc(os.path.join(self.sd_path, name))
+            except FileNotFoundError:
+                crc = "-"
+            else:
+                self.db.execute("UPDATE files SET crc = ? WHERE name = ? AND mtime = ?",
+                                (crc, name, mtime))
+                self.db.commit()
+        return name, size, mtime, crc
+
+
+def print_page(index, pattern="", sort="name", cursor="", limit=PAGE_SIZE):
+    """Prints one LIST page as FILE_ROW lines followed by a FILE_PAGE footer."""
+    index.sync()
+    rows, next_cursor = index.query(pattern, sort, cursor, limit)
+    for name, size, mtime, crc in rows:
+        print(f"FILE_ROW:{name}:{size}:{int(mtime)}:{crc}")
+    print(f"FILE_PAGE:{len(rows)}:{next_cursor or '-'}")
+
+
+# --- BENCHMARK ---
+def run_benchmark(n_files=100_000, sd_path="bench_index_storage"):
+    os.makedirs(sd_path, exist_ok=True)
+    existing = len(os.listdir(sd_path))
+    for i in range(existing, n_files):
+        with open(os.path.join(sd_path, f"log_{i:06d}.csv"), 'w') as f:
+            f.write(f"{i}\n")
+
+    t0 = time.perf_counter()
+    names = os.listdir(sd_path)
+    line = f"FILE_LIST: {', '.join(names)}"
+    t_listdir = time.perf_counter() - t0
+
+    index = SDIndex(sd_path)
+    t0 = time.perf_counter()
+    index.sync(force=True)
+    t_sync = time.perf_counter() - t0
+
+    def timed(**kw):
+        t0 = time.perf_counter()
+        index.sync()
+        rows, cur = index.query(**kw)
+        return (time.perf_counter() - t0) * 1000, rows, cur
+
+    # CRCs are filled in lazily, as LIST hands out each row: the first pages pay for them
+    index.db.execute("UPDATE files SET crc = NULL")
+    print(f"{n_files} files")
+    print(f"  old LIST (listdir + join): {t_listdir * 1000:8.1f} ms, {len(line)} bytes "
+          f"= {len(line) * 10 / 115200:.1f} s at 115200 baud")
+    print(f"  full index rebuild       : {t_sync * 1000:8.1f} ms (first run only)")
+    ms, rows, _ = timed()
+    print(f"  LIST, CRCs not known yet : {ms:8.2f} ms first page ({len(rows)} CRCs computed)")
+    for kw in ({}, {'pattern': 'log_0500'}, {'pattern': 'log_*7.csv'},
+               {'sort': '-mtime'}, {'sort': 'size'}):
+        ms, rows, cur = timed(**kw)
+        ms2, _, _ = timed(cursor=cur, **kw)
+        page = sum(len(f"FILE_ROW:{r[0]}:{r[1]}:{int(r[2])}:{r[3]}\n") for r in rows)
+        print(f"  LIST {str(kw):28}: {ms:6.2f} ms first page, {ms2:6.2f} ms next page, "
+              f"{page} bytes/page")
+    t0 = time.perf_counter()
+    index.query(limit=n_files)
+    print(f"  CRC of the remaining files: {(time.perf_counter() - t0) * 1000:7.1f} ms (once per new/changed file)")
+    index.close()
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_benchmark()
+    else:
+        print("Usage: python3 sd_index.py --bench")
@@ -0,0 +1,205 @@
+"""
+sd_logger.py - High-rate append logging to the SD storage.
+
+The listener keeps one SDLogWriter per log name open for its whole life, so
+each record costs a memory append instead of a process spawn + file open.
+Records are written in whole blocks, fsync'd on a time or byte budget, and
+files rotate by size or by date.
+
+Benchmark against the old one-spawn-per-WRITE path:
+  python3 sd_logger.py --bench
+"""
+import os
+import sys
+import time
+import subprocess
+from datetime import datetime
+
+# --- CONFIGURATION ---
+SD_PATH = "sd_card_storage"     # Same storage directory as spi_sd_card.py
+BLOCK_SIZE = 4096               # Write to the card in whole blocks
+FSYNC_INTERVAL = 1.0            # Seconds of data we are willing to lose
+FSYNC_BYTES = 64 * 1024         # ...or this many bytes, whichever comes first
+ROTATE_BYTES = 8 * 1024 * 1024  # Start a new file past this size
+ROTATE_DAILY = True             # ...and at midnight
+
+
+class SDLogWriter:
+    """Buffered, block-aligned append writer for one log stream.
+
+    Files are named <SD_PATH>/<name>_<YYYYMMDD>_<n><ext>.
+    """
+
+    def __init__(self, name, sd_path=SD_PATH, block_size=BLOCK_SIZE,
+                 fsync_interval=FSYNC_INTERVAL, fsync_bytes=FSYNC_BYTES,
+                 rotate_bytes=ROTATE_BYTES, rotate_daily=ROTATE_DAILY, index=None, ext=".log"):
+        self.name = name
+        self.ext = ext
+        self.index = index  # Optional SDIndex, refreshed after every fsync
+        self.sd_path = sd_path
+        self.block_size = block_size
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        self.rotate_bytes = rotate_bytes
+        self.rotate_daily = rotate_daily
+
+        self.buf = bytearray()
+        self.fd = None
+        self.path = None
+        self.day = None
+        self.file_size = 0
+        self.unsynced = 0        # Bytes written or buffered since the last fsync
+        self.last_sync = time.monotonic()
+
+        # Stats for the benchmark / status reports
+        self.records = 0
+        self.fsyncs = 0
+        self.max_unsynced = 0
+        self.max_sync_gap = 0.0
+
+        os.makedirs(sd_path, exist_ok=True)
+
+    # --- FILE HANDLING ---
+    def _open(self):
+        today = datetime.now().strftime("%Y%m%d")
+        n = 0
+        while True:
+            path = os.path.join(self.sd_path, f"{self.name}_{today}_{n}{self.ext}")
+            if not os.path.exists(path) or os.path.getsize(path) < self.rotate_bytes:
+                break
+            n += 1
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.path = path
+        self.day = today
+        self.file_size = os.fstat(self.fd).st_size
+
+    def _rotate_if_needed(self):
+        if self.fd is None:
+            self._open()
+            return
+        new_day = self.rotate_daily and datetime.now().strftime("%Y%m%d") != self.day
+        if new_day or self.file_size >= self.rotate_bytes:
+            # Finish the old file directly; flush() would come back here
+            if self.buf:
+                self._write(self.buf)
+                self.buf.clear()
+            self.flush(sync=True)
+            os.close(self.fd)
+            self.fd = None
+            self._open()
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+        self.file_size += len(data)
+
+    # --- PUBLIC API ---
+    def append(self, record, sep=b"\n"):
+        """Queues one record (str or bytes) followed by sep (b"" for binary)."""
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        self.buf += record
+        self.buf += sep
+        self.unsynced += len(record) + len(sep)
+        self.records += 1
+        self.max_unsynced = max(self.max_unsynced, self.unsynced)
+
+        self._rotate_if_needed()
+        # Top the file up to a block boundary, then write whole blocks only
+        head = (-self.file_size) % self.block_size or self.block_size
+        if len(self.buf) >= head:
+            n = head + (len(self.buf) - head) // self.block_size * self.block_size
+            self._write(self.buf[:n])
+            del self.buf[:n]
+        self.tick()
+
+    def tick(self):
+        """Syncs if the time or byte budget ran out. Call this from idle loops."""
+        if self.unsynced == 0:
+            self.last_sync = time.monotonic()
+            return
+        if (self.unsynced >= self.fsync_bytes or
+                time.monotonic() - self.last_sync >= self.fsync_interval):
+            self.flush(sync=True)
+
+    def flush(self, sync=True):
+        """Writes out the partial block and optionally fsyncs."""
+        if self.buf:
+            self._rotate_if_needed()
+            self._write(self.buf)
+            self.buf.clear()
+        if sync and self.fd is not None:
+            os.fsync(self.fd)
+            now = time.monotonic()
+            self.max_sync_gap = max(self.max_sync_gap, now - self.last_sync)
+            self.last_sync = now
+            self.unsynced = 0
+            self.fsyncs += 1
+            if self.index is not None:
+                self.index.update(os.path.basename(self.path))
+
+    def close(self):
+        if self.fd is not None:
+            self.flush(sync=True)
+            os.close(self.fd)
+            self.fd = None
+
+
+# --- BENCHMARK ---
+def _bench_legacy_inprocess(sd_path, records):
+    """Old WRITE semantics without the spawn: open('w') + write per record."""
+    fpath = os.path.join(sd_path, "legacy.txt")
+    t0 = time.perf_counter()
+    for rec in records:
+        with open(fpath, 'w') as f:
+            f.write(rec)
+    return time.perf_counter() - t0
+
+
+def _bench_legacy_spawn(sd_path, records):
+    """The real old path: one spi_sd_card.py process per record."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, "spi_sd_card.py")
+    t0 = time.perf_counter()
+    for rec in records:
+        subprocess.run([sys.executable, script, 'WRITE', 'legacy.txt', rec],
+                       cwd=os.path.dirname(os.path.abspath(sd_path)), capture_output=True)
+    return time.perf_counter() - t0
+
+
+def _bench_logger(sd_path, records):
+    w = SDLogWriter("bench", sd_path=sd_path)
+    t0 = time.perf_counter()
+    for rec in records:
+        w.append(rec)
+    w.close()
+    return time.perf_counter() - t0, w
+
+
+def run_benchmark(n_records=200_000, n_spawn=50, sd_path="bench_sd_storage"):
+    os.makedirs(sd_path, exist_ok=True)
+    records = [f"{time.time():.6f},sensor{i % 8},{i * 0.001:.3f}" for i in range(n_records)]
+    rec_len = sum(len(r) + 1 for r in records) / n_records
+
+    t_spawn = _bench_legacy_spawn(sd_path, records[:n_spawn])
+    t_open = _bench_legacy_inprocess(sd_path, records)
+    t_log, w = _bench_logger(sd_path, records)
+
+    print(f"Records: {n_records} x ~{rec_len:.0f} B")
+    print(f"{'path':32} {'records/s':>12}  worst-case loss on power cut")
+    print(f"{'WRITE (spawn per record)':32} {n_spawn / t_spawn:12.0f}  "
+          f"every earlier record ('w' truncates) + unsynced page cache")
+    print(f"{'WRITE (open w per record)':32} {n_records / t_open:12.0f}  "
+          f"every earlier record ('w' truncates) + unsynced page cache")
+    print(f"{'SDLogWriter (append)':32} {n_records / t_log:12.0f}  "
+          f"<= {w.max_unsynced} B (~{w.max_unsynced / rec_len:.0f} records), "
+          f"max {w.max_sync_gap * 1000:.0f} ms between fsyncs, {w.fsyncs} fsyncs")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_benchmark()
+    else:
+        print("Usage: python3 sd_logger.py --bench")
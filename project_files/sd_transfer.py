@@ -0,0 +1,265 @@
+"""
+sd_transfer.py - Chunked, resumable file transfer for the SD storage.
+
+Pi side  : stream_file() reads a byte range in fixed-size chunks and prints
+           one line per chunk, so memory use stays constant for any file size.
+PC side  : ChunkAssembler rebuilds the file from those lines into a spool
+           file and reports the offset to resume from after a bad chunk.
+
+Line format (one line per chunk, safe for UART + readline()):
+  READ_BEGIN:<fname>:<size>:<mtime>:<offset>:<length>
+  READ_CHUNK:<fname>:<offset>:<crc32>:<base64 data>
+  READ_END:<fname>:<end_offset>:<crc32 of whole range>
+"""
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+# --- CONFIGURATION ---
+CHUNK_SIZE = 192  # Raw bytes per chunk -> 256 base64 chars per UART line
+RESUME_RETRY_S = 1.0   # Re-send a resume request with no READ_BEGIN after an RTT plus
+                       # this (the Pi starts a new reader for it)
+RESUME_TRIES = 5       # ...this many times, then give the transfer up
+
+READ_PREFIX = "READ_"
+
+
+def crc_hex(data, value=0):
+    return f"{zlib.crc32(data, value) & 0xFFFFFFFF:08X}"
+
+
+# --- PI SIDE ---
+def stream_file(fpath, fname, offset=0, length=-1, out=None):
+    """Prints READ_BEGIN/READ_CHUNK/READ_END lines for a byte range of fpath."""
+    st = os.stat(fpath)
+    with open(fpath, 'rb') as f:
+        stream_fileobj(f, fname, st.st_size, int(st.st_mtime), offset, length, out)
+
+
+def stream_fileobj(f, fname, size, mtime, offset=0, length=-1, out=None):
+    """Same as stream_file() for any seekable binary file (e.g. a block device)."""
+    out = out or sys.stdout
+    offset = max(0, min(offset, size))
+    end = size if length < 0 else min(size, offset + length)
+
+    out.write(f"READ_BEGIN:{fname}:{size}:{mtime}:{offset}:{end - offset}\n")
+    running = 0
+    f.seek(offset)
+    pos = offset
+    while pos < end:
+        data = f.read(min(CHUNK_SIZE, end - pos))
+        if not data:
+            break  # File shrank while we were reading
+        running = zlib.crc32(data, running)
+        b64 = base64.b64encode(data).decode('ascii')
+        out.write(f"READ_CHUNK:{fname}:{pos}:{crc_hex(data)}:{b64}\n")
+        out.flush()  # Hand each chunk to the listener straight away
+        pos += len(data)
+    out.write(f"READ_END:{fname}:{pos}:{running & 0xFFFFFFFF:08X}\n")
+    out.flush()
+
+
+# --- PC SIDE ---
+class ChunkAssembler:
+    """Reassembles READ_* lines into spool files under download_dir.
+
+    Only chunks that extend the verified prefix are written, so the spool
+    file always holds [start, received) of the file and received is the offset
+    to resume from. A small JSON sidecar remembers which version (size +
+    mtime) of the file and which requested range [start, end) it belongs to.
+
+    retry_after, if given, returns how long to wait for the READ_BEGIN of a
+    resume request (e.g. the link's RTO + RESUME_RETRY_S); RESUME_RETRY_S
+    alone otherwise.
+    """
+
+    def __init__(self, download_dir="downloads", retry_after=None):
+        self.download_dir = download_dir
+        self.retry_after = retry_after
+        os.makedirs(download_dir, exist_ok=True)
+        self.files = {}  # fname -> state dict
+        self.cond = threading.Condition()
+
+    def _paths(self, fname):
+        base = os.path.join(self.download_dir, os.path.basename(fname))
+        return base + ".part", base + ".json"
+
+    def _state(self, fname):
+        st = self.files.get(fname)
+        if st is None:
+            part, meta = self._paths(fname)
+            st = {'size': None, 'mtime': None, 'start': 0, 'end': None, 'received': 0,
+                  'stream_start': 0, 'done': False, 'error': None}
+            if os.path.exists(meta) and os.path.exists(part):
+                with open(meta) as f:
+                    st.update(json.load(f))
+                st['received'] = st['start'] + os.path.getsize(part)
+            self.files[fname] = st
+        return st
+
+    def resume_offset(self, fname):
+        """Returns the offset the next READ request for fname should start at."""
+        with self.cond:
+            st = self._state(fname)
+            return 0 if st['done'] else st['received']
+
+    def resume_length(self, fname, offset):
+        """Bytes to ask for from offset to finish the requested range, or -1
+        for the rest of the file."""
+        with self.cond:
+            st = self._state(fname)
+            if st['end'] is None or st['size'] is None or st['end'] >= st['size'] or offset < st['start']:
+                return -1
+            return max(0, st['end'] - offset)
+
+    def spool_path(self, fname):
+        return self._paths(fname)[0]
+
+    def handle_line(self, line):
+        """Feeds one UART line. Returns (fname, resume_offset) when a re-request
+        is needed, (fname, None) when the line was consumed, or None if the
+        line is not part of a transfer."""
+        if not line.startswith(READ_PREFIX):
+            return None
+        tag, _, rest = line.partition(':')
+        with self.cond:
+            try:
+                if tag == "READ_BEGIN":
+                    result = self._on_begin(*rest.split(':'))
+                elif tag == "READ_CHUNK":
+                    result = self._on_chunk(*rest.split(':', 3))
+                elif tag == "READ_END":
+                    result = self._on_end(*rest.split(':'))
+                else:
+                    return None
+            except (TypeError, ValueError) as e:
+                # Garbled line: restart from what we already have
+                fname = rest.split(':', 1)[0]
+                if fname not in self.files:
+                    return None
+                self.files[fname]['error'] = f"Bad line: {e}"
+                result = fname, self.files[fname]['received']
+            finally:
+                self.cond.notify_all()
+
+            # Ask for each resume offset once per retry interval; the rest of the
+            # stale stream keeps arriving until the Pi sees the new request.
+            fname, resume = result
+            st = self.files[fname]
+            if resume is not None:
+                now = time.monotonic()
+                pending = st.get('pending')
+                if pending and pending[0] == resume:
+                    if now - pending[1] < self._retry_s():
+                        return fname, None
+                    st['pending'] = resume, now, pending[2] + 1
+                else:
+                    st['pending'] = resume, now, 1
+            return result
+
+    def overdue(self):
+        """Returns [(fname, resume_offset)] for resume requests that got no
+        READ_BEGIN in time (the request line was lost), to be sent again.
+        A transfer is given up after RESUME_TRIES requests."""
+        now = time.monotonic()
+        retry, due = self._retry_s(), []
+        with self.cond:
+            for fname, st in self.files.items():
+                pending = st.get('pending')
+                if not pending or now - pending[1] < retry:
+                    continue
+                resume, _, tries = pending
+                if tries >= RESUME_TRIES:
+                    st['pending'] = None
+                    st['error'] = f"No answer to {tries} resume requests at {resume}"
+                    self.cond.notify_all()
+                    continue
+                st['pending'] = resume, now, tries + 1
+                due.append((fname, resume))
+        return due
+
+    def _retry_s(self):
+        return self.retry_after() if self.retry_after else RESUME_RETRY_S
+
+    def _save_meta(self, fname, st):
+        with open(self._paths(fname)[1], 'w') as f:
+            json.dump({k: st[k] for k in ('size', 'mtime', 'start', 'end')}, f)
+
+    def _on_begin(self, fname, size, mtime, offset, length):
+        st = self._state(fname)
+        size, mtime, offset, length = int(size), int(mtime), int(offset), int(length)
+        if (st['size'], st['mtime']) != (size, mtime) or st['done'] or offset != st['received'] \
+                or offset == st['start']:
+            # New file version, or a read of another range: throw away the old prefix
+            open(self._paths(fname)[0], 'wb').close()
+            st.update(size=size, mtime=mtime, start=offset, received=offset)
+        # else: the resume of the prefix we have, which it continues
+        st['end'] = offset + length
+        self._save_meta(fname, st)
+        st['stream_start'] = offset
+        st['done'] = False
+        st['error'] = None
+        st['pending'] = None
+        return fname, None
+
+    def _on_chunk(self, fname, offset, crc, b64):
+        st = self._state(fname)
+        offset = int(offset)
+        if offset < st['received']:
+            return fname, None  # Duplicate from an overlapping resume
+        if offset > st['received']:
+            st['error'] = f"Gap at {st['received']}"
+            return fname, st['received']
+        data = base64.b64decode(b64, validate=True)
+        if crc_hex(data) != crc:
+            st['error'] = f"CRC mismatch at {offset}"
+            return fname, st['received']
+        with open(self._paths(fname)[0], 'ab') as f:
+            f.write(data)
+        st['received'] += len(data)
+        return fname, None
+
+    def _on_end(self, fname, end_offset, crc):
+        st = self._state(fname)
+        if int(end_offset) != st['received']:
+            return fname, st['received']
+        # The Pi's CRC covers this stream, [stream_start, end): check it against the spool
+        part = self._paths(fname)[0]
+        running = 0
+        with open(part, 'rb') as f:
+            f.seek(st['stream_start'] - st['start'])
+            for data in iter(lambda: f.read(65536), b""):
+                running = zlib.crc32(data, running)
+        if f"{running & 0xFFFFFFFF:08X}" != crc:
+            st['error'] = f"Range CRC mismatch over {st['stream_start']}-{st['received']}"
+            with open(part, 'r+b') as f:
+                f.truncate(st['stream_start'] - st['start'])
+            st['received'] = st['stream_start']
+            return fname, st['received']
+        if st['received'] >= (st['end'] if st['end'] is not None else st['size'] or 0):
+            st['done'] = True
+        return fname, None
+
+    def iter_file(self, fname, block=4096, timeout=30):
+        """Yields the file as it streams in; stops when done or stalled."""
+        pos = 0
+        with open(self.spool_path(fname), 'rb') as f:
+            while True:
+                with self.cond:
+                    st = self._state(fname)
+                    while pos >= st['received'] - st['start'] and not st['done']:
+                        if not self.cond.wait(timeout):
+                            return  # Transfer stalled, end the HTTP response
+                    available = st['received'] - st['start'] - pos
+                    done = st['done']
+                if available > 0:
+                    f.seek(pos)
+                    data = f.read(min(block, available))
+                    pos += len(data)
+                    yield data
+                elif done:
+                    return
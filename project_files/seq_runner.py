@@ -0,0 +1,258 @@
+"""
+seq_runner.py - Runs one compiled sequence program (WORKER)
+
+Started by CMD:SEQ:RUN (cmd_seq.py) with the program file written by
+CMD:SEQ:PUT. The whole program runs in this one process: no UART round trip
+and no process spawn per step. Timing is deadline based. Every 'wait' moves
+an absolute deadline forward and the runner sleeps (spinning the last
+SPIN_MARGIN) until it. A slow step therefore makes the next one late, but
+the pattern as a whole never drifts.
+
+Prints, forwarded to the PC as log lines:
+    SEQ_EVENT:<label>:<steps so far>:<ms since start>     for 'event'
+    SEQ_DONE:<steps>:<ms>:<late p99 us>:<late max us>      at the end (or on stop)
+
+With --sim (off the Pi) pins are simulated. Without RPi.GPIO and without
+--sim the worker stops with an error. Without the tm1637 module 'show'
+prints instead of driving the display.
+
+  python3 seq_runner.py <program.seqb> [start time, CLOCK_MONOTONIC s] [--sim]
+  python3 seq_runner.py --bench        # step rate and timing vs one CMD per step
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import clock_sync
+import sd_logger
+import seqc
+
+# --- CONFIGURATION ---
+DISPLAY_PINS = (5, 4)      # TM1637 CLK, DIO (as i2c_timer.py)
+LATE_SAMPLES = 100000      # Wait lateness values kept for the p99
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+
+class SimGPIO:
+    """Just enough of RPi.GPIO to run programs off the Pi."""
+    BCM, OUT, LOW, HIGH = "BCM", "OUT", 0, 1
+
+    def __init__(self):
+        self.levels = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        self.levels[pin] = 0
+
+    def output(self, pin, level):
+        self.levels[pin] = level
+        self.writes += 1
+
+    def cleanup(self):
+        pass
+
+    class PWM:
+        def __init__(self, pin, hz):
+            self.duty = 0
+
+        def start(self, duty):
+            self.duty = duty
+
+        def ChangeDutyCycle(self, duty):
+            self.duty = duty
+
+        def ChangeFrequency(self, hz):
+            pass
+
+        def stop(self):
+            pass
+
+
+class Runner:
+    def __init__(self, code, gpio=None, storage=sd_logger.SD_PATH, out=print):
+        self.consts, self.program = seqc.decode(code)
+        self.gpio = gpio or GPIO
+        if self.gpio is None:
+            raise seqc.SeqError("RPi.GPIO not installed (run on the Pi, or --sim for simulated pins)")
+        self.storage = storage
+        self.out = out
+        self.display = None
+        self.steps = 0
+        self.late = []
+        self.started = None
+        self.levels = {}
+        self.pwms = {}
+        self.released = False
+        self.gpio.setmode(self.gpio.BCM)
+        # Claim every pin up front, so no step pays for a setup
+        for ins in self.program:
+            if ins[0] in ("set", "toggle") and ins[1] not in self.levels:
+                self.gpio.setup(ins[1], self.gpio.OUT)
+                self.levels[ins[1]] = 0
+            elif ins[0] == "duty" and ins[1] not in self.pwms:
+                self.gpio.setup(ins[1], self.gpio.OUT)
+                pwm = self.gpio.PWM(ins[1], ins[3])
+                pwm.start(0)
+                self.pwms[ins[1]] = [pwm, ins[3]]
+
+    def run(self, start=None):
+        """Runs the program; start = time.monotonic() to begin at (None: now)."""
+        if start is not None:
+            clock_sync.wait_until(start)
+        program, consts, gpio, levels, late = self.program, self.consts, self.gpio, self.levels, self.late
+        output, monotonic = gpio.output, time.monotonic
+        self.started = deadline = monotonic()
+        remaining = {}
+        pc = 0
+        while True:
+            ins = program[pc]
+            op = ins[0]
+            self.steps += 1
+            pc += 1
+            if op == "set":
+                output(ins[1], ins[2])
+                levels[ins[1]] = ins[2]
+            elif op == "wait":
+                deadline += ins[1] / 1e6
+                if monotonic() < deadline:
+                    clock_sync.wait_until(deadline)
+                if len(late) < LATE_SAMPLES:
+                    late.append(monotonic() - deadline)
+            elif op == "toggle":
+                levels[ins[1]] ^= 1
+                output(ins[1], levels[ins[1]])
+            elif op == "end":
+                start_pc = ins[1]
+                count = program[start_pc][1]
+                if count == 0:
+                    pc = start_pc + 1
+                else:
+                    remaining[start_pc] -= 1
+                    if remaining[start_pc] > 0:
+                        pc = start_pc + 1
+            elif op == "loop":
+                remaining[pc - 1] = ins[1]
+            elif op == "duty":
+                pwm = self.pwms[ins[1]]
+                if ins[3] != pwm[1]:
+                    pwm[0].ChangeFrequency(ins[3])
+                    pwm[1] = ins[3]
+                pwm[0].ChangeDutyCycle(ins[2] / 100)
+            elif op == "event":
+                self.out(f"SEQ_EVENT:{consts[ins[1]]}:{self.steps}:{self.elapsed_ms():.1f}")
+            elif op == "show":
+                self.show(consts[ins[1]])
+            elif op == "write":
+                os.makedirs(self.storage, exist_ok=True)
+                with open(os.path.join(self.storage, consts[ins[1]]), "a") as f:
+                    f.write(consts[ins[2]] + "\n")
+            elif op == "halt":
+                return
+
+    def show(self, text):
+        if self.display is None:
+            try:
+                import tm1637
+                self.display = tm1637.TM1637(clk=DISPLAY_PINS[0], dio=DISPLAY_PINS[1])
+            except ImportError:
+                self.display = False
+        if self.display:
+            self.display.show(text)
+        else:
+            self.out(f"DISPLAY:{text}")
+
+    def elapsed_ms(self):
+        return 0.0 if self.started is None else 1000 * (time.monotonic() - self.started)
+
+    def late_stats(self):
+        """(p99, max) wait lateness in microseconds."""
+        if not self.late:
+            return 0, 0
+        ranked = sorted(self.late)
+        return 1e6 * ranked[int(0.99 * (len(ranked) - 1))], 1e6 * ranked[-1]
+
+    def summary(self):
+        p99, worst = self.late_stats()
+        return f"SEQ_DONE:{self.steps}:{self.elapsed_ms():.1f}:{p99:.0f}:{worst:.0f}"
+
+    def release(self):
+        """Drives the pins low and frees them; safe to call more than once."""
+        if self.released:
+            return
+        self.released = True
+        for pin in self.levels:
+            self.gpio.output(pin, 0)
+        for pwm, _ in self.pwms.values():
+            pwm.stop()
+        self.gpio.cleanup()
+
+
+# --- BENCH ---
+def run_bench():
+    def timed(source, label):
+        runner = Runner(seqc.compile_source(source), gpio=SimGPIO(), out=lambda line: None)
+        t = time.perf_counter()
+        runner.run()
+        took = time.perf_counter() - t
+        p99, worst = runner.late_stats()
+        print(f"  {label:34} {runner.steps:7} steps  {took * 1000:8.1f} ms  "
+              f"{runner.steps / took / 1000:6.0f} k steps/s  late p99 {p99:5.0f} us  max {worst:5.0f} us")
+        return runner
+
+    print(f"Sequence runner ({'RPi.GPIO' if GPIO else 'simulated GPIO'})")
+    timed("loop 10000\n  toggle 17\nend", "10k toggles, no waits")
+    timed("loop 1000\n  set 17 1\n  wait 500us\n  set 17 0\n  wait 500us\nend", "1 kHz square wave, 1 s")
+    timed("loop 200\n  loop 5\n    toggle 17\n    wait 1ms\n  end\n  duty 12 50\n  wait 2ms\nend",
+          "nested loops + PWM, 1.4 s")
+
+    # The same 1 kHz wave as one CMD per step: each pays its line on the wire and a worker spawn
+    t = time.perf_counter()
+    for _ in range(5):
+        subprocess.run([sys.executable, "-c", "pass"])
+    spawn = (time.perf_counter() - t) / 5
+    wire = len("CMD:GPIO:ON\n") * 10 / 115200
+    print(f"  one CMD per step: >= {1000 * (spawn + wire):.1f} ms per step ({1000 * spawn:.1f} ms spawn + "
+          f"{1000 * wire:.2f} ms on the wire) -> the 1 kHz wave would take "
+          f">= {2000 * (spawn + wire):.0f} s instead of 1 s")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+        sys.exit(0)
+    args = [a for a in sys.argv[1:] if a != '--sim']
+    if not args:
+        print("Usage: python3 seq_runner.py <program.seqb> [start time] [--sim] | --bench")
+        sys.exit(1)
+    try:
+        with open(args[0], "rb") as f:
+            runner = Runner(f.read(), gpio=SimGPIO() if '--sim' in sys.argv else None)
+    except (OSError, seqc.SeqError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    def stop(signum, frame):
+        sys.exit(0)   # Unwinds into the finally below, which releases the pins once
+    signal.signal(signal.SIGTERM, stop)
+
+    # Lines go to the listener through a pipe: flush each one so events arrive as they happen
+    runner.out = lambda line: print(line, flush=True)
+    name = os.path.basename(args[0]).rsplit(".", 1)[0]
+    print(f"Running {name}: {len(runner.program)} instructions", flush=True)
+    try:
+        runner.run(float(args[1]) if len(args) > 1 else None)
+    finally:
+        runner.release()
+        print(runner.summary(), flush=True)
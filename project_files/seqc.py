@@ -0,0 +1,245 @@
+"""
+seqc.py - Sequence program compiler and bytecode format (shared by both sides)
+
+A pattern more complex than blink / breathe / clock / timer used to be one
+CMD: per step from the PC: a UART round trip plus a process spawn per step.
+A sequence program is written once, compiled here to compact bytecode,
+uploaded with a few CMD:SEQ:PUT lines and run by seq_runner.py on the Pi in
+one process, with each wait measured against an absolute deadline.
+
+Source, one instruction per line ('#' starts a comment, indentation is free):
+
+    set 17 1            # pin 17 high (1/0, high/low, on/off)
+    toggle 17
+    duty 12 37.5 [1000] # PWM duty % on pin 12 [frequency in Hz, default 1000]
+    wait 250us          # us, ms or s; plain number = ms
+    loop 1000           # repeat the block up to the matching 'end' (loop 0 = forever)
+    end
+    show "12:34"        # TM1637 display (4 characters)
+    write log.txt "done"  # append a line to a file on the SD storage
+    event "half way"    # progress event, sent to the PC as a log line
+
+Bytecode: b"SEQ1", u32 body length, u32 CRC32 of the body, then the body:
+u16 constant count, the constants (u8 length + UTF-8) and the code. Each
+instruction is one opcode byte plus fixed-size arguments (see OPS).
+
+    code = compile_source(open("sos.seq").read())
+    for line in upload_lines("sos", code):
+        link.send(line)
+    link.send("CMD:SEQ:RUN:sos")
+
+  python3 seqc.py prog.seq          # compile, print size, listing and upload lines
+"""
+import base64
+import re
+import shlex
+import struct
+import sys
+import zlib
+
+# --- CONFIGURATION ---
+MAGIC = b"SEQ1"
+CHUNK = 180             # Program bytes per CMD:SEQ:PUT line (240 characters of base64)
+MAX_WAIT_US = 0xFFFFFFFF
+DEFAULT_PWM_HZ = 1000
+MAX_DEPTH = 16          # Nested loops
+
+# opcode: (name, argument struct)
+OPS = {
+    0x00: ("halt", struct.Struct("")),
+    0x01: ("set", struct.Struct(">BB")),       # pin, level
+    0x02: ("toggle", struct.Struct(">B")),     # pin
+    0x03: ("duty", struct.Struct(">BHI")),     # pin, duty in 1/100 %, Hz
+    0x04: ("wait", struct.Struct(">I")),       # microseconds
+    0x05: ("loop", struct.Struct(">I")),       # count, 0 = forever
+    0x06: ("end", struct.Struct("")),
+    0x07: ("show", struct.Struct(">H")),       # constant
+    0x08: ("write", struct.Struct(">HH")),     # file constant, text constant
+    0x09: ("event", struct.Struct(">H")),      # constant
+}
+OPCODES = {name: op for op, (name, _) in OPS.items()}
+HEADER = struct.Struct(">4sII")
+LEVELS = {"1": 1, "0": 0, "high": 1, "low": 0, "on": 1, "off": 0}
+UNITS = {"us": 1, "ms": 1000, "s": 1000000, "": 1000}
+
+
+class SeqError(ValueError):
+    """Bad source or bytecode; the message names the line or offset."""
+
+
+def parse_pin(text):
+    pin = int(text)
+    if not 0 <= pin <= 27:
+        raise ValueError(f"pin {pin} is not a BCM GPIO (0-27)")
+    return pin
+
+
+def parse_time(text):
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)(us|ms|s)?", text)
+    if not m:
+        raise ValueError(f"bad time '{text}'")
+    us = round(float(m.group(1)) * UNITS[m.group(2) or ""])
+    if us > MAX_WAIT_US:
+        raise ValueError(f"wait {text} is longer than {MAX_WAIT_US // 1000000} s")
+    return us
+
+
+def compile_source(source):
+    """Source text -> bytecode. Raises SeqError('line N: ...')."""
+    consts, index = [], {}
+    code = bytearray()
+    depth = 0
+
+    def const(text):
+        if text not in index:
+            if len(text.encode()) > 255:
+                raise ValueError("string longer than 255 bytes")
+            index[text] = len(consts)
+            consts.append(text)
+        return index[text]
+
+    def emit(name, *args):
+        op = OPCODES[name]
+        code.append(op)
+        code.extend(OPS[op][1].pack(*args))
+
+    for n, raw in enumerate(source.splitlines(), 1):
+        try:
+            words = shlex.split(raw, comments=True)
+        except ValueError as e:
+            raise SeqError(f"line {n}: {e}")
+        if not words:
+            continue
+        name, args = words[0].lower(), words[1:]
+        try:
+            if name == "set" and len(args) == 2:
+                if args[1].lower() not in LEVELS:
+                    raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+                emit("set", parse_pin(args[0]), LEVELS[args[1].lower()])
+            elif name == "toggle" and len(args) == 1:
+                emit("toggle", parse_pin(args[0]))
+            elif name == "duty" and len(args) in (2, 3):
+                duty = float(args[1])
+                if not 0 <= duty <= 100:
+                    raise ValueError("duty must be 0-100 %")
+                hz = int(args[2]) if len(args) == 3 else DEFAULT_PWM_HZ
+                emit("duty", parse_pin(args[0]), round(duty * 100), hz)
+            elif name == "wait" and len(args) == 1:
+                emit("wait", parse_time(args[0].lower()))
+            elif name == "loop" and len(args) == 1:
+                depth += 1
+                if depth > MAX_DEPTH:
+                    raise ValueError(f"loops nested deeper than {MAX_DEPTH}")
+                emit("loop", int(args[0]))
+            elif name == "end" and not args:
+                if not depth:
+                    raise ValueError("'end' without 'loop'")
+                depth -= 1
+                emit("end")
+            elif name == "show" and len(args) == 1:
+                emit("show", const(args[0]))
+            elif name == "write" and len(args) == 2:
+                if not re.fullmatch(r"[\w.-]+", args[0]):
+                    raise ValueError(f"bad file name '{args[0]}'")
+                emit("write", const(args[0]), const(args[1]))
+            elif name == "event" and len(args) == 1:
+                emit("event", const(args[0]))
+            elif name in OPCODES:
+                raise ValueError(f"wrong arguments for '{name}'")
+            else:
+                raise ValueError(f"unknown instruction '{name}'")
+        except (ValueError, struct.error) as e:
+            raise SeqError(f"line {n}: {e}")
+    if depth:
+        raise SeqError(f"{depth} 'loop' without 'end'")
+    emit("halt")
+
+    body = bytearray(struct.pack(">H", len(consts)))
+    for text in consts:
+        data = text.encode()
+        body += bytes([len(data)]) + data
+    body += code
+    return HEADER.pack(MAGIC, len(body), zlib.crc32(body)) + bytes(body)
+
+
+def decode(blob):
+    """Bytecode -> (constants, [(name, *args)]), checked. Loops come out as
+    ('loop', count, index of its end) and ('end', index of its loop)."""
+    if len(blob) < HEADER.size:
+        raise SeqError("program too short")
+    magic, length, crc = HEADER.unpack_from(blob)
+    body = blob[HEADER.size:]
+    if magic != MAGIC:
+        raise SeqError("not a sequence program")
+    if len(body) != length or zlib.crc32(body) != crc:
+        raise SeqError(f"program damaged ({len(body)}/{length} bytes, CRC mismatch)")
+    try:
+        (count,), pos = struct.unpack_from(">H", body), 2
+        consts = []
+        for _ in range(count):
+            n = body[pos]
+            consts.append(body[pos + 1:pos + 1 + n].decode())
+            pos += 1 + n
+        program, loops = [], []
+        while pos < len(body):
+            op = body[pos]
+            if op not in OPS:
+                raise SeqError(f"bad opcode 0x{op:02x} at byte {pos}")
+            name, fmt = OPS[op]
+            args = fmt.unpack_from(body, pos + 1)
+            if name in ("show", "event", "write") and max(args) >= len(consts):
+                raise SeqError(f"bad constant at byte {pos}")
+            pos += 1 + fmt.size
+            if name == "loop":
+                loops.append(len(program))
+            elif name == "end":
+                if not loops:
+                    raise SeqError("'end' without 'loop'")
+                start = loops.pop()
+                program[start] += (len(program),)
+                args = (start,)
+            program.append((name,) + args)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise SeqError("program truncated")
+    if loops:
+        raise SeqError("'loop' without 'end'")
+    return consts, program
+
+
+def upload_lines(name, code, chunk=CHUNK):
+    """CMD:SEQ:PUT lines that store code as <name> on the Pi."""
+    return [f"CMD:SEQ:PUT:{name}:{off}:{base64.b64encode(code[off:off + chunk]).decode()}"
+            for off in range(0, len(code), chunk)]
+
+
+def listing(code):
+    consts, program = decode(code)
+    out = []
+    for i, (name, *args) in enumerate(program):
+        if name in ("show", "event"):
+            args = [repr(consts[args[0]])]
+        elif name == "write":
+            args = [consts[args[0]], repr(consts[args[1]])]
+        elif name == "loop":
+            args = [args[0] or "forever", f"-> end @{args[1]}"]
+        elif name == "end":
+            args = [f"-> loop @{args[0]}"]
+        out.append(f"{i:4}  {name:6} {' '.join(map(str, args))}")
+    return out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 seqc.py <program.seq> [name]")
+        sys.exit(1)
+    path = sys.argv[1]
+    name = sys.argv[2] if len(sys.argv) > 2 else re.sub(r"\W", "_", path.rsplit("/", 1)[-1].rsplit(".", 1)[0])
+    try:
+        code = compile_source(open(path).read())
+    except SeqError as e:
+        print(f"{path}: {e}")
+        sys.exit(1)
+    print(f"{path}: {len(code)} bytes")
+    print("\n".join(listing(code)))
+    print("\n".join(upload_lines(name, code)))
+    print(f"CMD:SEQ:RUN:{name}")
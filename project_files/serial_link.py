@@ -0,0 +1,291 @@
+"""
+serial_link.py - Hotplug-aware serial connection for the master (LIBRARY)
+
+Keeps one UART link to the Pi alive across unplugs and re-enumeration:
+  * finds the adapter by USB VID:PID and/or serial number through
+    serial.tools.list_ports (so /dev/ttyUSB0 -> /dev/ttyUSB1 is followed),
+    or just uses the configured port name
+  * on Linux watches /dev with inotify, so a re-plugged adapter is opened
+    as soon as its node appears (other systems poll every RETRY_INTERVAL)
+  * while offline, send() parks commands in a bounded outbox that is
+    flushed in order on reconnect (oldest dropped when full, stale ones
+    expire after OUTBOX_MAX_AGE)
+  * every disconnect is recorded with its duration in link.history
+  * with mux=uart_mux.Mux(...), raw bytes go to the mux and send() uses
+    its control channel; on_line is then wired to the mux channels
+
+Used by flask_app.py:
+    link = SerialLink(port='/dev/ttyUSB0', vid_pid='0403:6001', on_line=handle)
+    link.start()
+    link.send('CMD:GPIO:ON')   # -> 'sent' or 'queued'
+"""
+import ctypes
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+import serial
+from serial.tools import list_ports
+
+# --- CONFIGURATION ---
+READ_TIMEOUT = 0.1      # readline() timeout; partial lines are carried over
+RETRY_INTERVAL = 2.0    # Rescan anyway this often while offline (missed events, non-Linux)
+OUTBOX_SIZE = 256       # Commands kept while offline
+OUTBOX_MAX_AGE = 30.0   # Seconds; older queued commands are dropped, not replayed
+MUX_SEND_WAIT = 1.0     # Seconds to wait for room in the mux control channel before queueing
+HISTORY_SIZE = 100      # Disconnect records kept
+
+# inotify(7)
+IN_ATTRIB = 0x00000004  # udev fixing permissions after the node appears
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+EVENT = struct.Struct("iIII")   # wd, mask, cookie, len (name follows)
+
+
+def open_dev_watch():
+    """inotify fd that becomes readable on /dev changes; None if unavailable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, b"/dev", IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def read_dev_events(fd):
+    """Returns [(mask, name)] for the pending inotify events."""
+    events = []
+    try:
+        buf = os.read(fd, 4096)
+    except BlockingIOError:
+        return events
+    pos = 0
+    while pos + EVENT.size <= len(buf):
+        _, mask, _, length = EVENT.unpack_from(buf, pos)
+        pos += EVENT.size
+        name = buf[pos:pos + length].rstrip(b"\0").decode(errors='replace')
+        pos += length
+        events.append((mask, name))
+    return events
+
+
+class SerialLink:
+    def __init__(self, port=None, baud=115200, vid_pid=None, serial_number=None,
+                 on_line=None, on_state=None, outbox_size=OUTBOX_SIZE, mux=None):
+        self.port = port                  # Fallback / non-USB port name
+        self.baud = baud
+        self.vid_pid = vid_pid.upper() if vid_pid else None
+        self.serial_number = serial_number
+        self.on_line = on_line or (lambda line: None)
+        self.on_state = on_state or (lambda connected, msg: None)
+        self.mux = mux
+
+        self.ser = None
+        self.device = None                # Port actually in use
+        self.lock = threading.RLock()     # Guards self.ser and writes
+        self.online = threading.Event()
+        self.running = False
+        self.partial = b""
+        self.watch_fd = None
+
+        self.outbox = deque(maxlen=outbox_size)   # (queued_at, line)
+        self.dropped = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.down_since = time.monotonic()
+        self.down_reason = None
+        self.lost_at = None               # Wall time of the last disconnect
+
+    # --- PUBLIC ---
+    @property
+    def connected(self):
+        return self.ser is not None
+
+    def start(self):
+        self.running = True
+        self.watch_fd = open_dev_watch()
+        if not self._try_connect():
+            where = self.vid_pid or self.serial_number or self.port
+            print(f"❌ Could not connect to {where}. Running offline, commands are queued until it appears.")
+        threading.Thread(target=self._reader, daemon=True).start()
+        threading.Thread(target=self._watcher, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            if self.ser:
+                self.ser.close()
+                self.ser = None
+
+    def send(self, line):
+        """Writes a line, or queues it while offline (or while the mux control
+        channel is full). Returns 'sent' or 'queued'."""
+        with self.lock:
+            if self.ser is not None:
+                if self.outbox:
+                    self._flush_outbox()   # Keep the order: older queued lines first
+                try:
+                    if not self.outbox and self._write_line(line):
+                        return 'sent'
+                except (serial.SerialException, OSError) as e:
+                    self._lost(self.ser, f"write failed: {e}")
+            if len(self.outbox) == self.outbox.maxlen:
+                self.dropped += 1
+            self.outbox.append((time.monotonic(), line))
+            return 'queued'
+
+    def _write_line(self, line):
+        """True if the line went out (False: the mux control channel stayed full)."""
+        if self.mux:
+            return self.mux.open(0).send_line(line, timeout=MUX_SEND_WAIT)  # Channel 0 = control
+        self.ser.write((line + '\n').encode('utf-8'))
+        return True
+
+    def status(self):
+        return {
+            "connected": self.connected,
+            "device": self.device,
+            "queued": len(self.outbox),
+            "dropped": self.dropped,
+            "offline_s": None if self.connected else round(time.monotonic() - self.down_since, 3),
+            "disconnects": list(self.history),
+        }
+
+    # --- CONNECTION ---
+    def find_port(self):
+        if not (self.vid_pid or self.serial_number):
+            return self.port
+        for p in list_ports.comports():
+            if self.vid_pid and (p.vid is None or f"{p.vid:04X}:{p.pid:04X}" != self.vid_pid):
+                continue
+            if self.serial_number and p.serial_number != self.serial_number:
+                continue
+            return p.device
+        return None
+
+    def _try_connect(self):
+        dev = self.find_port()
+        if dev is None:
+            return False
+        try:
+            ser = serial.Serial(dev, self.baud, timeout=READ_TIMEOUT)
+        except (serial.SerialException, OSError):
+            return False  # Node exists but udev hasn't granted access yet: IN_ATTRIB retries
+        with self.lock:
+            self.ser, self.device, self.partial = ser, dev, b""
+            if self.mux:
+                self.mux.attach(ser)
+            self.online.set()
+            downtime = time.monotonic() - self.down_since
+            if self.lost_at is not None:
+                self.history.append({
+                    "device": dev,
+                    "lost_at": self.lost_at,
+                    "restored_at": time.time(),
+                    "duration_s": round(downtime, 3),
+                    "reason": self.down_reason,
+                })
+                msg = f"Serial link restored on {dev} after {downtime * 1000:.0f} ms offline"
+            else:
+                msg = f"✅ Connected to {dev}"
+            self._flush_outbox()
+        print(msg)
+        self.on_state(True, msg)
+        return True
+
+    def _flush_outbox(self):
+        now = time.monotonic()
+        while self.outbox and self.ser is not None:
+            queued_at, line = self.outbox.popleft()
+            if now - queued_at > OUTBOX_MAX_AGE:
+                self.dropped += 1
+                continue
+            try:
+                if not self._write_line(line):
+                    self.outbox.appendleft((queued_at, line))
+                    break   # Still full: the watcher tries again
+            except (serial.SerialException, OSError) as e:
+                self.outbox.appendleft((queued_at, line))
+                self._lost(self.ser, f"write failed: {e}")
+
+    def _lost(self, ser, reason):
+        with self.lock:
+            if self.ser is not ser or ser is None:
+                return  # Already handled by the other thread
+            try:
+                ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+            if self.mux:
+                self.mux.detach()
+            self.online.clear()
+            self.down_since = time.monotonic()
+            self.lost_at = time.time()
+            self.down_reason = reason
+        msg = f"Serial link lost ({self.device}: {reason}), queueing commands"
+        print(msg)
+        self.on_state(False, msg)
+
+    # --- THREADS ---
+    def _reader(self):
+        while self.running:
+            ser = self.ser
+            if ser is None:
+                self.online.wait(0.5)
+                continue
+            try:
+                raw = ser.read(max(1, ser.in_waiting)) if self.mux else ser.readline()
+            except (serial.SerialException, OSError, TypeError) as e:
+                # TypeError: pyserial reading a port closed under it
+                self._lost(ser, str(e) or "read failed")
+                continue
+            if self.mux:
+                if raw:
+                    self.mux.feed(raw)
+                continue
+            if not raw.endswith(b'\n'):
+                self.partial += raw   # Timed out mid-line: keep it for the next read
+                continue
+            raw, self.partial = self.partial + raw, b""
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line:
+                try:
+                    self.on_line(line)
+                except Exception as e:
+                    print(f"Serial Error: {e}")
+
+    def _watcher(self):
+        last_try = time.monotonic()
+        while self.running:
+            events = []
+            if self.watch_fd is not None:
+                ready, _, _ = select.select([self.watch_fd], [], [], RETRY_INTERVAL)
+                if ready:
+                    events = read_dev_events(self.watch_fd)
+            else:
+                time.sleep(RETRY_INTERVAL if self.connected else 0.25)
+
+            if self.connected:
+                gone = [n for m, n in events if m & IN_DELETE]
+                if self.device and os.path.basename(self.device) in gone:
+                    self._lost(self.ser, "device removed")
+                elif self.outbox:
+                    with self.lock:
+                        self._flush_outbox()   # Lines a full mux channel made us queue
+                continue
+            # Offline: any /dev change (or the periodic retry) triggers a rescan
+            now = time.monotonic()
+            if events or now - last_try >= RETRY_INTERVAL or self.watch_fd is None:
+                last_try = now
+                self._try_connect()
@@ -0,0 +1,306 @@
+"""
+soft_pwm.py - Software PWM on many pins from one scheduler thread (WORKER + library)
+
+Every RPi.GPIO.PWM instance runs its own thread. Ten of them for an LED bar
+or a row of servos compete for the CPU, and each one's edges land wherever
+its thread happens to get scheduled. SoftPWM drives all its pins from one
+thread and one timeline:
+
+  * at the start of each period every pin with a duty above 0 goes high,
+    in one GPIO.output(list of pins, HIGH) call;
+  * the falling edges of all channels are kept sorted by time. Edges less
+    than GROUP_S apart share one output call, so 32 channels don't mean 32
+    wake-ups a period;
+  * the thread sleeps until SPIN_S before each edge and spins only that
+    small margin (like clock_sync.wait_until), so it costs no more CPU
+    than the sleeping threads it replaces. Every time is an absolute
+    deadline from the start, so the periods never drift, and edges that
+    are already due when it wakes go out in the same write;
+  * set_duties() only stores the new duties. They are swapped in at the next
+    period boundary and the edge list is re-sorted there, so a batch of
+    changes (a whole LED bar) never shows half-applied in a period.
+
+If the thread falls more than a period behind, it skips to the next period
+boundary instead of bunching periods up, and counts an overrun.
+
+    pwm = SoftPWM([5, 6, 13, 19], hz=200)
+    pwm.start()
+    pwm.set_duties({5: 10, 6: 40, 13: 70, 19: 100})
+
+As a worker (CMD:PWM:MULTI; --sim for simulated pins off the Pi, without
+RPi.GPIO it stops with an error otherwise):
+  python3 soft_pwm.py <pins> <duties %> [Hz] [--sim]   # e.g. 5,6,13,19 10,40,70,100 200
+  python3 soft_pwm.py --bench                      # CPU and edge timing, 1 / 8 / 32 channels
+"""
+import signal
+import sys
+import threading
+import time
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+# --- CONFIGURATION ---
+DEFAULT_HZ = 100           # As pwm_monitor.py's GPIO.PWM
+SPIN_S = 0.00005           # Wake this long before an edge and spin the rest: steadier edges, more CPU if raised
+GROUP_S = 0.00002          # Falling edges closer than this go out in one write
+LATE_SAMPLES = 100000      # Edge lateness values kept for the statistics
+
+
+class SimGPIO:
+    """Just enough of RPi.GPIO (including list writes) to run off the Pi."""
+    BCM, OUT, LOW, HIGH = "BCM", "OUT", 0, 1
+
+    def __init__(self):
+        self.levels = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        self.levels[pin] = 0
+
+    def output(self, pins, level):
+        for pin in pins if isinstance(pins, (list, tuple)) else (pins,):
+            self.levels[pin] = level
+        self.writes += 1
+
+    def cleanup(self):
+        pass
+
+
+class SoftPWM:
+    def __init__(self, pins, hz=DEFAULT_HZ, gpio=None, spin_s=SPIN_S):
+        self.spin_s = spin_s
+        self.pins = list(pins)
+        self.period = 1.0 / hz
+        self.gpio = gpio or GPIO
+        if self.gpio is None:
+            raise RuntimeError("RPi.GPIO not installed (run on the Pi, or pass gpio=SimGPIO())")
+        self.duties = {pin: 0.0 for pin in self.pins}
+        self.pending = None        # Duties waiting for the next period boundary
+        self.lock = threading.Lock()
+        self.schedule = []         # [(offset s, [pins])], sorted: the falling edges
+        self.high = []             # Pins that go high at the start of a period
+        self.stopped = threading.Event()
+        self.thread = None
+        self.periods = 0
+        self.overruns = 0
+        self.late = []
+        self.gpio.setmode(self.gpio.BCM)
+        for pin in self.pins:
+            self.gpio.setup(pin, self.gpio.OUT)
+
+    def set_duties(self, duties):
+        """{pin: percent} (or a list in pin order), applied together at the next period."""
+        if not isinstance(duties, dict):
+            duties = dict(zip(self.pins, duties))
+        unknown = set(duties) - set(self.pins)
+        if unknown:
+            raise ValueError(f"not a channel of this SoftPWM: {sorted(unknown)}")
+        with self.lock:
+            merged = dict(self.pending or self.duties)
+            merged.update({pin: min(max(float(d), 0.0), 100.0) for pin, d in duties.items()})
+            self.pending = merged
+
+    def set_duty(self, pin, duty):
+        self.set_duties({pin: duty})
+
+    def _apply(self):
+        with self.lock:
+            self.duties, self.pending = self.pending, None
+        edges = sorted((d / 100 * self.period, pin) for pin, d in self.duties.items() if 0 < d < 100)
+        schedule = []
+        for offset, pin in edges:
+            if schedule and offset - schedule[-1][0] < GROUP_S:
+                schedule[-1][1].append(pin)
+            else:
+                schedule.append((offset, [pin]))
+        self.schedule = schedule
+        self.high = [pin for pin, d in self.duties.items() if d > 0]
+        low = [pin for pin, d in self.duties.items() if d == 0]
+        if low:
+            self.gpio.output(low, self.gpio.LOW)   # Channels set to 0 mid-period stop now
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _wait(self, t):
+        """Sleeps until t; with spin_s, sleeps until spin_s before it and spins the rest."""
+        left = t - time.monotonic()
+        if left > self.spin_s:
+            time.sleep(left - self.spin_s)
+        while self.spin_s and time.monotonic() < t:
+            pass
+
+    def _run(self):
+        output, monotonic, late = self.gpio.output, time.monotonic, self.late
+        HIGH, LOW = self.gpio.HIGH, self.gpio.LOW
+        period = self.period
+        t0 = monotonic()
+        k = 0
+        while not self.stopped.is_set():
+            start = t0 + k * period
+            if self.pending is not None:
+                self._apply()
+            self._wait(start)
+            if self.high:
+                output(self.high, HIGH)
+                if len(late) < LATE_SAMPLES:
+                    late.append(monotonic() - start)
+            schedule = self.schedule
+            i = 0
+            while i < len(schedule):
+                due = start + schedule[i][0]
+                self._wait(due)
+                pins = schedule[i][1]
+                i += 1
+                # Woken late: edges due by now go out in the same write
+                now = monotonic() + GROUP_S
+                if i < len(schedule) and start + schedule[i][0] <= now:
+                    pins = list(pins)
+                    while i < len(schedule) and start + schedule[i][0] <= now:
+                        pins += schedule[i][1]
+                        i += 1
+                output(pins, LOW)
+                if len(late) < LATE_SAMPLES:
+                    late.append(monotonic() - due)
+            self.periods += 1
+            k += 1
+            behind = monotonic() - (t0 + k * period)
+            if behind > period:
+                k += int(behind / period)   # Skip, rather than squeeze in, the periods we missed
+                self.overruns += 1
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(1.0)
+        self.gpio.output(self.pins, self.gpio.LOW)
+
+    def late_stats(self):
+        """(p50, p99, max) edge lateness in microseconds."""
+        if not self.late:
+            return 0, 0, 0
+        ranked = sorted(self.late)
+        return tuple(1e6 * ranked[int(q * (len(ranked) - 1))] for q in (0.5, 0.99, 1.0))
+
+    def summary(self):
+        p50, p99, worst = self.late_stats()
+        return f"SOFT_PWM_DONE:{self.periods}:{p50:.0f}:{p99:.0f}:{worst:.0f}:{self.overruns}"
+
+
+# --- BENCH ---
+class ThreadPerChannel:
+    """The RPi.GPIO.PWM model: each channel its own thread and its own sleeps."""
+
+    def __init__(self, pins, hz, gpio, duties):
+        self.period = 1.0 / hz
+        self.gpio = gpio
+        self.stopped = threading.Event()
+        self.late = []
+        self.threads = [threading.Thread(target=self._run, args=(pin, duties[pin]), daemon=True)
+                        for pin in pins]
+
+    def _run(self, pin, duty):
+        period, late = self.period, self.late
+        t = time.monotonic()
+        while not self.stopped.is_set():
+            for level, length in ((1, duty / 100 * period), (0, (1 - duty / 100) * period)):
+                self.gpio.output(pin, level)
+                late.append(time.monotonic() - t)
+                t += length
+                time.sleep(max(0.0, t - time.monotonic()))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(1.0)
+
+
+def run_bench(seconds=2.0, hz=DEFAULT_HZ):
+    def timed(engine):
+        cpu, wall = time.process_time(), time.monotonic()
+        engine.start()
+        time.sleep(seconds)
+        engine.stop()
+        return 100 * (time.process_time() - cpu) / (time.monotonic() - wall)
+
+    def pct(values, q):
+        ranked = sorted(values)
+        return 1e6 * ranked[int(q * (len(ranked) - 1))] if ranked else 0.0
+
+    print(f"Software PWM at {hz} Hz for {seconds:g} s per run "
+          f"({'RPi.GPIO' if GPIO else 'simulated GPIO'}); edge lateness = write time - scheduled time")
+    print("  (the per-channel threads are Python threads standing in for RPi.GPIO's: same sleeps, plus the GIL)")
+    for n in (1, 8, 32):
+        pins = list(range(n))
+        duties = {pin: 100 * (pin + 1) / (n + 1) for pin in pins}   # Spread: all different
+        for label, spin in (("one scheduler     ", SPIN_S), ("  sleep only      ", 0.0)):
+            gpio = SimGPIO() if GPIO is None else GPIO
+            engine = SoftPWM(pins, hz, gpio, spin_s=spin)
+            engine.set_duties(duties)
+            cpu = timed(engine)
+            p50, p99, worst = engine.late_stats()
+            writes = f"{gpio.writes / max(1, engine.periods):5.1f}" if GPIO is None else "    -"
+            print(f"  {n:2} ch, {label}: CPU {cpu:5.1f}%  late p50 {p50:6.1f} us  p99 {p99:7.1f} us  "
+                  f"max {worst:8.1f} us  writes/period {writes}  overruns {engine.overruns}")
+        gpio = SimGPIO() if GPIO is None else GPIO
+        threads = ThreadPerChannel(pins, hz, gpio, duties)
+        cpu = timed(threads)
+        print(f"  {n:2} ch, thread per channel: CPU {cpu:5.1f}%  late p50 {pct(threads.late, 0.5):6.1f} us  "
+              f"p99 {pct(threads.late, 0.99):7.1f} us  max {pct(threads.late, 1.0):8.1f} us")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+        sys.exit(0)
+    args = [a for a in sys.argv[1:] if a != '--sim']
+    simulate = '--sim' in sys.argv
+    if len(args) < 2:
+        print("Usage: python3 soft_pwm.py <pins> <duties %> [Hz] [--sim] | --bench")
+        sys.exit(1)
+    if GPIO is None and not simulate:
+        print("Error: RPi.GPIO not installed (run on the Pi, or --sim for simulated pins)")
+        sys.exit(1)
+    try:
+        pins = [int(p) for p in args[0].split(",")]
+        duties = [float(d) for d in args[1].split(",")]
+        hz = float(args[2]) if len(args) > 2 else DEFAULT_HZ
+        if not all(0 <= p <= 27 for p in pins) or len(duties) not in (1, len(pins)) or not 0 < hz <= 10000:
+            raise ValueError("pins are BCM 0-27, one duty per pin (or one for all), 0-10000 Hz")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    pwm = SoftPWM(pins, hz, SimGPIO() if simulate else None)
+    duties = duties * len(pins) if len(duties) == 1 else duties
+    pwm.set_duties(duties)
+
+    def cleanup(signum, frame):
+        pwm.stop()
+        pwm.gpio.cleanup()
+        print(pwm.summary(), flush=True)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, cleanup)
+
+    print(f"Soft PWM on {pins} at {hz:g} Hz ({'simulated' if simulate else 'RPi.GPIO'}): "
+          f"{', '.join(f'{p}={d:g}%' for p, d in zip(pins, duties))}", flush=True)
+    pwm.start()
+    while True:
+        time.sleep(10)
+        p50, p99, worst = pwm.late_stats()
+        print(f"SAMPLE:soft_pwm_late_p99_us:{p99:.0f}", flush=True)
+        pwm.late.clear()
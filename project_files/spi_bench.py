@@ -0,0 +1,182 @@
+"""
+spi_bench.py - SPI bus throughput + jitter benchmark
+
+Sweeps transfer sizes, clock rates and spidev calls (xfer2 / xfer3 /
+writebytes2) and reports bytes/s, per-transfer latency percentiles with a
+log2 histogram, and loopback verification errors.
+
+TX buffers are pre-allocated bytes objects and latencies go into a
+pre-allocated array, so the loop measures spidev, not Python lists.
+
+Wire MOSI (GPIO10, pin 19) -> MISO (GPIO9, pin 21) for loopback checks.
+
+With --sim the loopback doesn't wait out the bus: each transfer's latency is
+the measured Python/call cost plus the modelled bus time (spi_sim's
+modelled_seconds), so the full default sweep takes seconds, not minutes.
+
+Usage:
+  python3 spi_bench.py                   # on the Pi (needs spidev)
+  python3 spi_bench.py --sim             # simulated loopback, off-device
+  python3 spi_bench.py --sizes 4096 --speeds 1000000 -n 1000      # "4KB x 1000"
+  python3 spi_bench.py --methods xfer3,writebytes2 --json results.json   ('-' = stdout)
+  python3 spi_bench.py --hist            # latency histogram of every case
+"""
+import json
+import statistics
+import sys
+import time
+from array import array
+
+import spi_sim
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+# --- CONFIGURATION ---
+SPI_BUS = 0
+SPI_DEV = 0   # /dev/spidev0.0
+DEFAULT_SIZES = "16,256,4096,16384"
+DEFAULT_SPEEDS = "1000000,8000000,16000000"
+DEFAULT_METHODS = "xfer2,xfer3,writebytes2"
+XFER2_LIMIT = 4096   # spidev bufsiz; xfer2 refuses anything larger
+
+
+def open_spi(simulate):
+    if simulate:
+        return spi_sim.LoopbackSpiDev()
+    spi = spidev.SpiDev()
+    spi.open(SPI_BUS, SPI_DEV)
+    spi.mode = 0
+    return spi
+
+
+def make_payload(size):
+    # Non-trivial pattern so stuck-at and shifted bits both show up
+    return bytes((i * 37 + 11) & 0xFF for i in range(size))
+
+
+def histogram(samples_us):
+    """log2 buckets: '<=1us', '<=2us', '<=4us', ..."""
+    hist = {}
+    for v in samples_us:
+        bucket = 1
+        while bucket < v:
+            bucket <<= 1
+        key = f"<={bucket}us"
+        hist[key] = hist.get(key, 0) + 1
+    return dict(sorted(hist.items(), key=lambda kv: int(kv[0][2:-2])))
+
+
+def run_case(spi, method, size, hz, iterations):
+    if method == "xfer2" and size > XFER2_LIMIT:
+        return {"method": method, "size": size, "hz": hz, "skipped": f"> {XFER2_LIMIT} B"}
+    fn = getattr(spi, method, None)
+    if fn is None:
+        return {"method": method, "size": size, "hz": hz, "skipped": "not in this spidev"}
+
+    spi.max_speed_hz = hz
+    tx = make_payload(size)
+    lat_ns = array('Q', bytes(8 * iterations))
+    errors = 0
+    bad_transfers = 0
+    verify = method != "writebytes2"  # writebytes2 is TX only
+    clock = time.perf_counter_ns
+    modelled = getattr(spi, "modelled_seconds", None)   # The simulator: add the bus time it models
+
+    fn(tx)  # Warm-up (first ioctl sets up the DMA buffers)
+    bus_ns = 0
+    t_start = clock()
+    for i in range(iterations):
+        if modelled:
+            before = modelled()
+        t0 = clock()
+        rx = fn(tx)
+        lat_ns[i] = clock() - t0
+        if modelled:
+            bus = int(1e9 * (modelled() - before))
+            lat_ns[i] += bus
+            bus_ns += bus
+        if verify and bytes(rx) != tx:
+            bad_transfers += 1
+            errors += sum(a != b for a, b in zip(rx, tx))
+    elapsed = (clock() - t_start + bus_ns) / 1e9
+
+    lat_us = [v / 1000 for v in lat_ns]
+    q = statistics.quantiles(lat_us, n=100) if iterations > 1 else [lat_us[0]] * 99
+    return {
+        "method": method, "size": size, "hz": hz, "iterations": iterations,
+        "bytes_per_s": size * iterations / elapsed,
+        "bus_limit_bytes_per_s": hz / 8,
+        "lat_us_p50": q[49], "lat_us_p99": q[98], "lat_us_max": max(lat_us),
+        "jitter_us": statistics.pstdev(lat_us),
+        "histogram": histogram(lat_us),
+        "verified": verify,
+        "byte_errors": errors,
+        "bad_transfers": bad_transfers,
+    }
+
+
+def print_result(r, show_hist):
+    head = f"{r['method']:12} {r['size']:6} B @ {r['hz'] / 1e6:5.1f} MHz"
+    if "skipped" in r:
+        print(f"{head}  skipped ({r['skipped']})")
+        return
+    eff = 100 * r["bytes_per_s"] / r["bus_limit_bytes_per_s"]
+    errs = f"{r['byte_errors']} byte err / {r['bad_transfers']} xfers" if r["verified"] else "TX only"
+    print(f"{head}  {r['bytes_per_s'] / 1e3:9.1f} kB/s ({eff:5.1f}% of bus)  "
+          f"p50 {r['lat_us_p50']:8.1f} us  p99 {r['lat_us_p99']:8.1f} us  "
+          f"jitter {r['jitter_us']:7.1f} us  {errs}")
+    if show_hist:
+        for bucket, count in r["histogram"].items():
+            print(f"      {bucket:>10} {count:7} {'#' * min(60, count * 60 // r['iterations'] + 1)}")
+
+
+def option(name, default):
+    """Value after name on the command line, or default."""
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+if __name__ == '__main__':
+    simulate = '--sim' in sys.argv
+    if not simulate and spidev is None:
+        print("Error: spidev not installed (pip install spidev, or --sim for the simulated loopback)")
+        sys.exit(1)
+    try:
+        speeds = [int(x) for x in option('--speeds', DEFAULT_SPEEDS).split(",")]
+        sizes = [int(x) for x in option('--sizes', DEFAULT_SIZES).split(",")]
+        iterations = int(option('-n', 1000))
+    except ValueError as e:
+        print(f"Error: {e}")
+        print("Usage: python3 spi_bench.py [--sim] [--sizes 16,256] [--speeds 1000000] [-n 1000] "
+              "[--methods xfer2,xfer3,writebytes2] [--hist] [--json FILE]")
+        sys.exit(1)
+    methods = option('--methods', DEFAULT_METHODS).split(",")
+    json_path = option('--json', None)
+
+    spi = open_spi(simulate)
+    target = "simulated loopback, bus time modelled" if simulate else f"/dev/spidev{SPI_BUS}.{SPI_DEV}"
+    print(f"[OK] SPI benchmark on {target}, {iterations} transfers per case")
+
+    results = []
+    try:
+        for hz in speeds:
+            for size in sizes:
+                for method in methods:
+                    r = run_case(spi, method.strip(), size, hz, iterations)
+                    results.append(r)
+                    print_result(r, '--hist' in sys.argv)
+    finally:
+        spi.close()
+
+    if json_path:
+        out = json.dumps({"target": target, "results": results}, indent=2)
+        if json_path == "-":
+            print(out)
+        else:
+            with open(json_path, "w") as f:
+                f.write(out)
+    sys.exit(1 if sum(r.get("byte_errors", 0) for r in results) else 0)
@@ -1,5 +1,8 @@
 import sys
 import os
+import io
+import sd_transfer
+import sd_index
 
 # CONFIG: Where is the "SD Card"? 
 # If real SPI card, use "/mnt/sdcard" or similar mount point.
@@ -12,7 +15,9 @@ if len(sys.argv) < 2:
     print("Error: No action specified")
     sys.exit(1)
 
-action = sys.argv[1] # CREATE, READ, WRITE, LIST
+action = sys.argv[1] # CREATE, READ, WRITE, APPEND, LIST, CARD_INFO, BLOCK_READ
+
+index = sd_index.SDIndex(SD_PATH)
 
 try:
     if action == "CREATE":
@@ -23,30 +28,64 @@ try:
         else:
             with open(fpath, 'w') as f:
                 pass
+            index.update(fname)
             print(f"Success: Created {fname}")
 
     elif action == "WRITE":
         fname = sys.argv[2]
-        data = sys.argv[3]
+        data = ':'.join(sys.argv[3:])  # Data may itself contain ':'
         fpath = os.path.join(SD_PATH, fname)
         with open(fpath, 'w') as f:
             f.write(data)
+        index.update(fname)
         print(f"Success: Wrote data to {fname}")
 
+    elif action == "APPEND":
+        # One-off append; sustained logging goes through the listener's SDLogWriter
+        fname = sys.argv[2]
+        data = ':'.join(sys.argv[3:])
+        fpath = os.path.join(SD_PATH, fname)
+        with open(fpath, 'a') as f:
+            f.write(data + "\n")
+        index.update(fname)
+        print(f"Success: Appended data to {fname}")
+
     elif action == "READ":
+        # READ <fname> [offset] [length] -> streamed as READ_CHUNK lines
         fname = sys.argv[2]
+        offset = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] else 0
+        length = int(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4] else -1
         fpath = os.path.join(SD_PATH, fname)
         if os.path.exists(fpath):
-            with open(fpath, 'r') as f:
-                content = f.read()
-            print(f"READ_DATA: {content}")
+            sd_transfer.stream_file(fpath, fname, offset, length)
         else:
             print(f"Error: File {fname} not found")
 
     elif action == "LIST":
-        files = os.listdir(SD_PATH)
-        # Return as a simple comma-separated string for easier parsing
-        print(f"FILE_LIST: {', '.join(files)}")
+        # LIST [pattern] [sort] [cursor] [limit] -> one page of FILE_ROW lines
+        args = sys.argv[2:6] + [""] * 4
+        pattern, sort, cursor, limit = args[:4]
+        sd_index.print_page(index, pattern, sort or "name", cursor if cursor != "-" else "",
+                            int(limit) if limit else sd_index.PAGE_SIZE)
+
+    elif action in ("CARD_INFO", "BLOCK_READ"):
+        # Raw card access over SPI (no filesystem), see sd_block.py
+        import sd_block
+        card = sd_block.open_card()
+        try:
+            if action == "CARD_INFO":
+                kind = "SDHC" if card.high_capacity else "SDSC"
+                print(f"CARD_INFO: {kind}, {card.num_blocks} blocks, "
+                      f"{card.num_blocks * sd_block.BLOCK_SIZE // (1024 * 1024)} MiB")
+            else:
+                # BLOCK_READ <lba> <count> [offset] -> streamed like READ, resumable
+                lba, count = int(sys.argv[2]), int(sys.argv[3])
+                offset = int(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4] else 0
+                raw = sd_block.BlockDeviceFile(card, lba, count)
+                sd_transfer.stream_fileobj(io.BufferedReader(raw, buffer_size=8 * sd_block.BLOCK_SIZE),
+                                           f"blocks_{lba}_{count}.img", raw.size, 0, offset)
+        finally:
+            card.close()
 
 except Exception as e:
     print(f"SPI Error: {e}")
@@ -0,0 +1,264 @@
+"""
+spi_sim.py - Simulated spidev backends for off-device testing.
+
+Both classes mimic the parts of spidev.SpiDev we use (open/close,
+max_speed_hz, mode, xfer2/xfer3/writebytes2/readbytes) and keep counters
+of clocked bytes and ioctl-like calls so benchmarks can model bus time.
+
+  LoopbackSpiDev   - MISO wired to MOSI (RX == TX)
+  SimulatedSDCard  - SDHC card speaking the SPI-mode protocol
+                     (CMD0/8/55/41/58/9/16/17/18/12/24/25)
+"""
+import time
+
+SPIDEV_BUFSIZ = 4096   # Default spidev bufsiz (xfer2 limit)
+CALL_OVERHEAD = 20e-6  # Rough per-ioctl cost on a Pi, for modelled bus time
+
+
+class LoopbackSpiDev:
+    """spidev stand-in with MOSI looped back to MISO."""
+
+    def __init__(self, flip_bits_every=0, realtime=False):
+        self.max_speed_hz = 500_000
+        self.mode = 0
+        self.no_cs = False
+        self.bytes_clocked = 0
+        self.calls = 0
+        self.flip_bits_every = flip_bits_every  # >0: corrupt every Nth byte
+        self.realtime = realtime                # Take as long as the real bus would
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def _loop(self, data):
+        self.calls += 1
+        self.bytes_clocked += len(data)
+        if self.realtime:
+            end = time.perf_counter() + len(data) * 8 / self.max_speed_hz + CALL_OVERHEAD
+            while time.perf_counter() < end:
+                pass
+        if self.flip_bits_every:
+            out = bytearray(data)
+            out[::self.flip_bits_every] = bytes(b ^ 0x01 for b in out[::self.flip_bits_every])
+            return out
+        return data
+
+    def xfer2(self, data, *args):
+        if len(data) > SPIDEV_BUFSIZ:
+            raise OverflowError("Argument list size exceeds %d bytes." % SPIDEV_BUFSIZ)
+        return list(self._loop(bytes(data)))
+
+    def xfer3(self, data, *args):
+        # Real xfer3 splits into bufsiz sized ioctls internally
+        self.calls += (len(data) - 1) // SPIDEV_BUFSIZ
+        return tuple(self._loop(bytes(data)))
+
+    def writebytes2(self, data):
+        self.calls += (len(data) - 1) // SPIDEV_BUFSIZ
+        self._loop(data)
+
+    def readbytes(self, n):
+        return list(self._loop(bytes([0xFF]) * n))
+
+    def modelled_seconds(self):
+        """Bus time these transfers would take at max_speed_hz."""
+        return self.bytes_clocked * 8 / self.max_speed_hz + self.calls * CALL_OVERHEAD
+
+
+class SimulatedSDCard(LoopbackSpiDev):
+    """Byte-accurate SPI-mode SDHC card backed by a bytearray.
+
+    Responses are queued on a MISO FIFO and clocked out as the host sends
+    bytes, so the driver sees the same NCR/NAC gaps, data tokens and busy
+    periods as on real hardware.
+    """
+
+    BLOCK = 512
+
+    def __init__(self, num_blocks=2048, init_polls=3, nac=2, busy=4):
+        super().__init__()
+        self.num_blocks = num_blocks
+        self.data = bytearray(num_blocks * self.BLOCK)
+        self.init_polls = init_polls  # ACMD41 calls before the card leaves idle
+        self.nac = nac                # 0xFF bytes before each data token
+        self.busy = busy              # 0x00 bytes after each written block
+        self.reset()
+
+    def reset(self):
+        self.idle = True
+        self.acmd = False
+        self.polls = 0
+        self.miso = bytearray()
+        self.cmd_buf = bytearray()
+        self.state = 'cmd'            # cmd | read_multi | write_wait | write_data
+        self.read_lba = 0
+        self.write_lba = 0
+        self.write_multi = False
+        self.write_buf = bytearray()
+
+    # --- MISO SIDE ---
+    def _take(self, n):
+        """Clocks n bytes out of the card."""
+        if self.state == 'read_multi':
+            while len(self.miso) < n:
+                self._queue_block(self.read_lba)
+                self.read_lba += 1
+        out = self.miso[:n]
+        del self.miso[:n]
+        if len(out) < n:
+            out += b'\xFF' * (n - len(out))
+        return out
+
+    def _queue_block(self, lba):
+        start = lba * self.BLOCK
+        self.miso += b'\xFF' * self.nac + b'\xFE'
+        self.miso += self.data[start:start + self.BLOCK] + b'\x00\x00'
+
+    # --- MOSI SIDE ---
+    def _loop(self, data):
+        self.calls += 1
+        self.bytes_clocked += len(data)
+        rx = bytearray()
+        pos, n = 0, len(data)
+        while pos < n:
+            if self.state in ('cmd', 'read_multi') and not self.cmd_buf:
+                # Skip idle 0xFF filler in bulk
+                j = pos
+                while j < n and data[j] == 0xFF:
+                    j += 1
+                rx += self._take(j - pos)
+                pos = j
+                if pos == n:
+                    break
+            if self.state == 'write_wait':
+                j = pos
+                while j < n and data[j] == 0xFF:
+                    j += 1
+                rx += self._take(j - pos)
+                pos = j
+                if pos == n:
+                    break
+                rx += self._take(1)
+                self._on_token(data[pos])
+                pos += 1
+                continue
+            if self.state == 'write_data':
+                need = self.BLOCK + 2 - len(self.write_buf)
+                chunk = data[pos:pos + need]
+                self.write_buf += chunk
+                rx += self._take(len(chunk))
+                pos += len(chunk)
+                if len(self.write_buf) == self.BLOCK + 2:
+                    self._on_block_written()
+                continue
+            # Command bytes
+            rx += self._take(1)
+            self.cmd_buf.append(data[pos])
+            pos += 1
+            if len(self.cmd_buf) == 6:
+                frame = bytes(self.cmd_buf)
+                self.cmd_buf.clear()
+                self._on_command(frame)
+        return bytes(rx)
+
+    def _r1(self, value=None):
+        if value is None:
+            value = 0x01 if self.idle else 0x00
+        return value
+
+    def _on_command(self, frame):
+        cmd = frame[0] & 0x3F
+        arg = int.from_bytes(frame[1:5], 'big')
+        acmd, self.acmd = self.acmd, False
+
+        if cmd in (0, 8) and frame[5] != crc7(frame[:5]):
+            self.miso = bytearray(b'\xFF' + bytes([self._r1() | 0x08]))  # CRC error
+            return
+
+        if self.state == 'read_multi' and cmd != 12:
+            return  # Only STOP_TRANSMISSION is honoured mid-stream
+
+        resp = b''
+        if cmd == 0:
+            self.reset()
+            resp = bytes([0x01])
+        elif cmd == 8:
+            resp = bytes([self._r1()]) + (arg & 0xFFF).to_bytes(4, 'big')
+        elif cmd == 55:
+            self.acmd = True
+            resp = bytes([self._r1()])
+        elif cmd == 41 and acmd:
+            self.polls += 1
+            if self.polls >= self.init_polls:
+                self.idle = False
+            resp = bytes([self._r1()])
+        elif cmd == 58:
+            ocr = 0xC0FF8000 if not self.idle else 0x00FF8000  # Busy bit + CCS
+            resp = bytes([self._r1()]) + ocr.to_bytes(4, 'big')
+        elif cmd == 9:
+            c_size = self.num_blocks // 1024 - 1
+            csd = bytearray(16)
+            csd[0] = 0x40                     # CSD version 2.0
+            csd[7] = (c_size >> 16) & 0x3F
+            csd[8] = (c_size >> 8) & 0xFF
+            csd[9] = c_size & 0xFF
+            resp = bytes([self._r1()]) + b'\xFF\xFE' + bytes(csd) + b'\x00\x00'
+        elif cmd == 16:
+            resp = bytes([self._r1()])
+        elif cmd == 12:
+            self.state = 'cmd'
+            self.miso = bytearray(b'\xFF' + bytes([self._r1()]) + b'\x00' * self.busy)
+            return
+        elif cmd in (17, 18, 24, 25) and not self.idle:
+            if arg >= self.num_blocks:
+                resp = bytes([0x40])          # Parameter error
+            elif cmd == 17:
+                self.miso = bytearray(b'\xFF\x00')
+                self._queue_block(arg)
+                return
+            elif cmd == 18:
+                self.miso = bytearray(b'\xFF\x00')
+                self.read_lba = arg
+                self.state = 'read_multi'
+                return
+            else:
+                self.write_lba = arg
+                self.write_multi = cmd == 25
+                self.state = 'write_wait'
+                resp = bytes([0x00])
+        else:
+            resp = bytes([self._r1() | 0x04])  # Illegal command
+        self.miso = bytearray(b'\xFF' + resp)
+
+    def _on_token(self, token):
+        if token == 0xFE or (token == 0xFC and self.write_multi):
+            self.write_buf.clear()
+            self.state = 'write_data'
+        elif token == 0xFD and self.write_multi:
+            self.state = 'cmd'
+            self.miso += b'\xFF' + b'\x00' * self.busy
+
+    def _on_block_written(self):
+        start = self.write_lba * self.BLOCK
+        if self.write_lba >= self.num_blocks:
+            self.miso += b'\x0D'             # Write error
+        else:
+            self.data[start:start + self.BLOCK] = self.write_buf[:self.BLOCK]
+            self.miso += b'\x05' + b'\x00' * self.busy
+        self.write_lba += 1
+        self.state = 'write_wait' if self.write_multi else 'cmd'
+
+
+def crc7(data):
+    """CRC7 as used in SD command frames, returned with the end bit set."""
+    crc = 0
+    for byte in data:
+        for i in range(8):
+            bit = ((byte >> (7 - i)) & 1) ^ ((crc >> 6) & 1)
+            crc = (crc << 1) & 0x7F
+            if bit:
+                crc ^= 0x09
+    return (crc << 1) | 1
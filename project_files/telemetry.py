@@ -0,0 +1,427 @@
+"""
+telemetry.py - Live variables from the Pi to the dashboard (shared by both sides)
+
+Pi (Publisher): workers print SAMPLE:<series>:<value>[:<t_ms>] lines (or the
+listener calls update() itself). Each sample is quantised (value * scale,
+rounded) and queued only if it differs from the previous one. RATE_HZ times a
+second the queue goes out as one binary frame:
+
+  'S' frame: b'S' + t0 (u64 us) + per variable:
+             id (u8), count (varint), then per sample
+             zigzag varint delta-of-delta of the timestamp (us)
+             zigzag varint delta of the quantised value
+  'M' frame: b'M' + per variable: id (u8), scale (f64), name length (u8), name
+             (re-sent every META_INTERVAL, so a master started later catches up)
+
+Steady sampling costs 1 byte per timestamp and small changes 1-2 bytes per
+value. Frames are self-contained (first value absolute), so a lost frame is
+only a gap in the chart. If a frame would go over its share of
+BYTES_PER_S, each variable is thinned to min/max pairs first: the envelope of
+a kHz signal survives, the link is never flooded.
+
+Transport: COBS-framed on the mux 'telemetry' channel, or "TM:<base64>" lines
+when UART_MUX is off.
+
+Master (TelemetryStore): keeps the last RING_SIZE samples of every variable in
+NumPy ring buffers and returns them reduced to the chart's pixel width with
+LTTB (shape) or min/max per pixel (envelope), see flask_app.py /telemetry.
+
+  python3 telemetry.py --bench     # 1 kHz signals: link bytes and chart reduction
+"""
+import base64
+import struct
+import sys
+import threading
+import time
+
+import uart_mux
+from tsdb import _zigzag, _unzigzag, _put_varint, _get_varint   # Same varints as the on-device store
+
+np = None   # Imported by the first TelemetryStore: the Pi side (Publisher) doesn't
+            # need it, and it was the slowest import of the listener's start-up
+
+# --- CONFIGURATION ---
+RATE_HZ = 10              # Frames per second (the listener loop runs at 20 Hz)
+BYTES_PER_S = 2000        # Telemetry budget, ~17% of 115200 baud
+META_INTERVAL = 5.0       # Seconds between name/scale frames
+KEYFRAME_S = 1.0          # Re-send an unchanged value this often so charts keep moving
+DEFAULT_SCALE = 1000      # Quantum 0.001 for variables nobody registered
+RING_SIZE = 1 << 17       # Samples kept per variable on the master (~2 min at 1 kHz)
+TEXT_PREFIX = "TM:"
+
+T0 = struct.Struct(">Q")
+META = struct.Struct(">Bd")
+
+
+def minmax_thin(samples, n):
+    """Keeps the min and max of n/2 equal slices (in time order)."""
+    if len(samples) <= n:
+        return samples
+    slices = max(1, n // 2)
+    out = []
+    for i in range(slices):
+        part = samples[i * len(samples) // slices:(i + 1) * len(samples) // slices]
+        lo = min(part, key=lambda s: s[1])
+        hi = max(part, key=lambda s: s[1])
+        out += sorted({lo, hi})
+    return out
+
+
+def encode_samples(pending):
+    """pending: {id: [(t_us, q), ...]} -> 'S' frame."""
+    t0 = min(s[0][0] for s in pending.values())
+    out = bytearray(b"S" + T0.pack(t0))
+    for vid, samples in pending.items():
+        out.append(vid)
+        _put_varint(out, len(samples))
+        prev_t, prev_d, prev_q = t0, 0, 0
+        for t, q in samples:
+            d = t - prev_t
+            _put_varint(out, _zigzag(d - prev_d))
+            _put_varint(out, _zigzag(q - prev_q))
+            prev_t, prev_d, prev_q = t, d, q
+    return bytes(out)
+
+
+def decode_frame(frame):
+    """Returns ('M', [(id, scale, name)]) or ('S', {id: [(t_us, q)]})."""
+    kind, pos = frame[:1], 1
+    if kind == b"M":
+        out = []
+        while pos < len(frame):
+            vid, scale = META.unpack_from(frame, pos)
+            pos += META.size
+            n = frame[pos]
+            out.append((vid, scale, frame[pos + 1:pos + 1 + n].decode("utf-8", errors="replace")))
+            pos += 1 + n
+        return "M", out
+    if kind == b"S":
+        t, = T0.unpack_from(frame, pos)
+        pos += T0.size
+        out = {}
+        while pos < len(frame):
+            vid = frame[pos]
+            count, pos = _get_varint(frame, pos + 1)
+            samples = out[vid] = []
+            prev_t, prev_d, q = t, 0, 0
+            for _ in range(count):
+                dod, pos = _get_varint(frame, pos)
+                dq, pos = _get_varint(frame, pos)
+                prev_d += _unzigzag(dod)
+                prev_t += prev_d
+                q += _unzigzag(dq)
+                samples.append((prev_t, q))
+        return "S", out
+    raise ValueError("unknown telemetry frame")
+
+
+# --- PI SIDE ---
+class Publisher:
+    """Collects changed samples and emits one frame per 1/RATE_HZ.
+
+    emit(frame_bytes) -> False if the transport dropped it.
+    """
+
+    def __init__(self, emit, rate_hz=RATE_HZ, bytes_per_s=BYTES_PER_S):
+        self.emit = emit
+        self.period = 1.0 / rate_hz
+        self.budget = max(64, int(bytes_per_s / rate_hz))
+        self.vars = {}          # name -> [id, scale, last q, last queued time]
+        self.pending = {}       # id -> [(t_us, q)]
+        self.last_flush = 0.0
+        self.last_meta = None
+        self.stats = {"samples": 0, "unchanged": 0, "thinned": 0, "frames": 0,
+                      "bytes": 0, "dropped_frames": 0}
+
+    def register(self, name, scale=DEFAULT_SCALE):
+        if name not in self.vars:
+            if len(self.vars) >= 256:
+                raise ValueError("too many telemetry variables")
+            self.vars[name] = [len(self.vars), float(scale), None, 0.0]
+            self.last_meta = None   # Announce it with the next frame
+        else:
+            self.vars[name][1] = float(scale)
+        return self.vars[name][0]
+
+    def update(self, name, value, t=None):
+        """Queues one sample (t = epoch seconds, default now) if it changed."""
+        var = self.vars.get(name)
+        if var is None:
+            self.register(name)
+            var = self.vars[name]
+        t = time.time() if t is None else t
+        q = round(float(value) * var[1])
+        self.stats["samples"] += 1
+        if q == var[2] and t - var[3] < KEYFRAME_S:
+            self.stats["unchanged"] += 1
+            return
+        var[2], var[3] = q, t
+        self.pending.setdefault(var[0], []).append((int(t * 1e6), q))
+
+    def tick(self, now=None):
+        """Call from the main loop; sends at most one frame per period."""
+        now = time.monotonic() if now is None else now
+        if now - self.last_flush < self.period:
+            return
+        self.last_flush = now
+        if self.vars and (self.last_meta is None or now - self.last_meta >= META_INTERVAL):
+            self.last_meta = now
+            self._send(self.meta_frame())
+        if self.pending:
+            pending, self.pending = self.pending, {}
+            self._send(self._fit(pending))
+
+    def meta_frame(self):
+        out = bytearray(b"M")
+        for name, (vid, scale, _, _) in self.vars.items():
+            raw = name.encode("utf-8")[:255]
+            out += META.pack(vid, scale) + bytes([len(raw)]) + raw
+        return bytes(out)
+
+    def _fit(self, pending):
+        frame = encode_samples(pending)
+        for _ in range(4):
+            if len(frame) <= self.budget:
+                break
+            keep = len(frame) and self.budget / len(frame)
+            for vid, samples in pending.items():
+                thinned = minmax_thin(samples, max(4, int(len(samples) * keep * 0.9)))
+                self.stats["thinned"] += len(samples) - len(thinned)
+                pending[vid] = thinned
+            frame = encode_samples(pending)
+        return frame
+
+    def _send(self, frame):
+        self.stats["frames"] += 1
+        self.stats["bytes"] += len(frame)
+        if self.emit(frame) is False:
+            self.stats["dropped_frames"] += 1
+
+
+def mux_emitter(channel):
+    """Publisher emit() for a uart_mux channel (never blocks the caller)."""
+    return lambda frame: channel.write(b"\0" + uart_mux.cobs_encode(frame) + b"\0", block=False)
+
+
+def text_emitter(send_line):
+    """Publisher emit() for the plain text link."""
+    def emit(frame):
+        send_line(TEXT_PREFIX + base64.b64encode(frame).decode("ascii"))
+    return emit
+
+
+# --- MASTER SIDE ---
+class Ring:
+    def __init__(self, size=RING_SIZE):
+        self.t = np.zeros(size)
+        self.v = np.zeros(size)
+        self.size = size
+        self.n = 0            # Samples ever written
+
+    def extend(self, t, v):
+        t, v = t[-self.size:], v[-self.size:]
+        i, k = self.n % self.size, len(t)
+        first = min(k, self.size - i)
+        self.t[i:i + first], self.v[i:i + first] = t[:first], v[:first]
+        self.t[:k - first], self.v[:k - first] = t[first:], v[first:]
+        self.n += k
+
+    def window(self, start=None, end=None):
+        """Samples in time order, optionally cut to [start, end] (epoch seconds)."""
+        if self.n < self.size:
+            t, v = self.t[:self.n], self.v[:self.n]
+        else:
+            i = self.n % self.size
+            t = np.concatenate((self.t[i:], self.t[:i]))
+            v = np.concatenate((self.v[i:], self.v[:i]))
+        lo = 0 if start is None else np.searchsorted(t, start)
+        hi = len(t) if end is None else np.searchsorted(t, end, side="right")
+        return t[lo:hi], v[lo:hi]
+
+
+def lttb(t, v, n):
+    """Largest-Triangle-Three-Buckets: n points that keep the visual shape."""
+    size = len(t)
+    if n >= size or n < 3:
+        return t, v
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    idx = np.empty(n, dtype=np.int64)
+    idx[0], idx[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < n - 1 else size)
+        ct, cv = t[nlo:nhi].mean(), v[nlo:nhi].mean()
+        area = np.abs((t[a] - ct) * (v[lo:hi] - v[a]) - (t[a] - t[lo:hi]) * (cv - v[a]))
+        a = lo + int(area.argmax()) if hi > lo else lo
+        idx[i + 1] = a
+    return t[idx], v[idx]
+
+
+def minmax(t, v, n):
+    """Min and max of each of n/2 slices: keeps spikes and the envelope."""
+    size = len(t)
+    slices = n // 2
+    if size <= n or slices < 1:
+        return t, v
+    edges = (np.arange(slices) * size) // slices
+    bucket = np.repeat(np.arange(slices), np.diff(np.append(edges, size)))
+    picks = []
+    for reduce in (np.minimum, np.maximum):
+        hits = np.flatnonzero(v == reduce.reduceat(v, edges)[bucket])
+        _, first = np.unique(bucket[hits], return_index=True)
+        picks.append(hits[first])
+    idx = np.unique(np.concatenate(picks))
+    return t[idx], v[idx]
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+class TelemetryStore:
+    def __init__(self, ring_size=RING_SIZE):
+        global np
+        if np is None:
+            try:
+                import numpy as np
+            except ImportError:
+                raise ImportError("telemetry charts need numpy (pip install numpy)")
+        self.ring_size = ring_size
+        self.names = {}        # id -> (name, scale)
+        self.rings = {}        # name -> Ring
+        self.unnamed = {}      # id -> [(t_us, q)] until its 'M' frame arrives
+        self.partial = bytearray()
+        self.lock = threading.Lock()   # Link reader thread writes, web requests read
+        self.stats = {"frames": 0, "bad_frames": 0, "samples": 0}
+
+    # --- INPUT ---
+    def feed_stream(self, data):
+        """Bytes from the mux telemetry channel (0-delimited COBS frames)."""
+        self.partial += data
+        *frames, rest = bytes(self.partial).split(b"\0")
+        self.partial = bytearray(rest)
+        for raw in frames:
+            if raw:
+                try:
+                    self.feed_frame(uart_mux.cobs_decode(raw))
+                except ValueError:
+                    self.stats["bad_frames"] += 1
+
+    def handle_line(self, line):
+        """TM:<base64> lines from the text link. Returns True if consumed."""
+        if not line.startswith(TEXT_PREFIX):
+            return False
+        try:
+            self.feed_frame(base64.b64decode(line[len(TEXT_PREFIX):], validate=True))
+        except ValueError:
+            self.stats["bad_frames"] += 1
+        return True
+
+    def feed_frame(self, frame):
+        try:
+            kind, body = decode_frame(frame)
+        except (IndexError, struct.error) as e:
+            raise ValueError(f"truncated telemetry frame: {e}")
+        self.stats["frames"] += 1
+        if kind == "M":
+            for vid, scale, name in body:
+                self.names[vid] = (name, scale)
+            for vid in [v for v in self.unnamed if v in self.names]:
+                self._store(vid, self.unnamed.pop(vid))
+            return
+        for vid, samples in body.items():
+            if vid in self.names:
+                self._store(vid, samples)
+            else:
+                self.unnamed.setdefault(vid, []).extend(samples[-1000:])
+
+    def _store(self, vid, samples):
+        name, scale = self.names[vid]
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = self.rings[name] = Ring(self.ring_size)
+        arr = np.array(samples, dtype=np.float64)
+        with self.lock:
+            ring.extend(arr[:, 0] / 1e6, arr[:, 1] / scale)
+        self.stats["samples"] += len(samples)
+
+    # --- OUTPUT ---
+    def variables(self):
+        out = {}
+        for name, ring in list(self.rings.items()):
+            if ring.n:
+                i = (ring.n - 1) % ring.size
+                out[name] = {"t": ring.t[i], "value": ring.v[i], "samples": ring.n}
+        return out
+
+    def chart(self, name, width=800, seconds=60.0, method="lttb", end=None):
+        """Last `seconds` of a variable reduced to ~width points."""
+        ring = self.rings.get(name)
+        if ring is None:
+            return None
+        if end is None:
+            end = ring.t[(ring.n - 1) % ring.size]
+        with self.lock:
+            t, v = ring.window(end - seconds, end)
+            t, v = t.copy(), v.copy()
+        raw = len(t)
+        t, v = METHODS[method](t, v, max(3, int(width)))
+        return {"name": name, "method": method, "raw_points": raw,
+                "t": t.tolist(), "v": v.tolist()}
+
+
+# --- BENCH ---
+def run_bench(seconds=10.0, rate=1000):
+    import math
+
+    store = TelemetryStore()
+    frames = []
+    pub = Publisher(lambda f: frames.append(f) or True)
+    pub.register("adc", scale=1000)
+    pub.register("gpio_led", scale=1)
+    pub.register("pwm_duty", scale=1)
+    text_bytes = 0
+    t0 = time.time()
+    start = time.perf_counter()
+    for i in range(int(seconds * rate)):
+        t = t0 + i / rate
+        values = {
+            "adc": round(1.65 + 1.2 * math.sin(2 * math.pi * 3 * t), 3),   # 3 Hz sine
+            "gpio_led": 1 if (i // 250) % 2 else 0,                       # 2 Hz blink
+            "pwm_duty": (i // 50) * 5 % 105,                               # breathing steps
+        }
+        for name, value in values.items():
+            pub.update(name, value, t)
+            text_bytes += len(f"SAMPLE:{name}:{value}:{int(t * 1000)}\n")
+        pub.tick(i / rate)
+    pub.tick(seconds + 1)
+    encode_s = time.perf_counter() - start
+
+    for f in frames:
+        store.feed_frame(f)
+    wire = sum(len(uart_mux.cobs_encode(f)) + 2 for f in frames)
+    print(f"{rate} Hz x 3 variables for {seconds:.0f} s = {pub.stats['samples']} samples "
+          f"({pub.stats['unchanged']} unchanged, {pub.stats['thinned']} thinned to fit)")
+    print(f"  as SAMPLE text lines : {text_bytes / seconds:8.0f} B/s")
+    print(f"  telemetry frames     : {wire / seconds:8.0f} B/s ({len(frames)} frames, "
+          f"budget {BYTES_PER_S} B/s), encode {encode_s / pub.stats['samples'] * 1e6:.1f} us/sample")
+    print(f"  stored on master     : {store.stats['samples']} samples")
+
+    # Chart reduction over a full ring at 1 kHz
+    big = TelemetryStore()
+    t = t0 + np.arange(RING_SIZE) / rate
+    ring = big.rings["adc"] = Ring()
+    ring.extend(t, np.sin(2 * np.pi * 3 * t) + np.random.default_rng(1).normal(0, 0.05, RING_SIZE))
+    for method in METHODS:
+        start = time.perf_counter()
+        for _ in range(5):
+            out = big.chart("adc", width=800, seconds=RING_SIZE / rate, method=method)
+        ms = (time.perf_counter() - start) / 5 * 1000
+        print(f"  {method:6} {out['raw_points']} -> {len(out['t'])} points in {ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_bench()
+    else:
+        print("Usage: python3 telemetry.py --bench")
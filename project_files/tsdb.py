@@ -0,0 +1,339 @@
+"""
+tsdb.py - Compact on-device time-series store.
+
+Layout under <SD_PATH>/tsdb/<series>/:
+  raw_<first_ms>.chk   append-only chunks, ~2 bytes/sample for steady data:
+                       header  = b'TS1' + first timestamp (ms) + first value
+                       records = zigzag varint delta-of-delta timestamp
+                                 + XOR-with-previous value (control byte +
+                                   only the non-zero bytes of the XOR)
+  agg_60.dat           1-minute buckets  (t, count, min, max, sum)
+  agg_3600.dat         1-hour buckets    (same record layout)
+
+Tiers are filled incrementally as samples arrive, so a query over hours
+reads a few hundred fixed-size records instead of every raw sample.
+Old raw chunks and minute buckets are dropped after their retention.
+
+Writers: main_listener.py records worker lines "SAMPLE:<series>:<value>[:<t_ms>]"
+and GPIO state changes. Readers: CMD:TSDB:QUERY (see query_rows()).
+"""
+import os
+import re
+import struct
+import time
+
+# --- CONFIGURATION ---
+SD_PATH = "sd_card_storage"         # Same storage directory as spi_sd_card.py
+CHUNK_SPAN_MS = 3600 * 1000         # Start a new raw chunk every hour...
+CHUNK_MAX_BYTES = 256 * 1024        # ...or when it gets this big
+TIERS = (60, 3600)                  # Downsampled bucket sizes (seconds)
+RETENTION_S = {0: 2 * 86400, 60: 30 * 86400, 3600: None}  # 0 = raw; None = keep
+MAX_ROWS = 500                      # Cap on rows per query reply
+NAME_RE = re.compile(r"[A-Za-z0-9_.-]+")   # Series names become directory names
+
+MAGIC = b"TS1"
+HEADER = struct.Struct("<qd")        # first timestamp (ms), first value
+AGG = struct.Struct("<qIddd")        # bucket start (s), count, min, max, sum
+
+
+# --- ENCODING ---
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, pos):
+    shift = result = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _float_bits(v):
+    return struct.unpack("<Q", struct.pack("<d", v))[0]
+
+
+def _bits_float(b):
+    return struct.unpack("<d", struct.pack("<Q", b))[0]
+
+
+class ChunkEncoder:
+    def __init__(self, t_ms, value):
+        self.prev_t = t_ms
+        self.prev_delta = 0
+        self.prev_bits = _float_bits(value)
+
+    def encode(self, t_ms, value, out):
+        delta = t_ms - self.prev_t
+        _put_varint(out, _zigzag(delta - self.prev_delta))
+        self.prev_delta, self.prev_t = delta, t_ms
+
+        bits = _float_bits(value)
+        xor = bits ^ self.prev_bits
+        self.prev_bits = bits
+        if xor == 0:
+            out.append(0)
+            return
+        shift = (((xor & -xor).bit_length() - 1) // 8)   # Whole zero bytes at the bottom
+        xor >>= 8 * shift
+        nbytes = (xor.bit_length() + 7) // 8
+        out.append((shift << 4) | nbytes)
+        out += xor.to_bytes(nbytes, 'little')
+
+
+def decode_chunk(data):
+    """Yields (t_ms, value) from one chunk; stops quietly at a torn tail."""
+    if data[:3] != MAGIC or len(data) < 3 + HEADER.size:
+        return
+    t, v = HEADER.unpack_from(data, 3)
+    yield t, v
+    pos = 3 + HEADER.size
+    delta, bits = 0, _float_bits(v)
+    try:
+        while pos < len(data):
+            dod, pos = _get_varint(data, pos)
+            ctrl = data[pos]
+            pos += 1
+            if ctrl:
+                shift, nbytes = ctrl >> 4, ctrl & 0x0F
+                if pos + nbytes > len(data):
+                    return
+                bits ^= int.from_bytes(data[pos:pos + nbytes], 'little') << (8 * shift)
+                pos += nbytes
+            delta += _unzigzag(dod)
+            t += delta
+            yield t, _bits_float(bits)
+    except IndexError:
+        return  # Power cut mid-record: everything before it is still good
+
+
+# --- STORAGE ---
+def check_name(name):
+    """Raises ValueError for a series name that isn't a plain directory name."""
+    if not NAME_RE.fullmatch(name) or name == "." or ".." in name:
+        raise ValueError(f"bad series name {name!r}")
+
+
+class Series:
+    def __init__(self, root, name):
+        check_name(name)
+        self.name = name
+        self.dir = os.path.join(root, name)
+        os.makedirs(self.dir, exist_ok=True)
+        self.chunk = None       # open file object
+        self.chunk_start = 0
+        self.encoder = None
+        self.last_t = None
+        self.buckets = {}       # tier -> [start, count, min, max, sum]
+        self.agg_files = {tier: open(os.path.join(self.dir, f"agg_{tier}.dat"), 'ab')
+                          for tier in TIERS}
+
+    def append(self, t_ms, value):
+        if self.last_t is not None and t_ms < self.last_t:
+            t_ms = self.last_t  # Clock went backwards: keep chunks monotonic
+        self.last_t = t_ms
+        value = float(value)
+        if (self.chunk is None or t_ms - self.chunk_start >= CHUNK_SPAN_MS or
+                self.chunk.tell() >= CHUNK_MAX_BYTES):
+            self._new_chunk(t_ms, value)
+        else:
+            out = bytearray()
+            self.encoder.encode(t_ms, value, out)
+            self.chunk.write(out)
+        self._aggregate(t_ms // 1000, value)
+
+    def _new_chunk(self, t_ms, value):
+        if self.chunk:
+            self.chunk.close()
+        path = os.path.join(self.dir, f"raw_{t_ms}.chk")
+        self.chunk = open(path, 'ab')
+        self.chunk.write(MAGIC + HEADER.pack(t_ms, value))
+        self.chunk_start = t_ms
+        self.encoder = ChunkEncoder(t_ms, value)
+
+    def _aggregate(self, t_s, value):
+        for tier in TIERS:
+            start = t_s - t_s % tier
+            b = self.buckets.get(tier)
+            if b is not None and b[0] != start:
+                self.agg_files[tier].write(AGG.pack(*b))
+                b = None
+            if b is None:
+                self.buckets[tier] = [start, 1, value, value, value]
+            else:
+                b[1] += 1
+                b[2] = min(b[2], value)
+                b[3] = max(b[3], value)
+                b[4] += value
+
+    def flush(self):
+        if self.chunk:
+            self.chunk.flush()
+        for f in self.agg_files.values():
+            f.flush()
+
+    def close(self):
+        # Write out the partial buckets so nothing is lost on a clean stop
+        for tier, b in self.buckets.items():
+            self.agg_files[tier].write(AGG.pack(*b))
+        self.buckets.clear()
+        self.flush()
+        if self.chunk:
+            self.chunk.close()
+        for f in self.agg_files.values():
+            f.close()
+
+    # --- READING ---
+    def raw_points(self, start_ms, end_ms):
+        names = sorted((int(n[4:-4]), n) for n in os.listdir(self.dir) if n.startswith("raw_"))
+        for i, (first, name) in enumerate(names):
+            nxt = names[i + 1][0] if i + 1 < len(names) else None
+            if first > end_ms or (nxt is not None and nxt <= start_ms):
+                continue
+            with open(os.path.join(self.dir, name), 'rb') as f:
+                for t, v in decode_chunk(f.read()):
+                    if start_ms <= t <= end_ms:
+                        yield t, v
+
+    def agg_points(self, tier, start_s, end_s):
+        path = os.path.join(self.dir, f"agg_{tier}.dat")
+        with open(path, 'rb') as f:
+            data = f.read()
+        whole = len(data) - len(data) % AGG.size
+        recs = [AGG.unpack_from(data, i) for i in range(0, whole, AGG.size)]
+        b = self.buckets.get(tier)
+        if b is not None:
+            recs.append(tuple(b))  # Bucket still being filled
+        for rec in recs:
+            if start_s <= rec[0] <= end_s:
+                yield rec
+
+    def expire(self, now_s):
+        """Drops raw chunks and buckets past their retention."""
+        keep_raw = RETENTION_S.get(0)
+        if keep_raw:
+            for n in os.listdir(self.dir):
+                if n.startswith("raw_") and int(n[4:-4]) < (now_s - keep_raw) * 1000:
+                    path = os.path.join(self.dir, n)
+                    if self.chunk is None or self.chunk.name != path:
+                        os.remove(path)
+        for tier in TIERS:
+            keep = RETENTION_S.get(tier)
+            if not keep:
+                continue
+            path = os.path.join(self.dir, f"agg_{tier}.dat")
+            self.agg_files[tier].flush()
+            with open(path, 'rb') as f:
+                data = f.read()
+            cut = 0
+            while cut + AGG.size <= len(data) and AGG.unpack_from(data, cut)[0] < now_s - keep:
+                cut += AGG.size
+            if cut:
+                self.agg_files[tier].close()
+                tmp = path + ".tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(data[cut:])
+                os.replace(tmp, path)
+                self.agg_files[tier] = open(path, 'ab')
+
+
+class TSDB:
+    def __init__(self, sd_path=SD_PATH):
+        self.root = os.path.join(sd_path, "tsdb")
+        os.makedirs(self.root, exist_ok=True)
+        self.series = {}
+        self.last_flush = time.monotonic()
+        self.last_expire = 0
+
+    def _get(self, name):
+        s = self.series.get(name)
+        if s is None:
+            s = self.series[name] = Series(self.root, name)
+        return s
+
+    def append(self, name, value, t_ms=None):
+        self._get(name).append(int(time.time() * 1000) if t_ms is None else int(t_ms), value)
+
+    def names(self):
+        return sorted(os.listdir(self.root))
+
+    def tick(self, flush_every=1.0, expire_every=3600):
+        """Call from the idle loop: flushes once a second, expires once an hour."""
+        now = time.monotonic()
+        if now - self.last_flush >= flush_every:
+            for s in self.series.values():
+                s.flush()
+            self.last_flush = now
+        if now - self.last_expire >= expire_every:
+            for s in self.series.values():
+                s.expire(time.time())
+            self.last_expire = now
+
+    def close(self):
+        for s in self.series.values():
+            s.close()
+        self.series.clear()
+
+    def query(self, name, start_s, end_s, step_s):
+        """Returns [(t, count, min, max, avg)] in step_s buckets, from the
+        coarsest tier that still resolves step_s."""
+        if name not in self.names():
+            return []
+        s = self._get(name)
+        s.flush()
+        step_s = max(1, int(step_s))
+        # Make sure we never return more than MAX_ROWS rows
+        step_s = max(step_s, -(-int(end_s - start_s) // MAX_ROWS))
+        tier = max([t for t in TIERS if t <= step_s], default=0)
+
+        out = {}
+        def add(bucket, count, lo, hi, total):
+            b = out.get(bucket)
+            if b is None:
+                out[bucket] = [count, lo, hi, total]
+            else:
+                b[0] += count
+                b[1] = min(b[1], lo)
+                b[2] = max(b[2], hi)
+                b[3] += total
+
+        if tier == 0:
+            for t, v in s.raw_points(int(start_s * 1000), int(end_s * 1000)):
+                t = t // 1000
+                add(t - t % step_s, 1, v, v, v)
+        else:
+            for t, count, lo, hi, total in s.agg_points(tier, start_s, end_s):
+                add(t - t % step_s, count, lo, hi, total)
+        return [(t, c, lo, hi, total / c) for t, (c, lo, hi, total) in sorted(out.items())]
+
+
+def query_rows(db, series, start, end, step):
+    """CMD:TSDB:QUERY handler: start/end are epoch seconds, or negative
+    seconds relative to now (-3600 = an hour ago); empty end = now."""
+    now = time.time()
+    start = float(start) if start else -3600
+    end = float(end) if end else now
+    if start < 0:
+        start += now
+    if end < 0:
+        end += now
+    lines = []
+    rows = db.query(series, int(start), int(end), int(float(step or 60)))
+    for t, count, lo, hi, avg in rows:
+        lines.append(f"TS_ROW:{series}:{t}:{count}:{lo:g}:{hi:g}:{avg:.4g}")
+    lines.append(f"TS_END:{series}:{len(rows)}")
+    return lines
@@ -0,0 +1,673 @@
+"""
+uart_mux.py - Virtual channels over the single PC <-> Pi UART (shared by both sides)
+
+Without it, commands, worker logs, SD file data and chat all queue behind
+each other on one wire, so a big READ transfer holds up every LOG line.
+The mux splits the link into numbered channels:
+
+  * every channel has its own receive window; the receiver grants credit
+    as its application consumes data, so a slow consumer only stalls its
+    own channel
+  * interactive channels (control, chat) always go first, in frames of at
+    most MAX_PAYLOAD bytes, and the writer keeps no more than LOW_WATER
+    bytes queued in the driver, so a command never waits behind more
+    than about one frame of bulk data
+  * the other channels share what is left by weighted deficit round robin
+
+Wire format: 0x00 + COBS(channel, type, epoch, u32 value, payload, CRC32) + 0x00
+  D  data    value = stream offset of the payload (gaps count as lost bytes)
+  G  grant   value = offset the sender may send up to
+  H  hello   value = session id (a new one means the peer restarted)
+  P  ping    value = sequence number; answered straight from the reader thread
+  Q  pong    value = the ping's sequence number (see link_health.py)
+  T  time     value = sequence number, payload = t1 (+ padding to the size of U)
+  U  time ack value = T's sequence number, payload = t1, t2 (T received), t3 (U sent)
+     Clock stamps (see clock_sync.py) are taken by the reader thread as the
+     frame arrives and by the writer right before it hands the frame to the
+     driver, with the driver queue empty; T and U are the same length on the
+     wire, so both directions take the same time.
+Frames are not retransmitted: file transfers already check and resume
+(sd_transfer.py), and everything else is line-based text.
+
+API (both sides):
+    mux = Mux(baud)
+    mux.attach(ser); mux.start_reader(ser)      # or feed() from your own reader
+    ctrl = mux.open(CONTROL)
+    ctrl.send_line("CMD:GPIO:ON")
+    ctrl.readline(timeout=0.1)                  # or: ctrl.on_line = callback
+    ChannelServer(mux).start()                  # other local programs (chat) connect
+                                                # to socket://localhost:5760 and
+                                                # send "OPEN chat\\n" first
+
+  python3 uart_mux.py --demo      # chat latency under a bulk transfer, with and without the mux
+"""
+import random
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# --- CONFIGURATION ---
+MAX_PAYLOAD = 240      # Bytes per data frame: bounds how long a bulk frame holds the wire
+LOW_WATER = 64         # Driver TX queue depth (bytes) before the next frame is chosen
+QUANTUM = 256          # Deficit round robin: bytes per weight unit per round
+REFRESH_INTERVAL = 1.0 # Re-send hello + grants (they can be lost like anything else)
+MUX_PORT = 5760        # ChannelServer TCP port (localhost only)
+
+CONTROL, LOG, BULK, CHAT, TELEMETRY = 0, 1, 2, 3, 4
+# id: (name, weight, interactive, receive window, send buffer)
+CHANNELS = {
+    CONTROL: ("control", 1, True, 2048, 16384),
+    LOG: ("log", 4, False, 8192, 65536),
+    BULK: ("bulk", 1, False, 16384, 65536),
+    CHAT: ("chat", 1, True, 4096, 65536),
+    TELEMETRY: ("telemetry", 2, False, 8192, 16384),
+}
+DEFAULT_CHANNEL = ("ch", 1, False, 4096, 65536)
+
+HEADER = struct.Struct(">BcBI")   # channel, type, epoch, value
+TIME = struct.Struct(">QQQ")       # T / U payload, microseconds
+MOD = 1 << 32
+
+
+def ahead(a, b):
+    """True if offset a is after offset b (mod 2**32)."""
+    return 0 < (a - b) % MOD < MOD // 2
+
+
+# --- FRAMING ---
+def cobs_encode(data):
+    out = bytearray()
+    for seg in data.split(b"\0"):
+        while len(seg) >= 254:
+            out.append(0xFF)
+            out += seg[:254]
+            seg = seg[254:]
+        out.append(len(seg) + 1)
+        out += seg
+    return bytes(out)
+
+
+def cobs_decode(data):
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        code = data[i]
+        i += 1
+        if code == 0 or i + code - 1 > n:
+            raise ValueError("bad COBS block")
+        out += data[i:i + code - 1]
+        i += code - 1
+        if code < 0xFF and i < n:
+            out.append(0)
+    return bytes(out)
+
+
+def encode_frame(cid, kind, epoch, value, payload=b""):
+    body = HEADER.pack(cid, kind, epoch, value) + payload
+    return b"\0" + cobs_encode(body + zlib.crc32(body).to_bytes(4, "big")) + b"\0"
+
+
+TIME_FRAME_BYTES = len(encode_frame(0, b"T", 0, 0, TIME.pack(0, 0, 0)))   # T and U alike
+
+
+class Channel:
+    def __init__(self, mux, cid, name, weight, interactive, window, tx_limit):
+        self.mux = mux
+        self.cid = cid
+        self.name = name
+        self.weight = weight
+        self.interactive = interactive
+        self.window = window
+        self.tx_limit = tx_limit
+        self.cond = threading.Condition(mux.lock)
+        # Sending
+        self.tx = bytearray()
+        self.tx_offset = 0
+        self.tx_epoch = 0
+        self.peer_limit = window       # Peer's window is known up front
+        self.deficit = 0
+        # Receiving
+        self.rx = bytearray()
+        self.rx_offset = 0
+        self.rx_epoch = None
+        self.granted = window
+        self.on_data = None            # Callback(bytes): data is consumed on arrival
+        self.on_line = None            # Callback(str) per complete line
+        self._line = bytearray()
+        self.stats = {"tx_bytes": 0, "rx_bytes": 0, "lost_bytes": 0, "dropped_writes": 0}
+
+    # --- SENDING ---
+    def write(self, data, block=True, timeout=None):
+        """Queues data. Blocks while the send buffer is full (block=False drops instead)."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.tx) + len(data) <= self.tx_limit or not self.mux.running,
+                                      timeout if block else 0):
+                self.stats["dropped_writes"] += 1
+                return False
+            self.tx += data
+            self.mux.wake.notify()
+            return True
+
+    def send_line(self, line, block=True, timeout=None):
+        return self.write(f"{line}\n".encode("utf-8"), block, timeout)
+
+    def credit(self):
+        c = (self.peer_limit - self.tx_offset) % MOD
+        return c if c < MOD // 2 else 0
+
+    def chunk_len(self):
+        return min(MAX_PAYLOAD, len(self.tx), self.credit())
+
+    def take_frame(self, n):
+        data = bytes(self.tx[:n])
+        del self.tx[:n]
+        frame = encode_frame(self.cid, b"D", self.tx_epoch, self.tx_offset, data)
+        self.tx_offset = (self.tx_offset + n) % MOD
+        self.stats["tx_bytes"] += n
+        if not self.tx:
+            self.deficit = 0
+        self.cond.notify_all()  # Room in the send buffer
+        return frame
+
+    def reset_tx(self):
+        self.tx_offset = 0
+        self.tx_epoch = (self.tx_epoch + 1) & 0xFF
+        self.peer_limit = self.window
+
+    # --- RECEIVING ---
+    def read(self, timeout=None):
+        """Returns whatever has arrived (b'' on timeout)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.rx, timeout)
+            data, self.rx = bytes(self.rx), bytearray()
+            self.mux._maybe_grant(self)
+            return data
+
+    def readline(self, timeout=0):
+        """Returns one line (bytes, without the newline) or None."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: b"\n" in self.rx, timeout):
+                return None
+            i = self.rx.index(b"\n")
+            line = bytes(self.rx[:i])
+            del self.rx[:i + 1]
+            self.mux._maybe_grant(self)
+            return line
+
+    def consumed(self):
+        return (self.rx_offset - len(self.rx)) % MOD
+
+    def _deliver(self, data):
+        """Runs the callbacks (called without the mux lock held). A failing
+        callback is logged, so it can't take the reader thread down with it."""
+        if self.on_data:
+            try:
+                self.on_data(data)
+            except Exception as e:
+                print(f"UART mux {self.name} callback error: {e}")
+        if self.on_line:
+            self._line += data
+            while True:
+                i = self._line.find(b"\n")
+                if i < 0:
+                    break
+                line = self._line[:i].decode("utf-8", errors="replace").strip()
+                del self._line[:i + 1]
+                if line:
+                    try:
+                        self.on_line(line)
+                    except Exception as e:
+                        print(f"UART mux {self.name} callback error: {e}")
+
+
+class Mux:
+    def __init__(self, baud=115200, clock=None):
+        self.baud = baud
+        self.clock = clock or (lambda: time.monotonic_ns() // 1000)   # Stamps T / U frames
+        self.lock = threading.RLock()
+        self.wake = threading.Condition(self.lock)
+        self.channels = {}
+        self.transport = None
+        self.session = random.randrange(1, MOD)
+        self.peer_session = None
+        self.ctrl_frames = []          # Grants / hellos waiting to go out
+        self.rr = 0
+        self.last_refresh = 0.0
+        self.running = True
+        self.in_frame = False
+        self.frame = bytearray()
+        self.stats = {"frames_in": 0, "bad_frames": 0, "noise_bytes": 0, "frames_out": 0}
+        self.on_pong = None            # Callback(seq) for answered pings
+        self.on_time = None            # Callback(seq, t1, t2, t3, t4) for answered time requests
+        for cid in CHANNELS:
+            self.open(cid)
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    # --- PUBLIC ---
+    def open(self, cid, name=None, weight=None, interactive=None, window=None):
+        """Returns the channel, creating it with its CHANNELS defaults."""
+        if isinstance(cid, str):
+            cid = next((c for c, cfg in CHANNELS.items() if cfg[0] == cid), None)
+            if cid is None:
+                raise KeyError("unknown channel name")
+        with self.lock:
+            ch = self.channels.get(cid)
+            if ch is None:
+                d_name, d_weight, d_inter, d_window, d_tx = CHANNELS.get(cid, DEFAULT_CHANNEL)
+                ch = self.channels[cid] = Channel(
+                    self, cid, name or d_name, weight or d_weight,
+                    d_inter if interactive is None else interactive, window or d_window, d_tx)
+            return ch
+
+    def attach(self, transport):
+        """Starts sending on transport (anything with write(); out_waiting is used if present)."""
+        with self.lock:
+            self.transport = transport
+            self.last_refresh = 0.0      # Say hello straight away
+            self.wake.notify()
+
+    def detach(self):
+        with self.lock:
+            self.transport = None
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.wake.notify_all()
+            for ch in self.channels.values():
+                ch.cond.notify_all()
+
+    def ping(self, seq):
+        """Queues a heartbeat ahead of all data. False while detached."""
+        with self.lock:
+            if self.transport is None:
+                return False
+            self.ctrl_frames.insert(0, encode_frame(0, b"P", 0, seq))
+            self.wake.notify()
+            return True
+
+    def time_request(self, seq):
+        """Queues a clock sync request, stamped when it goes out. False while detached."""
+        with self.lock:
+            if self.transport is None:
+                return False
+            self.ctrl_frames.insert(0, lambda: encode_frame(0, b"T", 0, seq, TIME.pack(self.clock(), 0, 0)))
+            self.wake.notify()
+            return True
+
+    def start_reader(self, ser):
+        """Reads ser in a thread and feeds the mux (for callers without their own reader)."""
+        def run():
+            while self.running:
+                try:
+                    data = ser.read(max(1, ser.in_waiting))
+                except Exception as e:
+                    print(f"UART Error: {e}")
+                    return
+                if data:
+                    self.feed(data)
+        threading.Thread(target=run, daemon=True).start()
+
+    def channel_stats(self):
+        with self.lock:
+            return {ch.name: dict(ch.stats, queued=len(ch.tx), credit=ch.credit())
+                    for ch in self.channels.values()}
+
+    # --- RECEIVING ---
+    def feed(self, data):
+        while data:
+            z = data.find(0)
+            if z < 0:
+                if self.in_frame:
+                    self.frame += data
+                else:
+                    self.stats["noise_bytes"] += len(data)
+                break
+            part, data = data[:z], data[z + 1:]
+            if not self.in_frame:
+                self.stats["noise_bytes"] += len(part)
+                self.in_frame = True
+                continue
+            self.frame += part
+            if self.frame:   # 00 00 = end of one frame + start of the next: stay in frame mode
+                raw = bytes(self.frame)
+                self.frame.clear()
+                self.in_frame = False
+                self._on_frame(raw)
+        if len(self.frame) > 4 * MAX_PAYLOAD:
+            self.frame.clear()  # Lost a delimiter in noise
+
+    def _on_frame(self, raw):
+        received = self.clock()
+        try:
+            body = cobs_decode(raw)
+        except ValueError:
+            body = b""
+        if len(body) < HEADER.size + 4 or zlib.crc32(body[:-4]) != int.from_bytes(body[-4:], "big"):
+            self.stats["bad_frames"] += 1
+            return
+        self.stats["frames_in"] += 1
+        cid, kind, epoch, value = HEADER.unpack_from(body)
+        payload = body[HEADER.size:-4]
+        deliver = None
+        if kind == b"Q":
+            if self.on_pong:
+                self.on_pong(value)
+            return
+        if kind == b"U":
+            if self.on_time and len(payload) == TIME.size:
+                self.on_time(value, *TIME.unpack(payload)[:3], received)
+            return
+        with self.lock:
+            if kind == b"H":
+                self._on_hello(value)
+                return
+            if kind == b"P":
+                self.ctrl_frames.insert(0, encode_frame(0, b"Q", 0, value))
+                self.wake.notify()
+                return
+            if kind == b"T":
+                if len(payload) == TIME.size:
+                    t1 = TIME.unpack(payload)[0]
+                    self.ctrl_frames.insert(0, lambda: encode_frame(
+                        0, b"U", 0, value, TIME.pack(t1, received, self.clock())))
+                    self.wake.notify()
+                return
+            ch = self.open(cid)
+            if kind == b"G":
+                if epoch == ch.tx_epoch and ahead(value, ch.peer_limit):
+                    ch.peer_limit = value
+                    self.wake.notify()
+            elif kind == b"D":
+                if epoch != ch.rx_epoch:
+                    ch.rx_epoch, ch.rx_offset = epoch, value   # Sender (re)started this stream
+                    ch.rx.clear()
+                gap = (value - ch.rx_offset) % MOD
+                if gap >= MOD // 2:
+                    return  # Older than what we already have
+                ch.stats["lost_bytes"] += gap
+                ch.stats["rx_bytes"] += len(payload)
+                ch.rx_offset = (value + len(payload)) % MOD
+                if ch.on_data or ch.on_line:
+                    deliver = ch
+                else:
+                    ch.rx += payload
+                    ch.cond.notify_all()
+                self._maybe_grant(ch)
+        if deliver:
+            deliver._deliver(payload)
+
+    def _on_hello(self, session):
+        if session == self.peer_session:
+            return
+        restarted = self.peer_session is not None
+        self.peer_session = session
+        # The peer's stream state is new: restart our offsets towards it and
+        # forget its old ones
+        for ch in self.channels.values():
+            ch.reset_tx()
+            ch.rx_epoch = None
+            ch.granted = ch.window
+        self.ctrl_frames.append(encode_frame(0, b"H", 0, self.session))
+        self.wake.notify()
+        if restarted:
+            print("UART mux: peer restarted, channel streams reset")
+
+    def _maybe_grant(self, ch):
+        """Sends more credit once a quarter of the window has been consumed."""
+        if ch.rx_epoch is None:
+            return
+        limit = (ch.consumed() + ch.window) % MOD
+        if (limit - ch.granted) % MOD >= ch.window // 4 and ahead(limit, ch.granted):
+            ch.granted = limit
+            self.ctrl_frames.append(encode_frame(ch.cid, b"G", ch.rx_epoch, limit))
+            self.wake.notify()
+
+    # --- SENDING ---
+    def _next_frame(self):
+        now = time.monotonic()
+        if now - self.last_refresh >= REFRESH_INTERVAL:
+            self.last_refresh = now
+            self.ctrl_frames.append(encode_frame(0, b"H", 0, self.session))
+            for ch in self.channels.values():
+                if ch.rx_epoch is not None:
+                    self.ctrl_frames.append(encode_frame(ch.cid, b"G", ch.rx_epoch, ch.granted))
+        if self.ctrl_frames:
+            return self.ctrl_frames.pop(0)
+
+        # Interactive channels first, in channel order
+        chans = sorted(self.channels.values(), key=lambda c: c.cid)
+        for ch in chans:
+            if ch.interactive and ch.chunk_len():
+                return ch.take_frame(ch.chunk_len())
+
+        # Then deficit round robin over the rest, by weight
+        active = [ch for ch in chans if not ch.interactive and ch.chunk_len()]
+        if not active:
+            return None
+        for _ in range(2 * len(active) + 1):
+            ch = active[self.rr % len(active)]
+            n = ch.chunk_len()
+            if ch.deficit >= n:
+                ch.deficit -= n
+                return ch.take_frame(n)
+            ch.deficit += ch.weight * QUANTUM
+            self.rr += 1
+        return None
+
+    def _writer(self):
+        byte_time = 10 / self.baud
+        while True:
+            with self.lock:
+                frame = None
+                while self.running:
+                    if self.transport is not None:
+                        # Choose the next frame only once the driver queue is short,
+                        # so a command typed meanwhile still gets to go first
+                        waiting = getattr(self.transport, "out_waiting", 0)
+                        if waiting > LOW_WATER:
+                            self.lock.release()
+                            time.sleep(max(0.0005, (waiting - LOW_WATER) * byte_time))
+                            self.lock.acquire()
+                            continue
+                        frame = self._next_frame()
+                        if frame:
+                            break
+                    self.wake.wait(REFRESH_INTERVAL / 2)
+                if not self.running:
+                    return
+                transport = self.transport
+            if callable(frame):
+                # Timed frame: wait until nothing is ahead of it in the driver, then stamp it
+                deadline = time.monotonic() + 0.05
+                while getattr(transport, "out_waiting", 0) and time.monotonic() < deadline:
+                    time.sleep(byte_time)
+                frame = frame()
+            try:
+                transport.write(frame)
+                self.stats["frames_out"] += 1
+            except Exception as e:
+                print(f"UART mux write error: {e}")
+                self.detach()
+
+
+class ChannelServer:
+    """Lets other local programs (e.g. the chat scripts) use a channel over TCP.
+
+    Client: connect to localhost:MUX_PORT, send "OPEN <channel id or name>\\n",
+    then read/write raw bytes. One client per channel; a new one replaces it.
+    """
+
+    def __init__(self, mux, port=MUX_PORT):
+        self.mux = mux
+        self.port = port
+        self.clients = {}   # channel id -> socket
+
+    def start(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(("127.0.0.1", self.port))
+        srv.listen()
+        threading.Thread(target=self._accept, args=(srv,), daemon=True).start()
+        return self
+
+    def _accept(self, srv):
+        while True:
+            sock, _ = srv.accept()
+            threading.Thread(target=self._client, args=(sock,), daemon=True).start()
+
+    def _client(self, sock):
+        f = sock.makefile("rb")
+        words = f.readline().decode(errors="replace").split()
+        try:
+            ch = self.mux.open(int(words[1]) if words[1].isdigit() else words[1])
+        except (IndexError, KeyError):
+            sock.sendall(b"ERROR: OPEN <channel>\n")
+            sock.close()
+            return
+        old = self.clients.get(ch.cid)
+        if old:
+            old.close()
+        self.clients[ch.cid] = sock
+        threading.Thread(target=self._to_client, args=(ch, sock), daemon=True).start()
+        try:
+            while True:
+                data = f.read1(4096)
+                if not data:
+                    break
+                ch.write(data)   # Blocks on the channel's credit: back-pressure to the client
+        except OSError:
+            pass
+        finally:
+            if self.clients.get(ch.cid) is sock:
+                del self.clients[ch.cid]
+            sock.close()
+
+    def _to_client(self, ch, sock):
+        while self.clients.get(ch.cid) is sock:
+            data = ch.read(timeout=0.5)   # Credit is only returned as the client takes data
+            if data:
+                try:
+                    sock.sendall(data)
+                except OSError:
+                    return
+
+
+# --- DEMO ---
+class SimPort:
+    """One end of a simulated UART: bytes reach the peer at baud/10 per second,
+    with a 4 KB driver buffer like a real tty."""
+
+    def __init__(self, baud, deliver, buffer=4096):
+        self.baud = baud
+        self.deliver = deliver
+        self.buffer = buffer
+        self.queue = bytearray()
+        self.cond = threading.Condition()
+        threading.Thread(target=self._wire, daemon=True).start()
+
+    @property
+    def out_waiting(self):
+        return len(self.queue)
+
+    def write(self, data):
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.queue) + len(data) <= self.buffer)
+            self.queue += data
+            self.cond.notify_all()
+
+    def _wire(self):
+        t = time.monotonic()
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue)
+                t = max(t, time.monotonic())
+            time.sleep(0.001)
+            now = time.monotonic()
+            with self.cond:
+                n = min(len(self.queue), max(1, int((now - t) * self.baud / 10)))
+                data = bytes(self.queue[:n])
+                del self.queue[:n]
+                t += n * 10 / self.baud
+                self.cond.notify_all()
+            self.deliver(data)
+
+
+def demo_case(mode, baud, seconds):
+    """Pings the chat channel every 50 ms while bulk data saturates the link."""
+    latencies = []
+    bulk_bytes = [0]
+    stop = threading.Event()
+
+    if mode == "plain FIFO":
+        buf = bytearray()
+        lock = threading.Lock()   # Whole lines, like uart_lock in main_listener.py
+
+        def rx(data):
+            buf.extend(data)
+            while b"\n" in buf:
+                i = buf.index(b"\n")
+                line = bytes(buf[:i])
+                del buf[:i + 1]
+                if line.startswith(b"PING:"):
+                    latencies.append(time.monotonic() - float(line[5:]))
+                else:
+                    bulk_bytes[0] += i + 1
+        port = SimPort(baud, rx)
+
+        def send_bulk():
+            while not stop.is_set():
+                with lock:
+                    port.write(b"R" * (MAX_PAYLOAD - 1) + b"\n")
+
+        def send_ping(msg):
+            with lock:
+                port.write(msg)
+    else:
+        side_b = Mux(baud)
+        side_a = Mux(baud)
+        side_b.attach(SimPort(baud, side_a.feed))
+        side_a.attach(SimPort(baud, side_b.feed))
+        side_b.open(BULK).on_data = lambda d: bulk_bytes.__setitem__(0, bulk_bytes[0] + len(d))
+        side_b.open(CHAT).on_line = lambda line: latencies.append(time.monotonic() - float(line[5:]))
+        bulk, chat = side_a.open(BULK), side_a.open(CHAT)
+
+        def send_bulk():
+            while not stop.is_set():
+                bulk.write(b"R" * (MAX_PAYLOAD - 1) + b"\n", timeout=0.1)
+
+        def send_ping(msg):
+            chat.write(msg)
+
+    threading.Thread(target=send_bulk, daemon=True).start()
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < seconds:
+        send_ping(f"PING:{time.monotonic():.6f}\n".encode())
+        time.sleep(0.05)
+    stop.set()
+    rate = bulk_bytes[0] / (time.monotonic() - t0)
+    time.sleep(0.5)
+    ms = sorted(1000 * x for x in latencies)
+    if len(ms) < 2:
+        print(f"  {mode:10}: too few pings arrived")
+        return
+    q = statistics.quantiles(ms, n=100, method="inclusive")
+    print(f"  {mode:10}: chat latency p50 {q[49]:6.1f} ms  p99 {q[98]:6.1f} ms  max {ms[-1]:6.1f} ms | "
+          f"bulk {rate / 1e3:5.1f} kB/s ({100 * rate / (baud / 10):.0f}% of line rate)")
+
+
+def run_demo(baud=115200, seconds=4.0):
+    print(f"Chat pings every 50 ms while a bulk transfer saturates a simulated {baud} baud UART")
+    for mode in ("plain FIFO", "uart_mux"):
+        demo_case(mode, baud, seconds)
+
+
+if __name__ == '__main__':
+    if '--demo' in sys.argv:
+        run_demo()
+    else:
+        print(__doc__)